@@ -1,13 +1,19 @@
 from __future__ import annotations
 import json
 import os
-import fastavro
 from glob import glob
-from typing import Iterable, Mapping, Optional, cast, MutableMapping, Union
+from typing import Any, Iterable, Mapping, Optional, cast, MutableMapping, Union
 import io
 import json
 
 
+def _fastavro() -> Any:
+    # fastavro is only imported once schemas or records are processed
+    import fastavro
+
+    return fastavro
+
+
 class AvroHandler:
     def __init__(self, path: Optional[str] = None, pattern: str = "*.avsc"):
         self._schemas: MutableMapping = {}
@@ -21,11 +27,11 @@ class AvroHandler:
             # schemas are indexed by lowercase basename
             self._schemas[
                 os.path.splitext(os.path.basename(p))[0].lower()
-            ] = fastavro.parse_schema(s)
+            ] = _fastavro().parse_schema(s)
 
     @staticmethod
     def _reader(file_like: Union[io.BytesIO, io.BufferedReader]) -> Iterable[Mapping]:
-        return fastavro.reader(file_like)
+        return _fastavro().reader(file_like)
 
     @staticmethod
     def _writer(
@@ -34,14 +40,18 @@ class AvroHandler:
         records: Iterable[Mapping],
         codec: str = "null",
     ):
-        return fastavro.writer(file_like, schema=schema, records=records, codec=codec)
+        return _fastavro().writer(
+            file_like, schema=schema, records=records, codec=codec
+        )
 
     @property
     def schemas(self) -> Mapping:
         return self._schemas
 
     @staticmethod
-    def avro_stream_to_native(content: io.BytesIO) -> Iterable[Mapping]:
+    def avro_stream_to_native(
+        content: Union[io.BytesIO, io.BufferedReader]
+    ) -> Iterable[Mapping]:
         return AvroHandler._reader(content)
 
     @staticmethod
@@ -1,5 +1,22 @@
 from avro import __version__
+import os
+import subprocess
+import sys
 
 
 def test_version():
     assert __version__ == '0.1.0'
+
+
+def test_import_defers_fastavro():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import avro"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    )
+    # -X importtime lines end with the module name
+    timed = {line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines()}
+    assert "avro.avro" in timed
+    assert "fastavro" not in timed
@@ -1,4 +1,35 @@
+from typing import TYPE_CHECKING
+
 from .bq import BQHandler
+from .cache import MetadataCache
+from .query import QueryCache, QueryEstimate
+from .write import RowEncoder, StreamWriter
+from .jobs import JobOrchestrator, JobResult
+
+if TYPE_CHECKING:
+    from .clients import get_client, clear_clients
 
 __version__ = "0.1.0"
-__all__ = ["BQHandler"]
+__all__ = [
+    "BQHandler",
+    "JobOrchestrator",
+    "JobResult",
+    "MetadataCache",
+    "QueryCache",
+    "QueryEstimate",
+    "RowEncoder",
+    "StreamWriter",
+    "get_client",
+    "clear_clients",
+]
+
+# the client registry imports the client library, so it is loaded on first use
+_LAZY_EXPORTS = {"get_client": ".clients", "clear_clients": ".clients"}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_EXPORTS:
+        from importlib import import_module
+
+        return getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,36 +1,73 @@
 from __future__ import annotations
-from google.cloud import bigquery  # type: ignore
-from typing import Iterable, Mapping, Optional, Union, Type
-from google.auth import credentials, default, exceptions as auth_exceptions  # type: ignore
-from google.api_core.client_options import ClientOptions  # type: ignore
-import requests.exceptions as requests_exceptions
-from ratelimiter import RateLimiter
-from retry import SimpleRetrier, backoff_hdlr, expo, full_jitter
+from functools import lru_cache
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    Type,
+)
+from ratelimiter import AdaptiveRateLimiter, RateLimiterRegistry, make_ratelimiter
+from retry import (
+    RetryPolicy,
+    ClassDefault,
+    default_backoff_params,
+    with_handlers,
+    feedback_handlers,
+    get_circuit_breaker,
+)
+from datetime import datetime
+import copy
 import logging
 from types import TracebackType
 from traceback import print_exception
-from google.api_core import exceptions
-import re
+from .cache import MetadataCache, compiled
+from .query import QueryCache, QueryEstimate, query_parameters
+from .read import iter_parallel
+from .write import StreamWriter
+
+if TYPE_CHECKING:
+    from google.auth import credentials  # type: ignore
+    from google.cloud import bigquery  # type: ignore
 
 
 _RETRYABLE_REASONS = frozenset(
     ["rateLimitExceeded", "backendError", "internalError", "badGateway"]
 )
 
-_UNSTRUCTURED_RETRYABLE_TYPES = (
-    ConnectionError,
-    exceptions.TooManyRequests,
-    exceptions.InternalServerError,
-    exceptions.BadGateway,
-    requests_exceptions.ChunkedEncodingError,
-    requests_exceptions.ConnectionError,
-    requests_exceptions.Timeout,
-    auth_exceptions.TransportError,
-)
+
+@lru_cache(maxsize=None)
+def _unstructured_retryable_types() -> Tuple[Type[BaseException], ...]:
+    # the client libraries are only imported once errors have to be classified
+    from google.api_core import exceptions
+    from google.auth import exceptions as auth_exceptions  # type: ignore
+    import requests.exceptions as requests_exceptions
+
+    return (
+        ConnectionError,
+        exceptions.TooManyRequests,
+        exceptions.InternalServerError,
+        exceptions.BadGateway,
+        requests_exceptions.ChunkedEncodingError,
+        requests_exceptions.ConnectionError,
+        requests_exceptions.Timeout,
+        auth_exceptions.TransportError,
+    )
+
 
 logger = logging.getLogger(__name__)
 
 
+_DEFAULT_API_ENDPOINT = "https://bigquery.googleapis.com"
+
+
 def _should_retry(exc):
     """Predicate for determining when to retry.
 
@@ -39,22 +76,28 @@ def _should_retry(exc):
     """
     if not hasattr(exc, "errors") or len(exc.errors) == 0:
         # Check for unstructured error returns, e.g. from GFE
-        return isinstance(exc, _UNSTRUCTURED_RETRYABLE_TYPES)
+        return isinstance(exc, _unstructured_retryable_types())
 
     reason = exc.errors[0]["reason"]
     return reason in _RETRYABLE_REASONS
 
 
+def _is_throttled(exc):
+    """Predicate for determining whether a retried error is a 429 or has
+    'rateLimitExceeded' as its reason.
+    """
+    from google.api_core import exceptions
+
+    if not hasattr(exc, "errors") or len(exc.errors) == 0:
+        return isinstance(exc, exceptions.TooManyRequests)
+
+    return exc.errors[0]["reason"] == "rateLimitExceeded"
+
+
 class BQHandler:
-    _default_backoff_params = {
-        "kind": "on_predicate",
-        "wait_gen": expo,
-        "predicate": _should_retry,
-        "on_backoff": backoff_hdlr,
-        "max_tries": 8,
-        "jitter": full_jitter,
-        "max_time": 600,
-    }
+    _default_backoff_params = ClassDefault(
+        partial(default_backoff_params, _should_retry)
+    )
     _default_ratelimit_params = {"calls": 15, "period": 900}
 
     def __init__(
@@ -73,18 +116,86 @@ class BQHandler:
         use_ratelimit = kwargs.pop("use_ratelimit", False)
         self._ratelimit_params = kwargs.pop("ratelimit_params", None)
         self._ratelimiter = None
+        self._ratelimit_costs: Mapping[str, int] = {}
         if use_ratelimit or self._ratelimit_params:
             self._ratelimit_params = (
                 self._ratelimit_params or self._default_ratelimit_params
             )
-            self._ratelimiter = RateLimiter(**self._ratelimit_params)
+            self._ratelimiter = self._make_ratelimiter(self._ratelimit_params)
+        self._circuit_breaker = None
+        if self._backoff_params and self._backoff_params.get("circuit_breaker"):
+            self._circuit_breaker = self._backoff_params["circuit_breaker"]
+            if self._circuit_breaker is True:
+                # one breaker per endpoint shared by all handlers in the process
+                self._circuit_breaker = get_circuit_breaker(
+                    api_endpoint or _DEFAULT_API_ENDPOINT
+                )
+                self._backoff_params = {
+                    **self._backoff_params,
+                    "circuit_breaker": self._circuit_breaker,
+                }
+        if isinstance(self._ratelimiter, AdaptiveRateLimiter) and self._backoff_params:
+            # retry outcomes drive the adaptive rate
+            self._backoff_params = with_handlers(
+                self._backoff_params,
+                **feedback_handlers(
+                    self._ratelimiter.record_success,
+                    self._ratelimiter.record_throttle,
+                    _is_throttled,
+                ),
+            )
+        # retry policies are built once and shared by all calls
+        self._retry_policy = (
+            RetryPolicy(**self._backoff_params) if self._backoff_params else None
+        )
+
+        from .clients import DEFAULT_POOL_SIZE, get_client
+
+        # handlers asking for it share pooled clients of the process
+        if kwargs.pop("shared_client", False):
+            self._client = get_client(
+                project,
+                credentials,
+                api_endpoint,
+                kwargs.pop("pool_size", DEFAULT_POOL_SIZE),
+            )
+        else:
+            from google.api_core.client_options import ClientOptions  # type: ignore
+            from google.auth import default  # type: ignore
+            from google.cloud import bigquery  # type: ignore
+
+            options = ClientOptions(api_endpoint=api_endpoint) if api_endpoint else None
+            if options and not credentials:
+                credentials, _ = default()
+            self._client = bigquery.Client(
+                project=project, credentials=credentials, client_options=options
+            )
+        # Storage API clients resolve default credentials themselves
+        self._credentials = credentials
 
-        options = ClientOptions(api_endpoint=api_endpoint) if api_endpoint else None
-        if options and not credentials:
-            credentials, _ = default()
-        self._client = bigquery.Client(
-            project=project, credentials=credentials, client_options=options
+        self._cache_params = kwargs.pop("cache_params", None)
+        self._cache = (
+            MetadataCache(**self._cache_params)
+            if self._cache_params is not None
+            else None
         )
+        # e.g. a client of a local emulator, built from the handler otherwise
+        self._read_client = kwargs.pop("read_client", None)
+        self._write_client = kwargs.pop("write_client", None)
+        self._query_cache_params = kwargs.pop("query_cache_params", None)
+        self._query_cache = (
+            QueryCache(**self._query_cache_params)
+            if self._query_cache_params is not None
+            else None
+        )
+
+    @property
+    def cache(self) -> Optional[MetadataCache]:
+        return self._cache
+
+    @property
+    def query_cache(self) -> Optional[QueryCache]:
+        return self._query_cache
 
     @property
     def ratelimit_params(self) -> Mapping:
@@ -94,6 +205,30 @@ class BQHandler:
     def backoff_params(self) -> Mapping:
         return self._backoff_params
 
+    def _make_ratelimiter(self, params: Mapping):
+        # costs and per_method are consumed here, everything else is passed on
+        params = dict(params)
+        self._ratelimit_costs = params.pop("costs", {})
+        per_method = params.pop("per_method", None)
+        if per_method:
+            return RateLimiterRegistry(
+                overrides=per_method if isinstance(per_method, Mapping) else None,
+                **params,
+            )
+        return make_ratelimiter(**params)
+
+    def _limit(self, method: str):
+        if self._circuit_breaker:
+            # fail before waiting for the ratelimiter while the circuit is open
+            self._circuit_breaker.check()
+        if not self._ratelimiter:
+            return
+        cost = self._ratelimit_costs.get(method, 1)
+        if isinstance(self._ratelimiter, RateLimiterRegistry):
+            self._ratelimiter.limit(method, cost)
+        else:
+            self._ratelimiter.limit(cost)
+
     def __enter__(self) -> BQHandler:
         return self
 
@@ -113,10 +248,14 @@ class BQHandler:
 
     @staticmethod
     def generate_load_job_config(**kwargs) -> bigquery.LoadJobConfig:
+        from google.cloud import bigquery  # type: ignore
+
         return bigquery.LoadJobConfig(**kwargs)
 
     @staticmethod
     def generate_extract_job_config(**kwargs) -> bigquery.ExtractJobConfig:
+        from google.cloud import bigquery  # type: ignore
+
         return bigquery.ExtractJobConfig(**kwargs)
 
     @staticmethod
@@ -127,40 +266,72 @@ class BQHandler:
     def generate_table_id(project: str, dataset_id: str, table_name: str) -> str:
         return f"{project}.{dataset_id}.{table_name}"
 
+    def _table_reference(
+        self, table: Union[str, bigquery.TableReference, bigquery.Table]
+    ) -> bigquery.TableReference:
+        from google.cloud.bigquery import TableReference  # type: ignore
+
+        if isinstance(table, str):
+            return TableReference.from_string(
+                table, default_project=self._client.project
+            )
+        if isinstance(table, TableReference):
+            return table
+        return table.reference
+
+    def invalidate_table(
+        self, table: Union[str, bigquery.TableReference, bigquery.Table]
+    ):
+        """Drops a table and the listing of its dataset from the cache."""
+        if self._cache:
+            ref = self._table_reference(table)
+            self._cache.invalidate_table(
+                f"{ref.project}.{ref.dataset_id}.{ref.table_id}",
+                f"{ref.project}.{ref.dataset_id}",
+            )
+
     def start_load_job(
         self, uri: str, table_id: str, job_config: Optional[bigquery.LoadJobConfig]
     ) -> bigquery.LoadJob:
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
+        self.invalidate_table(table_id)
+        self._limit("start_load_job")
         return self._client.load_table_from_uri(
             uri,
             table_id,
             job_config=job_config,
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None,
+            retry=self._retry_policy,  # type: ignore
         )
 
     def wait_for_job_completion(
         self, job: bigquery.LoadJob, timeout: Optional[float] = None
     ):
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
+        self._limit("wait_for_job_completion")
         job.result(
             timeout=timeout,
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None,
+            retry=self._retry_policy,  # type: ignore
         )
+        # metadata read while the job ran may already be stale
+        if getattr(job, "destination", None):
+            self.invalidate_table(job.destination)
 
     def get_table(self, table_id: str) -> bigquery.Table:
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
+        if self._cache:
+            ref = self._table_reference(table_id)
+            key = f"{ref.project}.{ref.dataset_id}.{ref.table_id}"
+            table = self._cache.get_table(key)
+            if table is None:
+                self._limit("get_table")
+                table = self._client.get_table(
+                    ref,
+                    retry=self._retry_policy,  # type: ignore
+                )
+                self._cache.put_table(key, table)
+            # callers may modify their table, e.g. to update it
+            return copy.deepcopy(table)
+        self._limit("get_table")
         return self._client.get_table(
             table_id,
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None,
+            retry=self._retry_policy,  # type: ignore
         )
 
     def extract_table(
@@ -170,16 +341,28 @@ class BQHandler:
         location: str,
         job_config: bigquery.ExtractJobConfig,
     ) -> bigquery.ExtractJob:
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
+        self._limit("extract_table")
         return self._client.extract_table(
             table_ref,
             destination_uri,
             location=location,
             job_config=job_config,
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None,
+            retry=self._retry_policy,  # type: ignore
+        )
+
+    def copy_table(
+        self,
+        sources: Union[str, Sequence[str]],
+        destination: str,
+        job_config: Optional[bigquery.CopyJobConfig] = None,
+    ) -> bigquery.CopyJob:
+        self.invalidate_table(destination)
+        self._limit("copy_table")
+        return self._client.copy_table(
+            sources,
+            destination,
+            job_config=job_config,
+            retry=self._retry_policy,  # type: ignore
         )
 
     def get_job(
@@ -191,14 +374,11 @@ class BQHandler:
         bigquery.ExtractJob,
         bigquery.UnknownJob,
     ]:
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
+        self._limit("get_job")
         return self._client.get_job(
             job_id,
             location,
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None,
+            retry=self._retry_policy,  # type: ignore
         )
 
     def cancel_job(
@@ -209,48 +389,278 @@ class BQHandler:
         bigquery.QueryJob,
         bigquery.ExtractJob,
     ]:
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
+        self._limit("cancel_job")
         return self._client.cancel_job(
             job_id,
             location,
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None,
+            retry=self._retry_policy,  # type: ignore
+        )
+
+    def list_jobs(
+        self,
+        state_filter: Optional[str] = None,
+        min_creation_time: Optional[datetime] = None,
+    ) -> Iterable:
+        self._limit("list_jobs")
+        return self._client.list_jobs(
+            state_filter=state_filter,
+            min_creation_time=min_creation_time,
+            retry=self._retry_policy,  # type: ignore
         )
 
     def list_datasets(self) -> Iterable:
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
-        return self._client.list_datasets(
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None
+        self._limit("list_datasets")
+        return self._client.list_datasets(retry=self._retry_policy)  # type: ignore
+
+    def _dataset_key(self, dataset_id: str) -> str:
+        from google.cloud.bigquery import DatasetReference  # type: ignore
+
+        ref = DatasetReference.from_string(
+            dataset_id, default_project=self._client.project
         )
+        return f"{ref.project}.{ref.dataset_id}"
+
+    def _cached_tables(self, dataset_id: str) -> List[Any]:
+        # the listing is shared with the cache
+        assert self._cache
+        key = self._dataset_key(dataset_id)
+        tables = self._cache.get_tables(key)
+        if tables is None:
+            self._limit("list_tables")
+            tables = list(
+                self._client.list_tables(
+                    dataset_id,
+                    retry=self._retry_policy,  # type: ignore
+                )
+            )
+            self._cache.put_tables(key, tables)
+        return tables
 
     def list_tables(self, dataset_id: str) -> Iterable:
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
+        """Lists the tables of a dataset.
+
+        With a cache, the table list items are shared and must not be modified.
+        """
+        if self._cache:
+            return list(self._cached_tables(dataset_id))
+        self._limit("list_tables")
         return self._client.list_tables(
             dataset_id,
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None,
+            retry=self._retry_policy,  # type: ignore
         )
 
     def delete_table(self, table_id: str, not_found_ok: bool = False):
-        if self._ratelimit_params:
-            self._ratelimiter.limit()  # type:ignore
+        self._limit("delete_table")
         self._client.delete_table(
             table_id,
-            retry=SimpleRetrier(**self._backoff_params)  # type: ignore
-            if self._backoff_params
-            else None,
+            retry=self._retry_policy,  # type: ignore
             not_found_ok=not_found_ok,
         )
+        self.invalidate_table(table_id)
 
     def list_tables_matching_regex(self, dataset_id: str, pattern: str) -> Iterable:
+        if self._cache:
+            key = self._dataset_key(dataset_id)
+            tables = self._cached_tables(dataset_id)
+            return iter(self._cache.match_tables(key, pattern, tables))
+        regex = compiled(pattern)
         return filter(
-            lambda table: re.match(pattern, table.table_id) is not None,
+            lambda table: regex.match(table.table_id) is not None,
             self.list_tables(dataset_id),
         )
+
+    def _get_read_client(self):
+        if self._read_client is None:
+            from google.cloud import bigquery_storage_v1  # type: ignore
+
+            self._read_client = bigquery_storage_v1.BigQueryReadClient(
+                credentials=self._credentials
+            )
+        return self._read_client
+
+    def read_table_stream(
+        self,
+        table_id: str,
+        selected_fields: Optional[Sequence[str]] = None,
+        row_restriction: Optional[str] = None,
+        data_format: str = "arrow",
+        max_streams: int = 0,
+        max_workers: int = 8,
+        queue_size: int = 16,
+    ) -> Iterator[Any]:
+        """Reads a table through the BigQuery Storage Read API.
+
+        The session reads the `selected_fields` of the rows which satisfy
+        `row_restriction` from up to `max_streams` streams, 0 leaves the count
+        to the server. Streams are read in parallel and their batches are
+        yielded as they arrive: `pyarrow.RecordBatch` objects for arrow and
+        lists of rows for avro. Requires the `storage` extra.
+        """
+        assert data_format in ("arrow", "avro"), "data_format is arrow or avro"
+        from google.cloud.bigquery_storage_v1 import types  # type: ignore
+
+        ref = self._table_reference(table_id)
+        client = self._get_read_client()
+        self._limit("create_read_session")
+        session = client.create_read_session(
+            parent=f"projects/{self._client.project}",
+            read_session=types.ReadSession(
+                table=(
+                    f"projects/{ref.project}/datasets/{ref.dataset_id}"
+                    f"/tables/{ref.table_id}"
+                ),
+                data_format=getattr(types.DataFormat, data_format.upper()),
+                read_options=types.ReadSession.TableReadOptions(
+                    selected_fields=list(selected_fields or ()),
+                    row_restriction=row_restriction or "",
+                ),
+            ),
+            max_stream_count=max_streams,
+            retry=self._retry_policy,
+        )
+
+        def read_stream(name: str) -> Iterator[Any]:
+            self._limit("read_rows")
+            # the reader resumes from its offset after retryable errors
+            reader = client.read_rows(name, retry=self._retry_policy)
+            for page in reader.rows(session).pages:
+                yield page.to_arrow() if data_format == "arrow" else list(page)
+
+        return iter_parallel(
+            [partial(read_stream, stream.name) for stream in session.streams],
+            max_workers,
+            queue_size,
+        )
+
+    def _get_write_client(self):
+        if self._write_client is None:
+            from google.cloud import bigquery_storage_v1  # type: ignore
+
+            self._write_client = bigquery_storage_v1.BigQueryWriteClient(
+                credentials=self._credentials
+            )
+        return self._write_client
+
+    def open_writer(self, table_id: str, **kwargs) -> StreamWriter:
+        """Returns a buffered writer appending to a table, see `StreamWriter`.
+
+        Requires the `storage` extra.
+        """
+        return StreamWriter(self, table_id, **kwargs)
+
+    @staticmethod
+    def _query_job_config(
+        params: Optional[Mapping[str, Any]],
+        job_config: Optional[bigquery.QueryJobConfig],
+        **properties,
+    ) -> bigquery.QueryJobConfig:
+        from google.cloud.bigquery import QueryJobConfig  # type: ignore
+
+        # the caller's config is copied, not modified
+        config = copy.deepcopy(job_config) if job_config else QueryJobConfig()
+        if params:
+            config.query_parameters = query_parameters(params)
+        for name, value in properties.items():
+            setattr(config, name, value)
+        return config
+
+    def estimate_query(
+        self,
+        query: str,
+        params: Optional[Mapping[str, Any]] = None,
+        job_config: Optional[bigquery.QueryJobConfig] = None,
+        location: Optional[str] = None,
+    ) -> QueryEstimate:
+        """Dry-runs a query, which returns the bytes it would process for free."""
+        self._limit("query")
+        job = self._client.query(
+            query,
+            job_config=self._query_job_config(
+                params, job_config, dry_run=True, use_query_cache=False
+            ),
+            location=location,
+            retry=self._retry_policy,  # type: ignore
+        )
+        return QueryEstimate(
+            job.total_bytes_processed or 0,
+            [
+                f"{table.project}.{table.dataset_id}.{table.table_id}"
+                for table in job.referenced_tables
+            ],
+        )
+
+    def _table_modified(self, table_id: str) -> Optional[datetime]:
+        # the metadata cache may serve a table from before its last write
+        self._limit("get_table")
+        return self._client.get_table(
+            table_id,
+            retry=self._retry_policy,  # type: ignore
+        ).modified
+
+    def query(
+        self,
+        query: str,
+        params: Optional[Mapping[str, Any]] = None,
+        data_format: str = "arrow",
+        page_size: Optional[int] = None,
+        prefetch: int = 2,
+        job_config: Optional[bigquery.QueryJobConfig] = None,
+        location: Optional[str] = None,
+    ) -> Iterator[Any]:
+        """Runs a query with named `params` and yields its results in batches.
+
+        Batches are `pyarrow.RecordBatch` objects for arrow and mappings of
+        column names to NumPy arrays for numpy. Up to `prefetch` batches of
+        `page_size` rows are read ahead in the background. Results are read
+        through the Storage Read API if it is installed. With a query cache,
+        a dry run first resolves the tables the query references. Requires
+        the `storage` extra.
+        """
+        assert data_format in ("arrow", "numpy"), "data_format is arrow or numpy"
+        key = None
+        if self._query_cache:
+            tables = self.estimate_query(
+                query, params, job_config, location
+            ).referenced_tables
+            key = self._query_cache.key(
+                query,
+                params,
+                data_format,
+                [(table, self._table_modified(table)) for table in tables],
+            )
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                return iter(cached)
+
+        self._limit("query")
+        job = self._client.query(
+            query,
+            job_config=self._query_job_config(params, job_config),
+            location=location,
+            retry=self._retry_policy,  # type: ignore
+        )
+        try:
+            read_client = self._get_read_client()
+        except ImportError:
+            read_client = None
+        rows = job.result(
+            page_size=page_size,
+            retry=self._retry_policy,  # type: ignore
+        )
+
+        def read_batches() -> Iterator[Any]:
+            for batch in rows.to_arrow_iterable(
+                bqstorage_client=read_client, max_queue_size=prefetch
+            ):
+                if data_format == "arrow":
+                    yield batch
+                else:
+                    yield {
+                        name: column.to_numpy(zero_copy_only=False)
+                        for name, column in zip(batch.schema.names, batch.columns)
+                    }
+
+        batches = iter_parallel([read_batches], 1, prefetch)
+        if self._query_cache and key:
+            return self._query_cache.tee(key, batches)
+        return batches
@@ -0,0 +1,139 @@
+import re
+import time
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Pattern, Sequence
+
+
+@lru_cache(maxsize=256)
+def compiled(pattern: str) -> Pattern:
+    return re.compile(pattern)
+
+
+class _TableEntry(NamedTuple):
+    table: Any
+    ttl: float
+    expires: float
+
+
+class _Listing(NamedTuple):
+    tables: List[Any]
+    expires: float
+    matches: Dict[str, List[Any]]  # table list items by pattern
+
+
+class MetadataCache:
+    """In-memory cache of table metadata and dataset listings.
+
+    Tables expire after `ttl` seconds. An expired table is refetched, and if
+    its etag and modification time did not change, its TTL doubles, up to
+    `max_ttl`. A changed table starts again at `ttl`. Dataset listings expire
+    after `listing_ttl` and memoize the tables matched by each pattern.
+    At most `max_tables` tables are kept, the oldest entries are dropped first.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        max_ttl: Optional[float] = None,
+        listing_ttl: Optional[float] = None,
+        max_tables: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        assert ttl >= 0 and max_tables > 0
+        self._ttl = ttl
+        self._max_ttl = max(max_ttl or ttl, ttl)
+        self._listing_ttl = ttl if listing_ttl is None else listing_ttl
+        self._max_tables = max_tables
+        self._clock = clock
+        self._lock = Lock()
+        self._tables: Dict[str, _TableEntry] = {}
+        self._listings: Dict[str, _Listing] = {}
+        self._hits = 0
+        self._misses = 0
+        self._revalidations = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def revalidations(self) -> int:
+        """Number of refetched tables which turned out to be unchanged."""
+        return self._revalidations
+
+    def get_table(self, table_id: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._tables.get(table_id)
+            if entry and entry.expires > self._clock():
+                self._hits += 1
+                return entry.table
+            self._misses += 1
+            return None
+
+    def put_table(self, table_id: str, table: Any):
+        with self._lock:
+            # expired entries are kept until replaced to compare versions
+            entry = self._tables.pop(table_id, None)
+            ttl = self._ttl
+            if (
+                entry
+                and entry.table.etag == table.etag
+                and entry.table.modified == table.modified
+            ):
+                self._revalidations += 1
+                ttl = min(entry.ttl * 2, self._max_ttl)
+            self._tables[table_id] = _TableEntry(table, ttl, self._clock() + ttl)
+            while len(self._tables) > self._max_tables:
+                del self._tables[next(iter(self._tables))]
+
+    def get_tables(self, dataset_id: str) -> Optional[List[Any]]:
+        with self._lock:
+            listing = self._listings.get(dataset_id)
+            if listing and listing.expires > self._clock():
+                self._hits += 1
+                return listing.tables
+            self._misses += 1
+            return None
+
+    def put_tables(self, dataset_id: str, tables: List[Any]):
+        with self._lock:
+            self._listings[dataset_id] = _Listing(
+                tables, self._clock() + self._listing_ttl, {}
+            )
+
+    def match_tables(
+        self, dataset_id: str, pattern: str, tables: Sequence[Any]
+    ) -> List[Any]:
+        """Returns the `tables` whose id matches `pattern` from the start.
+
+        Matches are memoized while `tables` is the cached listing of the
+        dataset.
+        """
+        regex = compiled(pattern)
+        with self._lock:
+            listing = self._listings.get(dataset_id)
+            if listing and listing.tables is tables:
+                matches = listing.matches.get(pattern)
+                if matches is None:
+                    matches = listing.matches[pattern] = [
+                        table for table in tables if regex.match(table.table_id)
+                    ]
+                return matches
+        return [table for table in tables if regex.match(table.table_id)]
+
+    def invalidate_table(self, table_id: str, dataset_id: Optional[str] = None):
+        """Drops a table and, given its `dataset_id`, the dataset listing."""
+        with self._lock:
+            self._tables.pop(table_id, None)
+            if dataset_id:
+                self._listings.pop(dataset_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._listings.clear()
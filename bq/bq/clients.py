@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Sequence, Tuple
+
+from google.auth import credentials  # type: ignore
+from google.cloud import bigquery  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_CLIENTS = 32
+
+
+def _mount(session: Any, pool_size: int):
+    from requests.adapters import HTTPAdapter  # type: ignore
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def _mount_all(session: Any, pool_size: int):
+    _mount(session, pool_size)
+    # credentials are refreshed through a session of their own
+    auth_request = getattr(session, "_auth_request", None)
+    if auth_request is not None:
+        _mount(auth_request.session, pool_size)
+
+
+class ClientRegistry:
+    """Process-wide registry of Google Cloud clients on pooled HTTP sessions.
+
+    `factory(project, credentials, client_options, session)` builds a client
+    of the API authorized for `scopes`. Clients are kept per project,
+    endpoint, credentials and pool size, at most `max_clients` of them, the
+    least recently used client is dropped and its session closed first.
+    Default credentials are resolved once per registry. A forked child gets
+    empty connection pools, as pooled connections are shared with the parent.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str, Any, Any, Any], Any],
+        scopes: Sequence[str],
+        max_clients: int = DEFAULT_MAX_CLIENTS,
+    ):
+        assert max_clients > 0
+        self._factory = factory
+        self._scopes = scopes
+        self._max_clients = max_clients
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[Hashable, Tuple[Any, Any, int]]" = OrderedDict()
+        self._default_credentials: Optional[Any] = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork_in_child)
+
+    def _after_fork_in_child(self):
+        # a lock no other thread of the child can hold
+        self._lock = threading.Lock()
+        for _, session, pool_size in self._clients.values():
+            _mount_all(session, pool_size)
+
+    def get_client(
+        self,
+        project: str,
+        credentials: Optional[Any] = None,
+        api_endpoint: Optional[str] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+    ) -> Any:
+        """Returns the client of a project, endpoint and credentials.
+
+        Clients are built once with an HTTP session holding up to `pool_size`
+        connections per host.
+        """
+        # the registry holds the credentials, so their identity is not reused
+        key = (project, api_endpoint, credentials, pool_size)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry:
+                self._clients.move_to_end(key)
+                return entry[0]
+            from google.api_core.client_options import ClientOptions  # type: ignore
+            from google.auth import default  # type: ignore
+            from google.auth.credentials import with_scopes_if_required  # type: ignore
+            from google.auth.transport.requests import AuthorizedSession  # type: ignore
+
+            if not credentials:
+                if not self._default_credentials:
+                    self._default_credentials, _ = default(scopes=self._scopes)
+                credentials = self._default_credentials
+            logger.debug(f"creating client for {project}")
+            session = AuthorizedSession(
+                with_scopes_if_required(credentials, self._scopes)
+            )
+            _mount_all(session, pool_size)
+            options = ClientOptions(api_endpoint=api_endpoint) if api_endpoint else None
+            client = self._factory(project, credentials, options, session)
+            self._clients[key] = (client, session, pool_size)
+            while len(self._clients) > self._max_clients:
+                _, (_, evicted, _) = self._clients.popitem(last=False)
+                evicted.close()
+            return client
+
+    def clear(self):
+        """Closes and forgets all clients of the registry."""
+        with self._lock:
+            for _, session, _ in self._clients.values():
+                session.close()
+            self._clients.clear()
+
+
+def _make_client(project, credentials, client_options, session) -> bigquery.Client:
+    return bigquery.Client(
+        project=project,
+        credentials=credentials,
+        client_options=client_options,
+        _http=session,
+    )
+
+
+_registry = ClientRegistry(_make_client, bigquery.Client.SCOPE)
+
+
+def get_client(
+    project: str,
+    credentials: Optional[credentials.Credentials] = None,
+    api_endpoint: Optional[str] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+) -> bigquery.Client:
+    """Returns the process-wide client for a project, endpoint and credentials.
+
+    Clients are built once with an HTTP session holding up to `pool_size`
+    connections per host. Default credentials are resolved once per process.
+    """
+    return _registry.get_client(project, credentials, api_endpoint, pool_size)
+
+
+def clear_clients():
+    """Closes and forgets all clients of the registry."""
+    _registry.clear()
@@ -0,0 +1,345 @@
+from __future__ import annotations
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    CancelledError,
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError,
+    as_completed,
+    wait,
+)
+from contextvars import copy_context
+from functools import partial
+from traceback import print_exception
+from types import TracebackType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery  # type: ignore
+    from .bq import BQHandler
+
+
+logger = logging.getLogger(__name__)
+
+_DONE_STATE = "DONE"
+
+# HTTP status of the documented error reasons of jobs, others map to 500
+_ERROR_REASON_STATUS = {
+    "accessDenied": 403,
+    "billingNotEnabled": 403,
+    "billingTierLimitExceeded": 400,
+    "blocked": 403,
+    "duplicate": 409,
+    "invalid": 400,
+    "invalidQuery": 400,
+    "notFound": 404,
+    "notImplemented": 501,
+    "policyViolation": 403,
+    "quotaExceeded": 403,
+    "rateLimitExceeded": 403,
+    "resourceInUse": 400,
+    "resourcesExceeded": 400,
+    "responseTooLarge": 403,
+    "tableUnavailable": 400,
+}
+
+
+class JobResult(NamedTuple):
+    key: str
+    job: Optional[Any]  # None if the job could not be started
+    error: Optional[BaseException]
+
+
+def _job_error(job) -> Optional[BaseException]:
+    if not job.error_result:
+        return None
+    from google.api_core.exceptions import from_http_status
+
+    return from_http_status(
+        _ERROR_REASON_STATUS.get(job.error_result.get("reason"), 500),
+        job.error_result.get("message", ""),
+        errors=[job.error_result],
+    )
+
+
+class JobOrchestrator:
+    """Runs many load, extract and copy jobs of a `BQHandler` concurrently.
+
+    At most `max_concurrent_jobs` jobs run at a time, further jobs are queued
+    and started by `submit_workers` threads as running jobs finish. A single
+    background thread polls all running jobs, with one `get_job` per job
+    while at most `list_threshold` jobs run and otherwise with one listing of
+    the finished jobs. The poll interval grows by `poll_backoff` up to
+    `max_poll_interval` while no job finishes and is reset once one does.
+    """
+
+    def __init__(
+        self,
+        handler: BQHandler,
+        max_concurrent_jobs: int = 50,
+        submit_workers: int = 4,
+        poll_interval: float = 1.0,
+        max_poll_interval: float = 30.0,
+        poll_backoff: float = 1.5,
+        list_threshold: int = 10,
+    ):
+        assert max_concurrent_jobs > 0 and submit_workers > 0
+        assert 0 < poll_interval <= max_poll_interval and poll_backoff >= 1
+        self._handler = handler
+        self._max_concurrent_jobs = max_concurrent_jobs
+        self._poll_interval = poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._poll_backoff = poll_backoff
+        self._list_threshold = list_threshold
+        self._interval = poll_interval
+        self._condition = threading.Condition()
+        self._queue: Deque[Tuple[Future, Callable[[], Any]]] = deque()
+        self._running: Dict[str, Tuple[Future, Any]] = {}
+        self._starting = 0
+        self._futures: List[Future] = []
+        self._keys: Dict[Future, str] = {}
+        self._jobs: Dict[Future, Any] = {}
+        self._closed = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=submit_workers, thread_name_prefix="bq-job-submit"
+        )
+        self._poller: Optional[threading.Thread] = None
+
+    def __enter__(self) -> JobOrchestrator:
+        return self
+
+    def __exit__(
+        self,
+        type: Optional[Type[BaseException]],
+        value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ):
+        self.shutdown(cancel=type is not None)
+        if not type and not value and not traceback:
+            return True
+        print_exception(type, value, traceback)
+        return False
+
+    @property
+    def poll_interval(self) -> float:
+        return self._interval
+
+    def submit_load(
+        self,
+        uri: str,
+        table_id: str,
+        job_config: Optional[bigquery.LoadJobConfig] = None,
+        key: Optional[str] = None,
+    ) -> Future:
+        return self._submit(
+            key or table_id, self._handler.start_load_job, uri, table_id, job_config
+        )
+
+    def submit_extract(
+        self,
+        table_ref: bigquery.TableReference,
+        destination_uri: str,
+        location: str,
+        job_config: Optional[bigquery.ExtractJobConfig] = None,
+        key: Optional[str] = None,
+    ) -> Future:
+        return self._submit(
+            key or destination_uri,
+            self._handler.extract_table,
+            table_ref,
+            destination_uri,
+            location,
+            job_config,
+        )
+
+    def submit_copy(
+        self,
+        sources: Union[str, Sequence[str]],
+        destination: str,
+        job_config: Optional[bigquery.CopyJobConfig] = None,
+        key: Optional[str] = None,
+    ) -> Future:
+        return self._submit(
+            key or destination,
+            self._handler.copy_table,
+            sources,
+            destination,
+            job_config,
+        )
+
+    def _submit(self, key: str, start: Callable, *args) -> Future:
+        future: Future = Future()
+        with self._condition:
+            assert not self._closed, "cannot submit jobs after shutdown"
+            self._futures.append(future)
+            self._keys[future] = key
+            self._queue.append((future, partial(copy_context().run, start, *args)))
+            self._start_queued()
+            if self._poller is None:
+                self._poller = threading.Thread(
+                    target=self._poll_forever, name="bq-job-poller", daemon=True
+                )
+                self._poller.start()
+        return future
+
+    def _start_queued(self):
+        # called with the condition held
+        while (
+            self._queue
+            and self._starting + len(self._running) < self._max_concurrent_jobs
+        ):
+            future, start = self._queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._starting += 1
+            self._executor.submit(self._start, future, start)
+
+    def _start(self, future: Future, start: Callable[[], Any]):
+        try:
+            job = start()
+        except BaseException as e:
+            logger.debug(f"starting job {self._keys[future]} failed: {e}")
+            with self._condition:
+                self._starting -= 1
+                self._start_queued()
+                self._condition.notify_all()
+            future.set_exception(e)
+            return
+        with self._condition:
+            self._starting -= 1
+            self._jobs[future] = job
+            self._running[job.job_id] = (future, job)
+            # new jobs are polled at the shortest interval
+            self._interval = self._poll_interval
+            self._condition.notify_all()
+
+    def _poll_forever(self):
+        last_poll = 0.0
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed and not (
+                        self._queue or self._starting or self._running
+                    ):
+                        return
+                    delay = last_poll + self._interval - time.monotonic()
+                    if self._running and delay <= 0:
+                        break
+                    self._condition.wait(delay if self._running else None)
+                running = dict(self._running)
+            last_poll = time.monotonic()
+            finished = self._poll(running)
+            with self._condition:
+                done = [self._running.pop(job_id) for job_id in finished]
+                for (future, _), job in zip(done, finished.values()):
+                    self._jobs[future] = job
+                self._interval = (
+                    self._poll_interval
+                    if finished
+                    else min(
+                        self._interval * self._poll_backoff, self._max_poll_interval
+                    )
+                )
+                self._start_queued()
+            for (future, started), job in zip(done, finished.values()):
+                try:
+                    # cached metadata of written tables is stale once jobs finish
+                    if getattr(started, "destination", None):
+                        self._handler.invalidate_table(started.destination)
+                    error = _job_error(job)
+                except Exception as e:
+                    # the poller has to outlive the completion of any one job
+                    logger.debug(f"completing job {job.job_id} failed: {e}")
+                    error = e
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(job)
+
+    def _poll(self, running: Mapping[str, Tuple[Future, Any]]) -> Dict[str, Any]:
+        jobs = [job for _, job in running.values()]
+        try:
+            if len(jobs) > self._list_threshold and all(job.created for job in jobs):
+                # one paged listing replaces a request per job
+                polled = self._handler.list_jobs(
+                    state_filter="done",
+                    min_creation_time=min(job.created for job in jobs),
+                )
+            else:
+                polled = (
+                    self._handler.get_job(job.job_id, job.location) for job in jobs
+                )
+            finished = {}
+            for job in polled:
+                if job.job_id in running and job.state == _DONE_STATE:
+                    finished[job.job_id] = job
+                    if len(finished) == len(running):
+                        break
+            return finished
+        except Exception as e:
+            logger.warning(f"polling {len(jobs)} jobs failed: {e}")
+            return {}
+
+    def _job_result(self, future: Future) -> JobResult:
+        key = self._keys[future]
+        if future.cancelled():
+            return JobResult(key, None, CancelledError())
+        return JobResult(key, self._jobs.get(future), future.exception())
+
+    def as_completed(self, timeout: Optional[float] = None) -> Iterator[JobResult]:
+        """Yields the results of all submitted jobs as they finish.
+
+        A failed job is reported by the error of its result.
+        """
+        with self._condition:
+            futures = list(self._futures)
+        for future in as_completed(futures, timeout):
+            yield self._job_result(future)
+
+    def wait_all(self, timeout: Optional[float] = None) -> List[JobResult]:
+        """Waits for all submitted jobs and returns their results in order."""
+        with self._condition:
+            futures = list(self._futures)
+        _, not_done = wait(futures, timeout)
+        if not_done:
+            raise TimeoutError(f"{len(not_done)} of {len(futures)} jobs are not done")
+        return [self._job_result(future) for future in futures]
+
+    def shutdown(self, wait: bool = True, cancel: bool = False):
+        """Stops accepting jobs, `cancel` also cancels queued and running jobs."""
+        queued: List[Tuple[Future, Callable[[], Any]]] = []
+        running: List[Tuple[Future, Any]] = []
+        with self._condition:
+            self._closed = True
+            if cancel:
+                queued, running = list(self._queue), list(self._running.values())
+                self._queue.clear()
+            self._condition.notify_all()
+        for future, _ in queued:
+            future.cancel()
+        for _, job in running:
+            try:
+                self._handler.cancel_job(job.job_id, job.location)
+            except Exception as e:
+                logger.warning(f"cancelling job {job.job_id} failed: {e}")
+        if wait and self._poller:
+            self._poller.join()
+        self._executor.shutdown(wait=wait)
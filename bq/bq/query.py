@@ -0,0 +1,156 @@
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import date, datetime, time
+from decimal import Decimal
+from threading import Lock
+from typing import Any, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+
+class QueryEstimate(NamedTuple):
+    total_bytes_processed: int
+    referenced_tables: List[str]
+
+
+def _parameter_type(name: str, value: Any) -> str:
+    if isinstance(value, datetime) and value.tzinfo:
+        return "TIMESTAMP"
+    # bool before int, datetime before date, as they are subclasses
+    for types, parameter_type in (
+        (bool, "BOOL"),
+        (int, "INT64"),
+        (float, "FLOAT64"),
+        (Decimal, "NUMERIC"),
+        (str, "STRING"),
+        (bytes, "BYTES"),
+        (datetime, "DATETIME"),
+        (date, "DATE"),
+        (time, "TIME"),
+    ):
+        if isinstance(value, types):
+            return parameter_type
+    raise ValueError(f"cannot infer the type of query parameter {name}: {value!r}")
+
+
+def query_parameters(params: Mapping[str, Any]) -> List[Any]:
+    """Returns the named query parameters of Python values.
+
+    Lists and tuples become array parameters. Parameter objects are passed
+    through, e.g. to give a NULL value its type.
+    """
+    from google.cloud import bigquery  # type: ignore
+
+    parameters: List[Any] = []
+    for name, value in params.items():
+        if hasattr(value, "to_api_repr"):
+            parameters.append(value)
+        elif isinstance(value, (list, tuple)):
+            types = {_parameter_type(name, item) for item in value}
+            if len(types) != 1:
+                raise ValueError(f"cannot infer the type of array parameter {name}")
+            parameters.append(bigquery.ArrayQueryParameter(name, types.pop(), value))
+        else:
+            parameters.append(
+                bigquery.ScalarQueryParameter(name, _parameter_type(name, value), value)
+            )
+    return parameters
+
+
+def _nbytes(batch: Any) -> int:
+    if hasattr(batch, "nbytes"):
+        return batch.nbytes
+    return sum(column.nbytes for column in batch.values())
+
+
+def _shared(batch: Any) -> Any:
+    # numpy batches are handed to every hit, their arrays are made read-only
+    # and each hit gets a mapping of its own
+    if isinstance(batch, dict):
+        for column in batch.values():
+            column.setflags(write=False)
+        return dict(batch)
+    return batch
+
+
+class QueryCache:
+    """In-memory cache of query results holding up to `max_bytes` of batches.
+
+    Results are keyed by the query, its parameters and the last modification
+    times of the tables it references, so writes to a table invalidate the
+    results read from it. Results larger than `max_bytes` are not cached and
+    the least recently used results are evicted first. Queries whose results
+    change without their tables, e.g. by calling `CURRENT_TIMESTAMP`, should
+    not be cached. The NumPy arrays of cached results are read-only.
+    """
+
+    def __init__(self, max_bytes: int = 256 << 20):
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self._results: "OrderedDict[str, Tuple[List[Any], int]]" = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @staticmethod
+    def key(
+        query: str,
+        params: Optional[Mapping[str, Any]],
+        data_format: str,
+        tables: Iterable[Tuple[str, Any]],
+    ) -> str:
+        parameters = sorted(
+            (name, value.to_api_repr() if hasattr(value, "to_api_repr") else value)
+            for name, value in (params or {}).items()
+        )
+        text = json.dumps(
+            [query, parameters, data_format, sorted(tables)], default=repr
+        ).encode("utf-8")
+        return hashlib.sha256(text).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self._misses += 1
+                return None
+            self._results.move_to_end(key)
+            self._hits += 1
+            return [_shared(batch) for batch in result[0]]
+
+    def put(self, key: str, batches: List[Any], size: int):
+        with self._lock:
+            if key in self._results:
+                self._size -= self._results.pop(key)[1]
+            self._results[key] = (batches, size)
+            self._size += size
+            while self._size > self._max_bytes:
+                _, (_, evicted) = self._results.popitem(last=False)
+                self._size -= evicted
+
+    def tee(self, key: str, batches: Iterable[Any]) -> Iterator[Any]:
+        """Yields `batches` and caches them once all were consumed."""
+        stored: Optional[List[Any]] = []
+        size = 0
+        for batch in batches:
+            if stored is not None:
+                size += _nbytes(batch)
+                if size <= self._max_bytes:
+                    stored.append(_shared(batch))
+                else:
+                    stored = None
+            yield batch
+        if stored is not None:
+            self.put(key, stored, size)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._size = 0
@@ -0,0 +1,72 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+_DONE = object()
+
+
+def _submit(executor: ThreadPoolExecutor, fn: Callable, *args: Any) -> Future:
+    # tasks run in a copy of the submitting context, e.g. to inherit deadlines
+    context = copy_context()
+    return executor.submit(lambda: context.run(fn, *args))
+
+
+def iter_parallel(
+    sources: Sequence[Callable[[], Iterable[Any]]],
+    max_workers: int = 8,
+    queue_size: int = 16,
+) -> Iterator[Any]:
+    """Yields the items of all sources as up to `max_workers` threads read them.
+
+    At most `queue_size` items are buffered, so fast sources wait for the
+    consumer instead of piling up in memory. The first error of a source is
+    raised to the consumer, and closing the iterator stops all readers.
+    """
+    assert max_workers > 0 and queue_size > 0
+    items: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def drain(source: Callable[[], Iterable[Any]]):
+        error = None
+        try:
+            if stop.is_set():
+                return
+            for item in source():
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            error = e
+        put((_DONE, error))
+
+    if not sources:
+        return
+    executor = ThreadPoolExecutor(
+        max_workers=min(max_workers, len(sources)), thread_name_prefix="bq-read"
+    )
+    try:
+        for source in sources:
+            _submit(executor, drain, source)
+        remaining = len(sources)
+        while remaining:
+            item, error = items.get()
+            if item is not _DONE:
+                yield item
+            elif error:
+                raise error
+            else:
+                remaining -= 1
+    finally:
+        stop.set()
+        # readers blocked on the network exit with their next item
+        executor.shutdown(wait=False)
@@ -0,0 +1,442 @@
+from __future__ import annotations
+import io
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from traceback import print_exception
+from types import TracebackType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Type,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery  # type: ignore
+    from .bq import BQHandler
+
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_STRUCT_TYPES = frozenset(["RECORD", "STRUCT"])
+
+
+@lru_cache(maxsize=None)
+def _proto_type(field_type: str) -> int:
+    from google.protobuf import descriptor_pb2  # type: ignore
+
+    FieldDescriptorProto = descriptor_pb2.FieldDescriptorProto
+    return {
+        "BYTES": FieldDescriptorProto.TYPE_BYTES,
+        "INTEGER": FieldDescriptorProto.TYPE_INT64,
+        "INT64": FieldDescriptorProto.TYPE_INT64,
+        "FLOAT": FieldDescriptorProto.TYPE_DOUBLE,
+        "FLOAT64": FieldDescriptorProto.TYPE_DOUBLE,
+        "BOOLEAN": FieldDescriptorProto.TYPE_BOOL,
+        "BOOL": FieldDescriptorProto.TYPE_BOOL,
+        # timestamps are microseconds and dates days since the epoch
+        "TIMESTAMP": FieldDescriptorProto.TYPE_INT64,
+        "DATE": FieldDescriptorProto.TYPE_INT32,
+    }.get(field_type, FieldDescriptorProto.TYPE_STRING)
+
+
+def _row_descriptor(fields: Sequence[bigquery.SchemaField], name: str = "Row"):
+    """Self-contained proto2 descriptor of rows, as the Write API expects."""
+    from google.protobuf import descriptor_pb2  # type: ignore
+
+    FieldDescriptorProto = descriptor_pb2.FieldDescriptorProto
+    proto = descriptor_pb2.DescriptorProto(name=name)
+    for number, field in enumerate(fields, 1):
+        field_proto = proto.field.add(
+            name=field.name,
+            number=number,
+            label=FieldDescriptorProto.LABEL_REPEATED
+            if field.mode == "REPEATED"
+            else FieldDescriptorProto.LABEL_OPTIONAL,
+        )
+        if field.field_type in _STRUCT_TYPES:
+            nested = _row_descriptor(field.fields, f"{field.name}_{number}")
+            proto.nested_type.append(nested)
+            field_proto.type = FieldDescriptorProto.TYPE_MESSAGE
+            field_proto.type_name = nested.name
+        else:
+            field_proto.type = _proto_type(field.field_type)
+    return proto
+
+
+def _convert(field_type: str, value: Any) -> Any:
+    if field_type == "TIMESTAMP" and isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        delta = value - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    if field_type == "DATE" and isinstance(value, date):
+        if isinstance(value, datetime):
+            value = value.date()
+        return (value - _EPOCH.date()).days
+    if field_type == "DATETIME" and isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if field_type == "JSON" and not isinstance(value, str):
+        return json.dumps(value)
+    if _proto_type(field_type) == _proto_type("STRING") and not isinstance(value, str):
+        return value.isoformat() if hasattr(value, "isoformat") else str(value)
+    return value
+
+
+class RowEncoder:
+    """Serializes records to protocol buffer rows of a table schema."""
+
+    def __init__(self, schema: Sequence[bigquery.SchemaField]):
+        from google.protobuf import (  # type: ignore
+            descriptor_pb2,
+            descriptor_pool,
+            message_factory,
+        )
+
+        self._schema = schema
+        self.descriptor = _row_descriptor(schema)
+        pool = descriptor_pool.DescriptorPool()
+        pool.Add(
+            descriptor_pb2.FileDescriptorProto(
+                name="row.proto", message_type=[self.descriptor]
+            )
+        )
+        message_descriptor = pool.FindMessageTypeByName(self.descriptor.name)
+        if hasattr(message_factory, "GetMessageClass"):
+            self._message_class = message_factory.GetMessageClass(message_descriptor)
+        else:  # protobuf < 4.22
+            self._message_class = message_factory.MessageFactory(pool).GetPrototype(
+                message_descriptor
+            )
+
+    @property
+    def message_class(self) -> Type:
+        return self._message_class
+
+    def encode(self, record: Mapping[str, Any]) -> bytes:
+        message = self._message_class()
+        self._fill(message, self._schema, record)
+        return message.SerializeToString()
+
+    def _fill(self, message, fields: Sequence[bigquery.SchemaField], record: Mapping):
+        message.SetInParent()
+        for field in fields:
+            value = record.get(field.name)
+            if value is None:
+                continue
+            if field.field_type in _STRUCT_TYPES:
+                if field.mode == "REPEATED":
+                    for item in value:
+                        self._fill(
+                            getattr(message, field.name).add(), field.fields, item
+                        )
+                else:
+                    self._fill(getattr(message, field.name), field.fields, value)
+            elif field.mode == "REPEATED":
+                getattr(message, field.name).extend(
+                    _convert(field.field_type, item) for item in value
+                )
+            else:
+                setattr(message, field.name, _convert(field.field_type, value))
+
+
+class _WriteStream:
+    """Committed write stream and its connection, rows are appended at offsets."""
+
+    def __init__(self, client, table_path: str, descriptor, retry=None):
+        from google.cloud.bigquery_storage_v1 import types  # type: ignore
+
+        self._client = client
+        self.name = client.create_write_stream(
+            parent=table_path,
+            write_stream=types.WriteStream(type_=types.WriteStream.Type.COMMITTED),
+            retry=retry,
+        ).name
+        self.offset = 0
+        self._template = types.AppendRowsRequest(
+            write_stream=self.name,
+            proto_rows=types.AppendRowsRequest.ProtoData(
+                writer_schema=types.ProtoSchema(proto_descriptor=descriptor)
+            ),
+        )
+        self._connection: Optional[Any] = None
+
+    def append(self, offset: int, rows: List[bytes], timeout: Optional[float]):
+        from google.cloud.bigquery_storage_v1 import types, writer  # type: ignore
+
+        if self._connection is None:
+            self._connection = writer.AppendRowsStream(self._client, self._template)
+        request = types.AppendRowsRequest(
+            offset=offset,
+            proto_rows=types.AppendRowsRequest.ProtoData(
+                rows=types.ProtoRows(serialized_rows=rows)
+            ),
+        )
+        try:
+            return self._connection.send(request).result(timeout)
+        except BaseException:
+            # a broken connection is reopened by the next append
+            self.close()
+            raise
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def finalize(self):
+        self.close()
+        self._client.finalize_write_stream(name=self.name)
+
+
+class StreamWriter:
+    """Buffered writer appending rows to a table over the Storage Write API.
+
+    Records are encoded as they are written and batched until a batch holds
+    `max_batch_bytes` or `max_batch_rows`, or its first row waited
+    `max_latency` seconds. Batches are appended in the background over up to
+    `pool_size` committed write streams. Each batch is appended at the next
+    offset of its stream, so a retried append cannot duplicate rows. `write`
+    blocks while `max_buffer_bytes` are buffered or in flight. Errors of
+    background appends are raised by the next `write`, `flush` or `close`.
+    """
+
+    def __init__(
+        self,
+        handler: BQHandler,
+        table_id: str,
+        pool_size: int = 4,
+        max_batch_bytes: int = 4 << 20,
+        max_batch_rows: int = 50000,
+        max_latency: float = 1.0,
+        max_buffer_bytes: int = 64 << 20,
+        append_timeout: Optional[float] = 60,
+    ):
+        # append requests are limited to 10MB
+        assert 0 < max_batch_bytes <= 9 << 20 and max_batch_rows > 0
+        assert pool_size > 0 and max_buffer_bytes >= max_batch_bytes
+        self._handler = handler
+        ref = handler._table_reference(table_id)
+        self._table_path = (
+            f"projects/{ref.project}/datasets/{ref.dataset_id}/tables/{ref.table_id}"
+        )
+        self._encoder = RowEncoder(handler.get_table(table_id).schema)
+        self._pool_size = pool_size
+        self._max_batch_bytes = max_batch_bytes
+        self._max_batch_rows = max_batch_rows
+        self._max_latency = max_latency
+        self._max_buffer_bytes = max_buffer_bytes
+        self._append_timeout = append_timeout
+        self._condition = threading.Condition()
+        self._rows: List[bytes] = []
+        self._batch_bytes = 0
+        self._oldest = 0.0
+        self._pending_bytes = 0
+        self._rows_written = 0
+        self._failed_rows = 0
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._streams: queue.Queue = queue.Queue()
+        self._stream_count = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="bq-write"
+        )
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="bq-write-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    def __enter__(self) -> StreamWriter:
+        return self
+
+    def __exit__(
+        self,
+        type: Optional[Type[BaseException]],
+        value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ):
+        self.close()
+        if not type and not value and not traceback:
+            return True
+        print_exception(type, value, traceback)
+        return False
+
+    @property
+    def rows_written(self) -> int:
+        return self._rows_written
+
+    @property
+    def failed_rows(self) -> int:
+        return self._failed_rows
+
+    def _raise_error(self):
+        if self._error:
+            error, self._error = self._error, None
+            raise error
+
+    def write(
+        self, records: Iterable[Mapping[str, Any]], timeout: Optional[float] = None
+    ):
+        """Buffers records, blocking for up to `timeout` while the buffer is full."""
+        for record in records:
+            row = self._encoder.encode(record)
+            with self._condition:
+                assert not self._closed, "writer is closed"
+                self._raise_error()
+                if self._rows and (
+                    self._batch_bytes + len(row) > self._max_batch_bytes
+                    or self._pending_bytes + len(row) > self._max_buffer_bytes
+                ):
+                    # the buffered rows have to be in flight to free the buffer
+                    self._submit_batch()
+                if not self._condition.wait_for(
+                    lambda: self._error
+                    or not self._pending_bytes
+                    or self._pending_bytes + len(row) <= self._max_buffer_bytes,
+                    timeout,
+                ):
+                    raise TimeoutError("buffer of the writer is full")
+                self._raise_error()
+                if self._rows and self._batch_bytes + len(row) > self._max_batch_bytes:
+                    self._submit_batch()
+                if not self._rows:
+                    self._oldest = time.monotonic()
+                    self._condition.notify_all()
+                self._rows.append(row)
+                self._batch_bytes += len(row)
+                self._pending_bytes += len(row)
+                if len(self._rows) >= self._max_batch_rows:
+                    self._submit_batch()
+
+    def write_avro(
+        self, content: Union[bytes, BinaryIO], timeout: Optional[float] = None
+    ):
+        """Writes the records of an Avro container, e.g. from `AvroHandler`."""
+        import fastavro  # type: ignore
+
+        if isinstance(content, bytes):
+            content = io.BytesIO(content)
+        self.write(fastavro.reader(content), timeout)
+
+    def flush(self, timeout: Optional[float] = None):
+        """Appends the buffered rows and waits until all appends finished."""
+        with self._condition:
+            if self._rows:
+                self._submit_batch()
+            if not self._condition.wait_for(lambda: not self._pending_bytes, timeout):
+                raise TimeoutError("appends of the writer did not finish")
+            self._raise_error()
+
+    def close(self):
+        """Flushes the writer and finalizes its streams."""
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            self._flusher.join()
+            self._executor.shutdown()
+            while not self._streams.empty():
+                self._streams.get().finalize()
+
+    def _submit_batch(self):
+        # called with the condition held
+        rows, size = self._rows, self._batch_bytes
+        self._rows, self._batch_bytes = [], 0
+        self._executor.submit(copy_context().run, self._append_batch, rows, size)
+
+    def _flush_periodically(self):
+        with self._condition:
+            while not self._closed:
+                if self._rows:
+                    delay = self._oldest + self._max_latency - time.monotonic()
+                    if delay <= 0:
+                        self._submit_batch()
+                        continue
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+
+    def _acquire_stream(self) -> _WriteStream:
+        # at most pool_size appends run at once, so a stream is free or new
+        with self._condition:
+            create = self._streams.empty() and self._stream_count < self._pool_size
+            if create:
+                self._stream_count += 1
+        if not create:
+            return self._streams.get()
+        try:
+            self._handler._limit("create_write_stream")
+            return _WriteStream(
+                self._handler._get_write_client(),
+                self._table_path,
+                self._encoder.descriptor,
+                retry=self._handler._retry_policy,
+            )
+        except BaseException:
+            with self._condition:
+                self._stream_count -= 1
+            raise
+
+    def _append(self, stream: _WriteStream, rows: List[bytes]):
+        from google.api_core import exceptions
+
+        offset = stream.offset
+
+        def append():
+            self._handler._limit("append_rows")
+            try:
+                stream.append(offset, rows, self._append_timeout)
+            except exceptions.AlreadyExists:
+                # a retried append whose first attempt was committed
+                logger.debug(f"rows at offset {offset} of {stream.name} exist")
+
+        retry_policy = self._handler._retry_policy
+        if retry_policy:
+            retry_policy(append)()
+        else:
+            append()
+        stream.offset = offset + len(rows)
+
+    def _append_batch(self, rows: List[bytes], size: int):
+        stream = None
+        try:
+            stream = self._acquire_stream()
+            self._append(stream, rows)
+        except BaseException as e:
+            logger.warning(f"appending {len(rows)} rows failed: {e}")
+            with self._condition:
+                self._error = self._error or e
+                self._failed_rows += len(rows)
+                if stream is not None:
+                    # whether the rows landed is unknown, so is the offset
+                    self._stream_count -= 1
+            if stream is not None:
+                stream.close()
+                stream = None
+        else:
+            with self._condition:
+                self._rows_written += len(rows)
+        finally:
+            if stream is not None:
+                self._streams.put(stream)
+            with self._condition:
+                self._pending_bytes -= size
+                self._condition.notify_all()
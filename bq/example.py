@@ -1,5 +1,5 @@
 from bq import BQHandler
-from retry import expo, full_jitter
+from retry import RetryBudget, expo, full_jitter
 
 PROJECT_ID = "<YOUR-PROJECT-ID-HERE>"
 PRIVATE_CONNECTION_NAME = "<YOUR-PRIVATE-CONNECTION-NAME-HERE>"
@@ -97,3 +97,88 @@ def remove_table():
             bq.generate_table_id(PROJECT_ID, "PLACEHOLDER", "PLACEHOLDER"),
             not_found_ok=False,
         )
+
+
+def token_bucket_ratelimit():
+    # refills lazily without a background thread
+    ratelimit_params = {
+        "kind": "token_bucket",
+        "calls": 10,
+        "period": 60,  # seconds
+        "burst": 2,
+    }
+
+    with BQHandler(PROJECT_ID, ratelimit_params=ratelimit_params) as bq:
+        for dataset in bq.list_datasets():
+            print(dataset.dataset_id)
+
+
+def shared_ratelimit():
+    # all processes on this host using the same name share one quota
+    ratelimit_params = {
+        "kind": "shared",
+        "name": "bq-" + PROJECT_ID,
+        "calls": 10,
+        "period": 60,  # seconds
+    }
+
+    with BQHandler(PROJECT_ID, ratelimit_params=ratelimit_params) as bq:
+        for dataset in bq.list_datasets():
+            print(dataset.dataset_id)
+
+
+def weighted_ratelimit():
+    # every method gets its own quota, extract jobs are charged 5 units
+    ratelimit_params = {
+        "kind": "token_bucket",
+        "calls": 20,
+        "period": 60,  # seconds
+        "per_method": {"list_datasets": {"calls": 100}},
+        "costs": {"extract_table": 5},
+    }
+
+    with BQHandler(PROJECT_ID, ratelimit_params=ratelimit_params) as bq:
+        for dataset in bq.list_datasets():
+            print(dataset.dataset_id)
+
+
+def adaptive_ratelimit():
+    # the rate grows while calls succeed and halves on rateLimitExceeded,
+    # feedback is reported by the retrier
+    ratelimit_params = {
+        "kind": "adaptive",
+        "calls": 60,
+        "period": 60,  # seconds
+        "min_calls": 5,
+        "max_calls": 600,
+    }
+
+    with BQHandler(
+        PROJECT_ID, use_backoff=True, ratelimit_params=ratelimit_params
+    ) as bq:
+        for dataset in bq.list_datasets():
+            print(dataset.dataset_id)
+
+
+def retry_budget():
+    # retries are capped at 10% of recent successful calls across both handlers
+    budget = RetryBudget(ratio=0.1, min_retries_per_second=1)
+    backoff_params = {**BQHandler._default_backoff_params, "budget": budget}
+
+    with BQHandler(PROJECT_ID, backoff_params=backoff_params) as bq, BQHandler(
+        PROJECT_ID, backoff_params=backoff_params
+    ) as other:
+        for dataset in bq.list_datasets():
+            print(dataset.dataset_id)
+        for dataset in other.list_datasets():
+            print(dataset.dataset_id)
+
+
+def circuit_breaker():
+    # calls fail immediately with CircuitOpenError while the endpoint is down,
+    # True shares one breaker per endpoint between all handlers of the process
+    backoff_params = {**BQHandler._default_backoff_params, "circuit_breaker": True}
+
+    with BQHandler(PROJECT_ID, backoff_params=backoff_params) as bq:
+        for dataset in bq.list_datasets():
+            print(dataset.dataset_id)
@@ -1,5 +1,525 @@
-from bq import __version__
+from bq import __version__, BQHandler, JobOrchestrator, RowEncoder
+from bq.query import QueryCache, query_parameters
+from bq.read import iter_parallel
+from collections import Counter
+from functools import partial
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from google.auth.credentials import AnonymousCredentials  # type: ignore
+from retry import constant
+import io
+import os
+import pytest  # type: ignore
+import subprocess
+import sys
+import threading
+import time
+from unittest import mock
 
 
 def test_version():
     assert __version__ == '0.1.0'
+
+
+def test_handlers_share_pooled_clients():
+    credentials = AnonymousCredentials()
+    shared = {"shared_client": True, "pool_size": 32}
+    first = BQHandler("project", credentials=credentials, **shared)
+    second = BQHandler("project", credentials=credentials, **shared)
+    own = BQHandler("project", credentials=credentials)
+    assert first._client is second._client
+    assert first._client is not own._client
+    adapter = first._client._http.get_adapter("https://bigquery.googleapis.com")
+    assert adapter._pool_maxsize == 32
+
+
+def test_import_defers_client_libraries():
+    code = "import bq; bq.BQHandler.generate_table_id('p', 'd', 't')"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    )
+    # -X importtime lines end with the module name
+    timed = {line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines()}
+    assert "bq.bq" in timed
+    for module in ("google.cloud.bigquery", "requests", "backoff", "asyncio"):
+        assert module not in timed
+
+
+class _FakeJobs:
+    """Handler stand-in whose jobs finish after a number of polls."""
+
+    def __init__(self, polls_until_done: int = 2):
+        self._lock = threading.Lock()
+        self._polls: dict = {}
+        self._polls_until_done = polls_until_done
+        self.running = 0
+        self.max_running = 0
+        self.calls: Counter = Counter()
+
+    def _job(self, job_id: str, state: str = "RUNNING"):
+        error = {"reason": "invalid", "message": "bad"} if "bad" in job_id else None
+        return mock.Mock(
+            job_id=job_id,
+            location="EU",
+            created=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            state=state,
+            error_result=error if state == "DONE" else None,
+            errors=[error] if error and state == "DONE" else None,
+        )
+
+    def _poll(self, job_id: str):
+        self._polls[job_id] += 1
+        if self._polls[job_id] < self._polls_until_done:
+            return self._job(job_id)
+        if self._polls[job_id] == self._polls_until_done:
+            self.running -= 1
+        return self._job(job_id, "DONE")
+
+    def start_load_job(self, uri, table_id, job_config):
+        if "missing" in uri:
+            raise ValueError(uri)
+        with self._lock:
+            self.calls["start_load_job"] += 1
+            self._polls[table_id] = 0
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        return self._job(table_id)
+
+    def get_job(self, job_id, location):
+        with self._lock:
+            self.calls["get_job"] += 1
+            return self._poll(job_id)
+
+    def invalidate_table(self, table):
+        self.calls["invalidate_table"] += 1
+
+    def list_jobs(self, state_filter, min_creation_time):
+        with self._lock:
+            self.calls["list_jobs"] += 1
+            jobs = [self._poll(job_id) for job_id in list(self._polls)]
+        return [job for job in jobs if job.state == "DONE"]
+
+
+def test_orchestrator_bounds_running_jobs_and_reports_errors():
+    handler = _FakeJobs()
+    with JobOrchestrator(
+        handler, max_concurrent_jobs=8, poll_interval=0.001, list_threshold=4
+    ) as orchestrator:
+        for i in range(40):
+            orchestrator.submit_load(f"gs://bucket/{i}", f"table_{i}")
+        orchestrator.submit_load("gs://bucket/bad", "table_bad")
+        orchestrator.submit_load("gs://missing", "table_missing")
+        results = orchestrator.wait_all(timeout=10)
+    assert [result.key for result in results[:2]] == ["table_0", "table_1"]
+    assert handler.max_running <= 8
+    assert handler.calls["start_load_job"] == 41
+    # jobs are listed in bulk while many of them run
+    assert handler.calls["list_jobs"] > 0
+    assert handler.calls["list_jobs"] + handler.calls["get_job"] < 41 * 2
+    errors = {result.key: result.error for result in results if result.error}
+    assert set(errors) == {"table_bad", "table_missing"}
+    assert isinstance(errors["table_missing"], ValueError)
+    assert errors["table_bad"].code == 400
+    assert results[0].job.state == "DONE"
+    assert handler.calls["invalidate_table"] == 41
+
+
+def test_orchestrator_fails_only_the_job_whose_completion_raises():
+    handler = _FakeJobs()
+    invalidate_table = handler.invalidate_table
+
+    def flaky_invalidate_table(table):
+        invalidate_table(table)
+        if handler.calls["invalidate_table"] == 1:
+            raise RuntimeError("cache unavailable")
+
+    handler.invalidate_table = flaky_invalidate_table  # type: ignore
+    with JobOrchestrator(handler, poll_interval=0.001) as orchestrator:
+        for i in range(3):
+            orchestrator.submit_load(f"gs://bucket/{i}", f"table_{i}")
+        results = orchestrator.wait_all(timeout=10)
+    errors = [result.error for result in results if result.error]
+    assert len(results) == 3 and len(errors) == 1
+    assert isinstance(errors[0], RuntimeError)
+
+
+def test_orchestrator_backs_off_while_no_job_finishes():
+    handler = _FakeJobs(polls_until_done=6)
+    orchestrator = JobOrchestrator(
+        handler, poll_interval=0.001, max_poll_interval=0.004, poll_backoff=2
+    )
+    orchestrator.submit_load("gs://bucket/slow", "table_slow")
+    assert [result.error for result in orchestrator.as_completed(timeout=10)] == [None]
+    assert handler.calls["get_job"] == 6
+    orchestrator.shutdown()
+
+
+def test_metadata_cache_serves_repeated_lookups():
+    from google.cloud import bigquery
+
+    now = [0.0]
+    handler = BQHandler(
+        "project",
+        credentials=AnonymousCredentials(),
+        cache_params={"ttl": 10, "max_ttl": 40, "clock": lambda: now[0]},
+    )
+    table = bigquery.Table("project.dataset.events_1")
+    table._properties.update(etag="a", lastModifiedTime="1")
+    items = [mock.Mock(table_id=name) for name in ("events_1", "events_2", "users")]
+    with mock.patch.object(
+        handler._client, "get_table", return_value=table
+    ) as get_table, mock.patch.object(
+        handler._client, "list_tables", return_value=iter(items)
+    ) as list_tables, mock.patch.object(
+        handler._client, "delete_table"
+    ):
+        for _ in range(3):
+            cached = handler.get_table("dataset.events_1")
+            assert cached is not table and cached.etag == "a"
+            # changes to a returned table do not reach the cache
+            cached.description = "changed"
+            assert list(handler.list_tables_matching_regex("dataset", "events_")) == (
+                items[:2]
+            )
+            handler.list_tables("dataset").clear()
+        assert handler.get_table("dataset.events_1").description is None
+        assert get_table.call_count == 1 and list_tables.call_count == 1
+        # an unchanged table is cached twice as long after its TTL expired
+        now[0] = 11
+        handler.get_table("project.dataset.events_1")
+        now[0] = 30
+        handler.get_table("dataset.events_1")
+        assert get_table.call_count == 2
+        assert handler.cache.revalidations == 1
+        handler.delete_table("dataset.events_1")
+        handler.get_table("dataset.events_1")
+        assert get_table.call_count == 3
+        list_tables.return_value = iter(items[1:])
+        assert list(handler.list_tables_matching_regex("dataset", "events_")) == [
+            items[1]
+        ]
+
+
+def test_iter_parallel_bounds_buffer_and_raises_source_errors():
+    produced = Counter()
+
+    def source(name, count, fail=False):
+        for i in range(count):
+            produced[name] += 1
+            yield (name, i)
+        if fail:
+            raise ValueError(name)
+
+    items = list(iter_parallel([partial(source, n, 50) for n in "abc"], 2, 4))
+    assert sorted(items) == [(n, i) for n in "abc" for i in range(50)]
+    assert [i for n, i in items if n == "b"] == list(range(50))
+
+    batches = iter_parallel([partial(source, "slow", 1000)], queue_size=4)
+    next(batches)
+    time.sleep(0.05)
+    assert produced["slow"] <= 6
+    batches.close()
+
+    with pytest.raises(ValueError):
+        list(iter_parallel([partial(source, "bad", 3, fail=True)]))
+
+
+def test_read_table_stream_reads_streams_in_parallel():
+    # the storage client and pyarrow are dependencies of the locked bigquery
+    from google.cloud.bigquery_storage_v1 import types
+
+    streams = [SimpleNamespace(name=f"stream-{i}") for i in range(3)]
+    session = SimpleNamespace(streams=streams, data_format=types.DataFormat.AVRO)
+    read_client = mock.Mock()
+    read_client.create_read_session.return_value = session
+    read_client.read_rows.side_effect = lambda name, retry: mock.Mock(
+        rows=lambda session: SimpleNamespace(pages=[[{"stream": name}]] * 2)
+    )
+    handler = BQHandler(
+        "project", credentials=AnonymousCredentials(), read_client=read_client
+    )
+    batches = list(
+        handler.read_table_stream(
+            "dataset.table", ["stream"], "x > 1", data_format="avro"
+        )
+    )
+    assert sorted(batch[0]["stream"] for batch in batches) == sorted(
+        stream.name for stream in streams for _ in range(2)
+    )
+    request = read_client.create_read_session.call_args.kwargs["read_session"]
+    assert request.table == "projects/project/datasets/dataset/tables/table"
+    assert list(request.read_options.selected_fields) == ["stream"]
+    assert request.read_options.row_restriction == "x > 1"
+    assert request.data_format == types.DataFormat.AVRO
+    assert read_client.read_rows.call_count == 3
+
+
+def _schema():
+    from google.cloud.bigquery import SchemaField
+
+    return [
+        SchemaField("name", "STRING"),
+        SchemaField("count", "INTEGER"),
+        SchemaField("at", "TIMESTAMP"),
+        SchemaField("tags", "STRING", mode="REPEATED"),
+        SchemaField("point", "RECORD", fields=[SchemaField("x", "FLOAT")]),
+    ]
+
+
+def test_row_encoder_serializes_records_of_a_schema():
+    encoder = RowEncoder(_schema())
+    at = datetime(2024, 1, 1, 0, 0, 1, tzinfo=timezone.utc)
+    row = encoder.message_class.FromString(
+        encoder.encode(
+            {"name": "a", "count": 2, "at": at, "tags": ["x"], "point": {"x": 1.5}}
+        )
+    )
+    assert (row.name, row.count, list(row.tags), row.point.x) == ("a", 2, ["x"], 1.5)
+    assert row.at == int(at.timestamp()) * 10**6
+    assert not encoder.message_class.FromString(encoder.encode({})).HasField("name")
+
+
+class _FakeWriteStream:
+    appended: list = []
+    fail_once = True
+
+    def __init__(self, client, table_path, descriptor, retry=None):
+        self.name = f"{table_path}/streams/{len(self.appended)}"
+        self.offset = 0
+
+    def append(self, offset, rows, timeout):
+        from google.api_core import exceptions
+
+        if any(name == self.name and o == offset for name, o, _ in self.appended):
+            raise exceptions.AlreadyExists("offset exists")
+        self.appended.append((self.name, offset, len(rows)))
+        if _FakeWriteStream.fail_once:
+            # the rows landed but the response was lost
+            _FakeWriteStream.fail_once = False
+            raise exceptions.InternalServerError("lost response")
+
+    def close(self):
+        pass
+
+    def finalize(self):
+        pass
+
+
+def test_stream_writer_batches_rows_at_stream_offsets():
+    handler = BQHandler(
+        "project",
+        credentials=AnonymousCredentials(),
+        write_client=mock.Mock(),
+        backoff_params={
+            **BQHandler._default_backoff_params,
+            "wait_gen": constant,
+            "interval": 0,
+        },
+    )
+    table = mock.Mock(schema=_schema())
+    with mock.patch.object(
+        handler._client, "get_table", return_value=table
+    ), mock.patch("bq.write._WriteStream", _FakeWriteStream):
+        with handler.open_writer(
+            "dataset.table", pool_size=1, max_batch_rows=10, max_latency=0.01
+        ) as writer:
+            writer.write({"name": str(i), "count": i} for i in range(25))
+            writer.flush()
+            assert [(o, n) for _, o, n in _FakeWriteStream.appended] == [
+                (0, 10),
+                (10, 10),
+                (20, 5),
+            ]
+            writer.write([{"name": "late"}])
+            # a partial batch is appended once it waited max_latency
+            time.sleep(0.2)
+            assert _FakeWriteStream.appended[-1][1:] == (25, 1)
+        assert writer.rows_written == 26 and writer.failed_rows == 0
+
+
+def test_stream_writer_appends_a_full_buffer_without_waiting():
+    handler = BQHandler(
+        "project", credentials=AnonymousCredentials(), write_client=mock.Mock()
+    )
+    table = mock.Mock(schema=_schema())
+    with mock.patch.object(
+        handler._client, "get_table", return_value=table
+    ), mock.patch("bq.write._WriteStream", _FakeWriteStream), mock.patch.object(
+        _FakeWriteStream, "appended", []
+    ), mock.patch.object(
+        _FakeWriteStream, "fail_once", False
+    ):
+        with handler.open_writer(
+            "dataset.table", max_batch_bytes=64, max_buffer_bytes=64, max_latency=60
+        ) as writer:
+            # the batch filling the buffer is appended before it is waited on
+            writer.write(({"name": "x" * 16} for _ in range(10)), timeout=5)
+            writer.flush(timeout=5)
+        assert sum(n for _, _, n in _FakeWriteStream.appended) == 10
+
+
+def test_stream_writer_writes_avro_records():
+    fastavro = pytest.importorskip("fastavro")
+    handler = BQHandler(
+        "project", credentials=AnonymousCredentials(), write_client=mock.Mock()
+    )
+    table = mock.Mock(schema=_schema())
+    avro = io.BytesIO()
+    fastavro.writer(
+        avro,
+        {"type": "record", "name": "r", "fields": [{"name": "name", "type": "string"}]},
+        [{"name": "a"}, {"name": "b"}],
+    )
+    with mock.patch.object(
+        handler._client, "get_table", return_value=table
+    ), mock.patch("bq.write._WriteStream", _FakeWriteStream), mock.patch.object(
+        _FakeWriteStream, "appended", []
+    ), mock.patch.object(
+        _FakeWriteStream, "fail_once", False
+    ):
+        with handler.open_writer("dataset.table", pool_size=1) as writer:
+            writer.write_avro(avro.getvalue())
+        assert [(o, n) for _, o, n in _FakeWriteStream.appended] == [(0, 2)]
+    assert writer.rows_written == 2
+
+
+class _FakeAppendCall:
+    """Bidirectional append_rows call of a fake write client."""
+
+    def __init__(self, client, requests):
+        self._client = client
+        self._requests = requests
+        self._active = True
+
+    def __next__(self):
+        from google.api_core import exceptions
+        from google.cloud.bigquery_storage_v1 import types
+        from google.rpc import status_pb2  # type: ignore
+
+        try:
+            request = next(self._requests)
+        except StopIteration:
+            raise exceptions.Cancelled("call closed")
+        self._client.requests.append(request)
+        if request.offset in self._client.offsets:
+            return types.AppendRowsResponse(
+                error=status_pb2.Status(code=6, message="offset exists")
+            )
+        self._client.offsets.append(request.offset)
+        return types.AppendRowsResponse(
+            append_result=types.AppendRowsResponse.AppendResult(offset=request.offset)
+        )
+
+    def is_active(self):
+        return self._active
+
+    def cancel(self):
+        self._active = False
+
+    def add_done_callback(self, callback):
+        pass
+
+
+def test_write_stream_appends_over_one_connection():
+    from google.api_core import exceptions
+    from bq.write import _WriteStream
+
+    client = mock.Mock(requests=[], offsets=[], calls=[])
+    client.create_write_stream.return_value = SimpleNamespace(name="stream")
+    client.append_rows.side_effect = lambda requests, metadata: client.calls.append(
+        metadata
+    ) or _FakeAppendCall(client, requests)
+    descriptor = RowEncoder(_schema()).descriptor
+    stream = _WriteStream(client, "projects/p/datasets/d/tables/t", descriptor)
+    stream.append(0, [b"a", b"b"], timeout=5)
+    stream.append(2, [b"c"], timeout=5)
+    with pytest.raises(exceptions.AlreadyExists):
+        stream.append(0, [b"a"], timeout=5)
+    # the failed connection is replaced by the next append
+    stream.append(3, [b"d"], timeout=5)
+    stream.finalize()
+    assert client.offsets == [0, 2, 3]
+    assert len(client.calls) == 2
+    # the stream and schema are sent once per connection
+    first = [r for r in client.requests if r.write_stream]
+    assert [r.offset for r in first] == [0, 3]
+    assert all(r.proto_rows.writer_schema.proto_descriptor.name for r in first)
+    assert list(client.requests[1].proto_rows.rows.serialized_rows) == [b"c"]
+    client.finalize_write_stream.assert_called_once_with(name="stream")
+
+
+def test_query_parameters_are_inferred_from_values():
+    parameters = query_parameters(
+        {
+            "flag": True,
+            "at": datetime(2024, 1, 1, tzinfo=timezone.utc),
+            "day": datetime(2024, 1, 1).date(),
+            "ids": [1, 2],
+        }
+    )
+    assert [parameter.to_api_repr()["parameterType"] for parameter in parameters] == [
+        {"type": "BOOL"},
+        {"type": "TIMESTAMP"},
+        {"type": "DATE"},
+        {"type": "ARRAY", "arrayType": {"type": "INT64"}},
+    ]
+    with pytest.raises(ValueError):
+        query_parameters({"missing": None})
+
+
+def test_cached_numpy_results_cannot_be_modified():
+    np = pytest.importorskip("numpy")
+    cache = QueryCache()
+    batch = {"id": np.arange(3)}
+    assert list(cache.tee("key", [batch])) == [batch]
+    cached = cache.get("key")
+    with pytest.raises(ValueError):
+        cached[0]["id"][0] = 5
+    cached[0]["id"] = np.zeros(3)
+    assert cache.get("key")[0]["id"].tolist() == [0, 1, 2]
+
+
+def test_query_results_are_cached_until_tables_change():
+    handler = BQHandler(
+        "project",
+        credentials=AnonymousCredentials(),
+        query_cache_params={"max_bytes": 1024},
+        cache_params={"ttl": 300},
+    )
+    batches = [SimpleNamespace(nbytes=8) for _ in range(3)]
+    table = mock.Mock(modified=datetime(2024, 1, 1))
+
+    def query(sql, job_config, location, retry):
+        if job_config.dry_run:
+            return mock.Mock(
+                total_bytes_processed=42,
+                referenced_tables=[
+                    SimpleNamespace(project="project", dataset_id="d", table_id="t")
+                ],
+            )
+        assert job_config.query_parameters[0].value == 1
+        rows = mock.Mock()
+        rows.to_arrow_iterable.side_effect = lambda **kwargs: iter(batches)
+        return mock.Mock(result=mock.Mock(return_value=rows))
+
+    sql = "SELECT * FROM d.t WHERE id = @id"
+    with mock.patch.object(
+        handler._client, "query", side_effect=query
+    ) as client_query, mock.patch.object(
+        handler._client, "get_table", return_value=table
+    ):
+        assert handler.estimate_query(sql) == (42, ["project.d.t"])
+        assert list(handler.query(sql, {"id": 1})) == batches
+        assert list(handler.query(sql, {"id": 1})) == batches
+        assert handler.query_cache.hits == 1
+        # every lookup dry-runs, only the first query ran
+        assert client_query.call_count == 4
+        # tables are looked up past the metadata cache, which may be stale
+        handler.get_table("project.d.t")
+        table.modified = datetime(2024, 1, 2)
+        assert list(handler.query(sql, {"id": 1})) == batches
+        assert client_query.call_count == 6
@@ -1,6 +1,37 @@
-from .gcs import GCSHandler
+from typing import TYPE_CHECKING
+
+from .gcs import GCSHandler, BatchResult
+from .cache import BlobCache
+from .index import BucketIndex, IndexChange, IndexEntry
+
+if TYPE_CHECKING:
+    from .aio import AsyncGCSHandler
+    from .clients import get_client, clear_clients
 
 __version__ = '0.1.0'
 __all__ = [
-    "GCSHandler"
+    "GCSHandler",
+    "AsyncGCSHandler",
+    "BatchResult",
+    "BlobCache",
+    "get_client",
+    "clear_clients",
+    "BucketIndex",
+    "IndexChange",
+    "IndexEntry"
 ]
+
+# submodules importing the client libraries are loaded on first access
+_LAZY_EXPORTS = {
+    "AsyncGCSHandler": ".aio",
+    "get_client": ".clients",
+    "clear_clients": ".clients",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_EXPORTS:
+        from importlib import import_module
+
+        return getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,282 @@
+from __future__ import annotations
+import asyncio
+import io
+import json
+import logging
+from datetime import datetime
+from functools import partial
+from traceback import print_exception
+from types import TracebackType
+from typing import Any, AsyncIterable, AsyncIterator, Mapping, Optional, Type, Union
+from urllib.parse import quote
+
+import aiohttp
+from google.api_core import exceptions as api_exceptions
+from google.auth import credentials, default  # type: ignore
+from google.auth.transport.requests import Request  # type: ignore
+from google.cloud import storage  # type: ignore
+from ratelimiter import AsyncRateLimiter
+from retry import ClassDefault, RetryPolicy, default_backoff_params, get_circuit_breaker
+
+from .gcs import (
+    GCSHandler,
+    _DEFAULT_API_ENDPOINT,
+    _blob_name,
+    _cost,
+    _should_retry,
+    _updated_predicate,
+)
+
+
+logger = logging.getLogger(__name__)
+
+_RETRYABLE_AIOHTTP_TYPES = (
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    asyncio.TimeoutError,
+)
+
+
+def _should_retry_async(exc):
+    """Predicate for determining when to retry."""
+    return isinstance(exc, _RETRYABLE_AIOHTTP_TYPES) or _should_retry(exc)
+
+
+class AsyncGCSHandler:
+    """Asyncio counterpart of `GCSHandler` talking to the GCS JSON API.
+
+    Requests share one pooled `aiohttp` session of `pool_size` connections,
+    which is opened on first use and closed by `close` or `async with`.
+    `api_endpoint` points the handler at an emulator.
+    """
+
+    _default_backoff_params = ClassDefault(
+        partial(default_backoff_params, _should_retry_async)
+    )
+    _default_ratelimit_params = GCSHandler._default_ratelimit_params
+    _scopes = ["https://www.googleapis.com/auth/devstorage.read_write"]
+
+    def __init__(
+        self,
+        project: str,
+        bucket_name: str,
+        credentials: Optional[credentials.Credentials] = None,
+        api_endpoint: Optional[str] = None,
+        **kwargs,
+    ):
+        if not credentials:
+            credentials, _ = default(scopes=self._scopes)
+        self._credentials = credentials
+        self._api_endpoint = (api_endpoint or _DEFAULT_API_ENDPOINT).rstrip("/")
+        self._pool_size = kwargs.pop("pool_size", 100)
+        use_backoff = kwargs.pop("use_backoff", False)
+        self._backoff_params = kwargs.pop("backoff_params", None)
+        if use_backoff or self._backoff_params:
+            self._backoff_params = self._backoff_params or self._default_backoff_params
+        use_ratelimit = kwargs.pop("use_ratelimit", False)
+        self._ratelimit_params = kwargs.pop("ratelimit_params", None)
+        self._ratelimiter = None
+        self._ratelimit_costs: Mapping[str, int] = {}
+        self._bytes_per_token: Optional[int] = None
+        if use_ratelimit or self._ratelimit_params:
+            self._ratelimit_params = (
+                self._ratelimit_params or self._default_ratelimit_params
+            )
+            params = dict(self._ratelimit_params)
+            self._ratelimit_costs = params.pop("costs", {})
+            self._bytes_per_token = params.pop("bytes_per_token", None)
+            kind = params.pop("kind", "token_bucket")
+            if kind != "token_bucket":
+                raise ValueError(f"Unsupported ratelimiter kind {kind}")
+            self._ratelimiter = AsyncRateLimiter(**params)
+        self._circuit_breaker = None
+        if self._backoff_params and self._backoff_params.get("circuit_breaker"):
+            self._circuit_breaker = self._backoff_params["circuit_breaker"]
+            if self._circuit_breaker is True:
+                self._circuit_breaker = get_circuit_breaker(self._api_endpoint)
+                self._backoff_params = {
+                    **self._backoff_params,
+                    "circuit_breaker": self._circuit_breaker,
+                }
+        self._retry_policy = (
+            RetryPolicy(**self._backoff_params) if self._backoff_params else None
+        )
+        self.project = project
+        self.bucket = storage.Bucket(None, bucket_name)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    async def __aexit__(
+        self,
+        type: Optional[Type[BaseException]],
+        value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ):
+        await self.close()
+        if not type and not value and not traceback:
+            return True
+        print_exception(type, value, traceback)
+        return False
+
+    async def __aenter__(self) -> AsyncGCSHandler:
+        return self
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            logger.debug("closing session")
+            await self._session.close()
+
+    @property
+    def backoff_params(self) -> Mapping:
+        return self._backoff_params
+
+    @property
+    def ratelimit_params(self) -> Mapping:
+        return self._ratelimit_params
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size)
+            )
+        return self._session
+
+    async def _limit(self, method: str, nbytes: int = 0):
+        if self._circuit_breaker:
+            self._circuit_breaker.check()
+        if self._ratelimiter:
+            await self._ratelimiter.limit(
+                _cost(
+                    self._ratelimit_costs.get(method, 1), nbytes, self._bytes_per_token
+                )
+            )
+
+    async def _headers(self) -> dict:
+        headers: dict = {}
+        if not self._credentials.valid:
+            if self._refresh_lock is None:
+                self._refresh_lock = asyncio.Lock()
+            async with self._refresh_lock:
+                if not self._credentials.valid:
+                    # refreshing is blocking I/O, hence the executor
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self._credentials.refresh, Request()
+                    )
+        self._credentials.apply(headers)
+        return headers
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        params: Mapping[str, Any],
+        data: Optional[bytes] = None,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> bytes:
+        async with self._get_session().request(
+            method,
+            self._api_endpoint + path,
+            params={k: str(v) for k, v in params.items() if v is not None},
+            data=data,
+            headers={**(await self._headers()), **(headers or {})},
+        ) as response:
+            body = await response.read()
+            if response.status >= 400:
+                raise api_exceptions.from_http_status(
+                    response.status, body.decode("utf-8", "replace")
+                )
+            return body
+
+    async def _request(self, method: str, path: str, retry: bool = True, **kwargs):
+        if retry and self._retry_policy:
+            return await self._retry_policy(self._send)(method, path, **kwargs)
+        return await self._send(method, path, **kwargs)
+
+    def _object_path(self, name: str) -> str:
+        return f"/storage/v1/b/{self.bucket.name}/o/{quote(name, safe='')}"
+
+    def _blob(self, resource: Mapping[str, Any]) -> storage.Blob:
+        blob = self.bucket.blob(resource["name"])
+        blob._set_properties(resource)
+        return blob
+
+    async def list_blobs(
+        self,
+        prefix: Optional[str] = None,
+        start_offset: Optional[str] = None,
+        match_glob: Optional[str] = None,
+        fields: Optional[str] = None,
+    ) -> AsyncIterator[storage.Blob]:
+        params = {
+            "prefix": prefix,
+            "startOffset": start_offset,
+            "matchGlob": match_glob,
+            "fields": fields,
+            "projection": "noAcl",
+        }
+        while True:
+            # every page is a request of its own
+            await self._limit("list_blobs")
+            page = json.loads(
+                await self._request(
+                    "GET", f"/storage/v1/b/{self.bucket.name}/o", params=params
+                )
+            )
+            for resource in page.get("items", ()):
+                yield self._blob(resource)
+            if not page.get("nextPageToken"):
+                return
+            params["pageToken"] = page["nextPageToken"]
+
+    async def download_blob_into_memory(
+        self, blob_name_or_blob: Union[str, storage.Blob]
+    ) -> io.BytesIO:
+        if isinstance(blob_name_or_blob, str):
+            blob = self.bucket.blob(blob_name_or_blob)
+            return await self.download_blob_into_memory(blob)
+
+        await self._limit("download_blob_into_memory", blob_name_or_blob.size or 0)
+        content = await self._request(
+            "GET",
+            self._object_path(blob_name_or_blob.name),
+            params={"alt": "media", "generation": blob_name_or_blob.generation},
+        )
+        return io.BytesIO(content)
+
+    async def upload_blob_from_memory(
+        self,
+        blob_name_or_blob: Union[str, storage.Blob],
+        file_obj: io.BytesIO,
+        content_type: Optional[str] = None,
+        if_generation_match: Optional[int] = None,
+    ) -> storage.Blob:
+        """Uploads `file_obj` and returns the blob with its new metadata.
+
+        Like `GCSHandler`, uploads are only retried if `if_generation_match`
+        makes them idempotent.
+        """
+        await self._limit("upload_blob_from_memory", file_obj.getbuffer().nbytes)
+        resource = await self._request(
+            "POST",
+            f"/upload/storage/v1/b/{self.bucket.name}/o",
+            retry=if_generation_match is not None,
+            params={
+                "uploadType": "media",
+                "name": _blob_name(blob_name_or_blob),
+                "ifGenerationMatch": if_generation_match,
+            },
+            data=file_obj.getvalue(),
+            headers={"Content-Type": content_type or "application/octet-stream"},
+        )
+        return self._blob(json.loads(resource))
+
+    @staticmethod
+    async def filter_updated(
+        blobs: AsyncIterable[storage.Blob],
+        threshold: Union[str, datetime],
+        cmp_op="gt",
+    ) -> AsyncIterator[storage.Blob]:
+        keep = _updated_predicate(threshold, cmp_op)
+        async for blob in blobs:
+            if keep(blob):
+                yield blob
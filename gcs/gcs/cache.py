@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterator, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+logger = logging.getLogger(__name__)
+
+
+class BlobCache:
+    """On-disk cache of blob contents keyed by bucket, name and generation.
+
+    A new generation of an object is a new key, so entries never have to be
+    invalidated and stale entries simply age out. Entries are written to a
+    temporary file and renamed into place, so readers never see partial data.
+    The least recently used entries are evicted once the cache holds more
+    than `max_bytes`. Eviction is guarded by an `flock` on a lock file in the
+    cache directory which makes one directory safe to share between the
+    processes of a host. The size of the cache is counted as of the last
+    scan of the directory plus the entries written since, the directory is
+    only scanned again once that exceeds `max_bytes`.
+    """
+
+    _suffix = ".blob"
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = 1 << 30):
+        self._directory = directory or os.path.join(tempfile.gettempdir(), "gcs-cache")
+        os.makedirs(self._directory, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._counter_lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._size: Optional[int] = None
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def evictions(self) -> int:
+        return self._evictions
+
+    def _path(self, bucket: str, name: str, generation: Union[int, str]) -> str:
+        key = f"{bucket}/{name}#{generation}".encode("utf-8")
+        return os.path.join(
+            self._directory, hashlib.sha256(key).hexdigest() + self._suffix
+        )
+
+    def _count(self, counter: str, value: int = 1):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def get(
+        self, bucket: str, name: str, generation: Union[int, str]
+    ) -> Optional[bytes]:
+        path = self._path(bucket, name, generation)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the modification time orders entries for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self._count("_misses")
+            return None
+        self._count("_hits")
+        return data
+
+    def put(self, bucket: str, name: str, generation: Union[int, str], data) -> str:
+        path = self._path(bucket, name, generation)
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                written = f.write(data)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._counter_lock:
+            if self._size is not None:
+                self._size += written - replaced
+            full = self._size is None or self._size > self._max_bytes
+        if full:
+            self.evict()
+        return path
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(os.path.join(self._directory, ".lock"), "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        """Removes least recently used entries until at most `max_bytes` remain."""
+        max_bytes = self._max_bytes if max_bytes is None else max_bytes
+        evicted = 0
+        with self._locked():
+            entries = []
+            for entry in os.scandir(self._directory):
+                if not entry.name.endswith(self._suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+            with self._counter_lock:
+                self._size = total
+        if evicted:
+            logger.debug(f"evicted {evicted} entries from {self._directory}")
+            self._count("_evictions", evicted)
+        return evicted
+
+    def clear(self):
+        self.evict(0)
@@ -1,47 +1,158 @@
 from __future__ import annotations
-from google.auth import credentials, default  # type: ignore
-from google.cloud import storage  # type: ignore
-from typing import Optional, Iterator, Union, Type, Mapping, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Iterator,
+    Set,
+    Tuple,
+    Union,
+    Type,
+    List,
+    Mapping,
+    Pattern,
+)
 from datetime import datetime
+import base64
+import inspect
+import mmap
+import operator
+import os
+import re
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
 import io
 import logging
-from google.cloud.storage.retry import (  # type: ignore
-    is_generation_specified,
-    is_etag_in_data,
-    is_metageneration_specified,
-    is_etag_in_json,
-)
 from traceback import print_exception
-from ratelimiter import RateLimiter
-from retry import SimpleRetrier, ConditionalRetrier, backoff_hdlr, expo, full_jitter
+from ratelimiter import AdaptiveRateLimiter, RateLimiterRegistry, make_ratelimiter
+from retry import (
+    RetryPolicy,
+    ConditionalRetryPolicy,
+    ClassDefault,
+    default_backoff_params,
+    with_handlers,
+    feedback_handlers,
+    get_circuit_breaker,
+    HedgingPolicy,
+    CircuitOpenError,
+)
 from types import TracebackType
-from google.api_core import exceptions as api_exceptions
-import requests
-import requests.exceptions as requests_exceptions
-from google.api_core.client_options import ClientOptions
-from google.auth import exceptions as auth_exceptions
+from .cache import BlobCache
+from .index import BucketIndex, IndexChange, IndexEntry
 
+if TYPE_CHECKING:
+    from google.auth import credentials  # type: ignore
+    from google.cloud import storage  # type: ignore
+    import requests
 
-logger = logging.getLogger(__name__)
 
-_RETRYABLE_TYPES = (
-    api_exceptions.TooManyRequests,  # 429
-    api_exceptions.InternalServerError,  # 500
-    api_exceptions.BadGateway,  # 502
-    api_exceptions.ServiceUnavailable,  # 503
-    api_exceptions.GatewayTimeout,  # 504
-    ConnectionError,
-    requests.ConnectionError,
-    requests_exceptions.ChunkedEncodingError,
-    requests_exceptions.Timeout,
-)
+logger = logging.getLogger(__name__)
 
 _ADDITIONAL_RETRYABLE_STATUS_CODES = (408,)
 
 
+_DEFAULT_API_ENDPOINT = "https://storage.googleapis.com"
+
+_MAX_COMPOSE_COMPONENTS = 32
+_MAX_BATCH_SIZE = 100
+_INDEX_FIELDS = "items(name,generation,size,updated),prefixes,nextPageToken"
+_RESUMABLE_CHUNK_MULTIPLE = 256 * 1024
+
+
+@lru_cache(maxsize=None)
+def _retryable_types() -> Tuple[Type[BaseException], ...]:
+    # the client libraries are only imported once errors have to be classified
+    from google.api_core import exceptions as api_exceptions
+    import requests.exceptions as requests_exceptions
+
+    return (
+        api_exceptions.TooManyRequests,  # 429
+        api_exceptions.InternalServerError,  # 500
+        api_exceptions.BadGateway,  # 502
+        api_exceptions.ServiceUnavailable,  # 503
+        api_exceptions.GatewayTimeout,  # 504
+        ConnectionError,
+        requests_exceptions.ConnectionError,
+        requests_exceptions.ChunkedEncodingError,
+        requests_exceptions.Timeout,
+    )
+
+
+@lru_cache(maxsize=None)
+def _batch_type() -> Tuple[type, bool]:
+    """Returns the storage batch type and whether its `finish` takes
+    `raise_exception`, so sub-responses are classified by the handler instead
+    of being raised at the first failure."""
+    from google.cloud.storage.batch import Batch  # type: ignore
+
+    if "raise_exception" in inspect.signature(Batch.finish).parameters:
+        return Batch, True
+
+    class _Batch(Batch):
+        def _finish_futures(self, responses, *args, **kwargs):
+            # no sub-request has a target object to update
+            pass
+
+    return _Batch, False
+
+
+@lru_cache(maxsize=None)
+def _lists_match_glob() -> bool:
+    from google.cloud import storage  # type: ignore
+
+    # match_glob is only known to google-cloud-storage >= 2.10
+    return "match_glob" in inspect.signature(storage.Client.list_blobs).parameters
+
+
+@lru_cache(maxsize=None)
+def _glob_pattern(match_glob: str) -> Pattern[str]:
+    """Compiles a GCS glob, where `*` and `?` stop at `/` and `**` does not."""
+    parts = []
+    for token in re.findall(r"\*\*|\[[^\]]+\]|\{[^}]*\}|[^*?[{]+|.", match_glob):
+        if token == "**":
+            parts.append(".*")
+        elif token == "*":
+            parts.append("[^/]*")
+        elif token == "?":
+            parts.append("[^/]")
+        elif token.startswith("[") and len(token) > 1:
+            parts.append("[^" + token[2:] if token.startswith("[!") else token)
+        elif token.startswith("{") and len(token) > 1:
+            alternatives = token[1:-1].split(",")
+            parts.append("(?:" + "|".join(map(re.escape, alternatives)) + ")")
+        else:
+            parts.append(re.escape(token))
+    return re.compile("".join(parts))
+
+
+def _glob_filter(
+    blobs: Iterator[storage.Blob], match_glob: Optional[str]
+) -> Iterator[storage.Blob]:
+    """Applies `match_glob` to a listing which could not filter by it."""
+    if not match_glob or _lists_match_glob():
+        return blobs
+    pattern = _glob_pattern(match_glob)
+    return (blob for blob in blobs if pattern.fullmatch(blob.name))
+
+
+def _glob_options(match_glob: Optional[str]) -> Dict[str, str]:
+    return {"match_glob": match_glob} if match_glob and _lists_match_glob() else {}
+
+
 def _should_retry(exc):
     """Predicate for determining when to retry."""
-    if isinstance(exc, _RETRYABLE_TYPES):
+    from google.api_core import exceptions as api_exceptions
+    from google.auth import exceptions as auth_exceptions
+
+    if isinstance(exc, _retryable_types()):
         return True
     elif isinstance(exc, api_exceptions.GoogleAPICallError):
         return exc.code in _ADDITIONAL_RETRYABLE_STATUS_CODES
@@ -51,16 +162,261 @@ def _should_retry(exc):
         return False
 
 
+def _is_throttled(exc):
+    """Predicate for determining whether a retried error is a 429."""
+    from google.api_core import exceptions as api_exceptions
+    from google.auth import exceptions as auth_exceptions
+
+    if isinstance(exc, auth_exceptions.TransportError):
+        return _is_throttled(exc.args[0])
+    return isinstance(exc, api_exceptions.TooManyRequests)
+
+
+class BatchResult(NamedTuple):
+    name: str
+    value: Any
+    error: Optional[BaseException]
+
+
+_COMPARISON_OPERATORS = {
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "lt": operator.lt,
+    "le": operator.le,
+    "eq": operator.eq,
+}
+
+
+class _BatchOperation(NamedTuple):
+    name: str
+    method: str
+    path: str
+    query_params: Mapping[str, Any]
+    data: Optional[Mapping[str, Any]] = None
+    target: Any = None
+
+
+def _submit(executor: ThreadPoolExecutor, fn: Callable, *args: Any) -> Future:
+    # tasks run in a copy of the submitting context, e.g. to inherit deadlines
+    context = copy_context()
+    return executor.submit(lambda: context.run(fn, *args))
+
+
+def _cost(cost: int, nbytes: int, bytes_per_token: Optional[int]) -> int:
+    # transfers of known size are charged one token per bytes_per_token
+    if not bytes_per_token or not nbytes:
+        return cost
+    return max(cost, -(-nbytes // bytes_per_token))
+
+
+def _copy_blob_args(args: tuple, kwargs: dict) -> Tuple[tuple, dict]:
+    # hedged attempts run concurrently, each needs a blob object of its own
+    from google.cloud import storage  # type: ignore
+
+    return (
+        tuple(
+            arg.bucket.blob(
+                arg.name,
+                chunk_size=arg.chunk_size,
+                kms_key_name=arg.kms_key_name,
+                generation=arg.generation,
+            )
+            if isinstance(arg, storage.Blob)
+            else arg
+            for arg in args
+        ),
+        kwargs,
+    )
+
+
+def _blob_name(blob_name_or_blob: Union[str, storage.Blob]) -> str:
+    if isinstance(blob_name_or_blob, str):
+        return blob_name_or_blob
+    return blob_name_or_blob.name
+
+
+def _updated_predicate(
+    threshold: Union[str, datetime], cmp_op: str
+) -> Callable[[storage.Blob], bool]:
+    if isinstance(threshold, str):
+        threshold = datetime.strptime(threshold, "%Y-%m-%dT%H:%M:%S.%f%z")
+    if cmp_op not in _COMPARISON_OPERATORS:
+        raise ValueError("Unknown comparison operator")
+    # the operator is resolved once instead of for every blob
+    compare = _COMPARISON_OPERATORS[cmp_op]
+    return lambda blob: bool(getattr(blob, "updated", None)) and compare(
+        blob.updated, threshold
+    )
+
+
+def _index_entry(blob: storage.Blob) -> IndexEntry:
+    updated = blob.updated.isoformat() if blob.updated else None
+    return IndexEntry(blob.name, blob.generation, blob.size, updated)
+
+
+class _BlobRangeReader(io.RawIOBase):
+    """Seekable raw stream reading a blob through ranged requests."""
+
+    def __init__(
+        self,
+        size: int,
+        download_range: Callable[[int, int], bytes],
+        max_request_size: int,
+    ):
+        self._size = size
+        self._download_range = download_range
+        self._max_request_size = max_request_size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        else:
+            raise ValueError("Unknown whence")
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def _read_request(self, size: int) -> bytes:
+        request_size = min(size, self._max_request_size)
+        data = self._download_range(
+            self._pos, min(self._size, self._pos + request_size) - 1
+        )
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        # fills the buffer by requests of up to max_request_size bytes
+        view = memoryview(buffer).cast("B")
+        read = 0
+        while read < len(view) and self._pos < self._size:
+            data = self._read_request(len(view) - read)
+            if not data:
+                break
+            view[read : read + len(data)] = data
+            read += len(data)
+        return read
+
+    def readall(self) -> bytes:
+        chunks = []
+        while self._pos < self._size:
+            data = self._read_request(self._size - self._pos)
+            if not data:
+                break
+            chunks.append(data)
+        return b"".join(chunks)
+
+
+class _SliceWriter(io.RawIOBase):
+    """Writable stream copying downloaded data straight into a buffer slice."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        size = len(data)
+        self._view[self._pos : self._pos + size] = data
+        self._pos += size
+        return size
+
+
+class _BufferReader(io.RawIOBase):
+    """Seekable stream reading from a buffer without copying it."""
+
+    def __init__(self, view: memoryview):
+        self._view = view.cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError("Unknown whence")
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        data = self._view[self._pos : self._pos + len(buffer)]
+        buffer[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+@contextmanager
+def _buffer_view(
+    data: Union[bytes, bytearray, memoryview, str, os.PathLike]
+) -> Iterator[memoryview]:
+    # paths are memory mapped, buffers are used as they are
+    if not isinstance(data, (str, os.PathLike)):
+        yield memoryview(data).cast("B")
+        return
+    with open(data, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            yield memoryview(b"")
+            return
+        mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    try:
+        with memoryview(mapped) as view:
+            yield view
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # a traceback still references a reader of the mapping, which is
+            # unmapped once that is gone
+            logger.debug(f"deferring unmapping {data}")
+
+
+def _committed_offset(response: requests.Response) -> int:
+    # a 308 carries the persisted range as "bytes=0-<last byte>", if any
+    committed = response.headers.get("Range")
+    return int(committed.rsplit("-", 1)[1]) + 1 if committed else 0
+
+
+def _crc32c(view: memoryview, chunk_size: int = 1024 * 1024) -> str:
+    import google_crc32c  # type: ignore
+
+    # google_crc32c only accepts read-only buffers, hence the bounded copies
+    crc = 0
+    for start in range(0, len(view), chunk_size):
+        crc = google_crc32c.extend(crc, bytes(view[start : start + chunk_size]))
+    return base64.b64encode(crc.to_bytes(4, "big")).decode("ascii")
+
+
 class GCSHandler:
-    _default_backoff_params = {
-        "kind": "on_predicate",
-        "wait_gen": expo,
-        "predicate": _should_retry,
-        "on_backoff": backoff_hdlr,
-        "max_tries": 8,
-        "jitter": full_jitter,
-        "max_time": 600,
-    }
+    _default_backoff_params = ClassDefault(
+        partial(default_backoff_params, _should_retry)
+    )
     _default_ratelimit_params = {"calls": 15, "period": 900}
 
     def __init__(
@@ -71,9 +427,7 @@ class GCSHandler:
         api_endpoint: Optional[str] = None,
         **kwargs,
     ):
-        options = ClientOptions(api_endpoint=api_endpoint) if api_endpoint else None
-        if options and not credentials:
-            credentials, _ = default()
+        self._api_endpoint = api_endpoint
         use_backoff = kwargs.pop("use_backoff", False)
         self._backoff_params = kwargs.pop("backoff_params", None)
         if use_backoff or self._backoff_params:
@@ -81,14 +435,80 @@ class GCSHandler:
         use_ratelimit = kwargs.pop("use_ratelimit", False)
         self._ratelimit_params = kwargs.pop("ratelimit_params", None)
         self._ratelimiter = None
+        self._ratelimit_costs: Mapping[str, int] = {}
+        self._bytes_per_token: Optional[int] = None
         if use_ratelimit or self._ratelimit_params:
             self._ratelimit_params = (
                 self._ratelimit_params or self._default_ratelimit_params
             )
-            self._ratelimiter = RateLimiter(**self._ratelimit_params)
-        self.client = storage.Client(
-            project=project, credentials=credentials, client_options=options
+            self._ratelimiter = self._make_ratelimiter(self._ratelimit_params)
+        self._circuit_breaker = None
+        if self._backoff_params and self._backoff_params.get("circuit_breaker"):
+            self._circuit_breaker = self._backoff_params["circuit_breaker"]
+            if self._circuit_breaker is True:
+                # one breaker per endpoint shared by all handlers in the process
+                self._circuit_breaker = get_circuit_breaker(
+                    api_endpoint or _DEFAULT_API_ENDPOINT
+                )
+                self._backoff_params = {
+                    **self._backoff_params,
+                    "circuit_breaker": self._circuit_breaker,
+                }
+        if isinstance(self._ratelimiter, AdaptiveRateLimiter) and self._backoff_params:
+            # retry outcomes drive the adaptive rate
+            self._backoff_params = with_handlers(
+                self._backoff_params,
+                **feedback_handlers(
+                    self._ratelimiter.record_success,
+                    self._ratelimiter.record_throttle,
+                    _is_throttled,
+                ),
+            )
+        from google.cloud.storage.retry import is_generation_specified  # type: ignore
+
+        # retry policies are built once and shared by all calls
+        self._retry_policy = (
+            RetryPolicy(**self._backoff_params) if self._backoff_params else None
+        )
+        self._upload_retry_policy = (
+            ConditionalRetryPolicy(
+                is_generation_specified, ["query_params"], **self._backoff_params
+            )
+            if self._backoff_params
+            else None
         )
+        self._hedging_params = kwargs.pop("hedging_params", None) or {}
+        self._hedging_policies: Mapping[str, HedgingPolicy] = {
+            method: HedgingPolicy(
+                **params,
+                on_hedge=partial(self._try_limit_hedge, method),
+                hedge_args=_copy_blob_args,
+            )
+            for method, params in self._hedging_params.items()
+        }
+        self._cache_params = kwargs.pop("cache_params", None)
+        self._cache = BlobCache(**self._cache_params) if self._cache_params else None
+        from .clients import DEFAULT_POOL_SIZE, get_client
+
+        # handlers asking for it share pooled clients of the process
+        if kwargs.pop("shared_client", False):
+            self.client = get_client(
+                project,
+                credentials,
+                api_endpoint,
+                kwargs.pop("pool_size", DEFAULT_POOL_SIZE),
+            )
+        else:
+            from google.api_core.client_options import ClientOptions
+            from google.auth import default  # type: ignore
+            from google.cloud import storage  # type: ignore
+
+            options = ClientOptions(api_endpoint=api_endpoint) if api_endpoint else None
+            if options and not credentials:
+                credentials, _ = default()
+            self.client = storage.Client(
+                project=project, credentials=credentials, client_options=options
+            )
         self.bucket = self.client.bucket(bucket_name)
 
     def __exit__(
@@ -100,6 +520,8 @@ class GCSHandler:
         if self._ratelimiter:
             logger.debug("finalizing ratelimiter")
             self._ratelimiter.finalize()
+        for hedging_policy in self._hedging_policies.values():
+            hedging_policy.shutdown()
         if not type and not value and not traceback:
             return True
         print_exception(type, value, traceback)
@@ -116,85 +538,755 @@ class GCSHandler:
     def ratelimit_params(self) -> Mapping:
         return self._ratelimit_params
 
-    def list_blobs(self, prefix: Optional[str] = None) -> Iterator[storage.Blob]:
-        if self._ratelimiter:
-            self._ratelimiter.limit()
-        return self.client.list_blobs(
-            self.bucket,
-            prefix=prefix,
-            retry=SimpleRetrier(**self.backoff_params)
-            if self._backoff_params
-            else None,
+    @property
+    def hedging_params(self) -> Mapping:
+        return self._hedging_params
+
+    @property
+    def cache(self) -> Optional[BlobCache]:
+        return self._cache
+
+    def _make_ratelimiter(self, params: Mapping):
+        # costs, bytes_per_token and per_method are consumed here, everything
+        # else is passed on
+        params = dict(params)
+        self._ratelimit_costs = params.pop("costs", {})
+        self._bytes_per_token = params.pop("bytes_per_token", None)
+        per_method = params.pop("per_method", None)
+        if per_method:
+            return RateLimiterRegistry(
+                overrides=per_method if isinstance(per_method, Mapping) else None,
+                **params,
+            )
+        return make_ratelimiter(**params)
+
+    def _limit(self, method: str, nbytes: int = 0):
+        if self._circuit_breaker:
+            # fail before waiting for the ratelimiter while the circuit is open
+            self._circuit_breaker.check()
+        if not self._ratelimiter:
+            return
+        cost = _cost(
+            self._ratelimit_costs.get(method, 1), nbytes, self._bytes_per_token
+        )
+        if isinstance(self._ratelimiter, RateLimiterRegistry):
+            self._ratelimiter.limit(method, cost)
+        else:
+            self._ratelimiter.limit(cost)
+
+    def _try_limit(self, method: str, nbytes: int = 0) -> bool:
+        # hedges are optional, so they never wait for a permit
+        if self._circuit_breaker:
+            try:
+                self._circuit_breaker.check()
+            except CircuitOpenError:
+                return False
+        if not self._ratelimiter:
+            return True
+        cost = _cost(
+            self._ratelimit_costs.get(method, 1), nbytes, self._bytes_per_token
         )
+        if isinstance(self._ratelimiter, RateLimiterRegistry):
+            return self._ratelimiter.try_acquire(method, cost, timeout=0)
+        return self._ratelimiter.try_acquire(cost, timeout=0)
+
+    def _try_limit_hedge(self, method: str, *args: Any) -> bool:
+        from google.cloud import storage  # type: ignore
+
+        # backup transfers are charged by size like their first attempt
+        nbytes = sum(arg.size or 0 for arg in args if isinstance(arg, storage.Blob))
+        return self._try_limit(method, nbytes)
+
+    def _hedged(self, method: str, fn: Callable) -> Callable:
+        hedging_policy = self._hedging_policies.get(method)
+        return hedging_policy(fn) if hedging_policy else fn
+
+    def list_blobs(
+        self,
+        prefix: Optional[str] = None,
+        start_offset: Optional[str] = None,
+        match_glob: Optional[str] = None,
+        fields: Optional[str] = None,
+    ) -> Iterator[storage.Blob]:
+        self._limit("list_blobs")
+
+        def list_blobs() -> Iterator[storage.Blob]:
+            blobs = self.client.list_blobs(
+                self.bucket,
+                prefix=prefix,
+                start_offset=start_offset,
+                fields=fields,
+                retry=self._retry_policy,
+                **_glob_options(match_glob),
+            )
+            return _glob_filter(blobs, match_glob)
+
+        if "list_blobs" not in self._hedging_policies:
+            return list_blobs()
+        # a hedged listing has to be complete before it can win
+        return iter(self._hedged("list_blobs", lambda: list(list_blobs()))())
 
     def download_blob_into_memory(
         self, blob_name_or_blob: Union[str, storage.Blob]
     ) -> io.BytesIO:
-        if self._ratelimiter:
-            self._ratelimiter.limit()
-
         if isinstance(blob_name_or_blob, str):
             blob = self.bucket.blob(blob_name_or_blob)
             return self.download_blob_into_memory(blob)
 
+        if self._cache:
+            return self._download_cached(blob_name_or_blob, self._cache)
+        self._limit("download_blob_into_memory", blob_name_or_blob.size or 0)
+
+        def download(blob: storage.Blob) -> io.BytesIO:
+            file_obj = io.BytesIO()
+            blob.download_to_file(
+                file_obj,
+                retry=self._retry_policy,
+            )
+            file_obj.seek(0)
+            return file_obj
+
+        return self._hedged("download_blob_into_memory", download)(blob_name_or_blob)
+
+    def _download_cached(self, blob: storage.Blob, cache: BlobCache) -> io.BytesIO:
+        # the content of a generation never changes, only blobs without one
+        # are looked up by a metadata call and a new generation is a miss
+        blob = self._reload_blob(blob)
+        key = (self.bucket.name, blob.name, blob.generation)
+        data = cache.get(*key)
+        if data is not None:
+            return io.BytesIO(data)
+        self._limit("download_blob_into_memory", blob.size)
         file_obj = io.BytesIO()
-        blob_name_or_blob.download_to_file(
-            file_obj,
-            retry=SimpleRetrier(**self.backoff_params)
-            if self._backoff_params
-            else None,
-        )
+        self._pinned(blob).download_to_file(file_obj, retry=self._retry_policy)
+        cache.put(*key, file_obj.getbuffer())
         file_obj.seek(0)
         return file_obj
 
+    def _reload_blob(
+        self, blob_name_or_blob: Union[str, storage.Blob], *fields: str
+    ) -> storage.Blob:
+        blob = (
+            self.bucket.blob(blob_name_or_blob)
+            if isinstance(blob_name_or_blob, str)
+            else blob_name_or_blob
+        )
+        if any(
+            getattr(blob, field) is None for field in ("size", "generation", *fields)
+        ):
+            # a blob with a generation is reloaded at that generation
+            self._limit("reload_blob")
+            blob.reload(retry=self._retry_policy)
+        return blob
+
+    def _pinned(self, blob: storage.Blob) -> storage.Blob:
+        # pins the generation so that subsequent ranged reads are consistent
+        return self.bucket.blob(blob.name, generation=blob.generation)
+
+    def _download_range(self, blob: storage.Blob, start: int, end: int) -> bytes:
+        self._limit("download_range", end - start + 1)
+        return blob.download_as_bytes(
+            start=start, end=end, checksum=None, retry=self._retry_policy
+        )
+
+    def open_blob_stream(
+        self,
+        blob_name_or_blob: Union[str, storage.Blob],
+        buffer_size: int = 8 * 1024 * 1024,
+    ) -> io.BufferedReader:
+        """Opens a seekable, buffered stream over a blob.
+
+        Data is fetched by ranged requests of up to `buffer_size` bytes, which
+        bounds the memory held by the stream apart from the results of `read`.
+        Every ranged request is charged to the ratelimiter as download_range.
+        """
+        blob = self._reload_blob(blob_name_or_blob)
+        return io.BufferedReader(
+            _BlobRangeReader(
+                blob.size,
+                partial(self._download_range, self._pinned(blob)),
+                buffer_size,
+            ),
+            buffer_size=buffer_size,
+        )
+
+    def iter_blob_chunks(
+        self,
+        blob_name_or_blob: Union[str, storage.Blob],
+        chunk_size: int = 8 * 1024 * 1024,
+    ) -> Iterator[bytes]:
+        blob = self._reload_blob(blob_name_or_blob)
+        pinned, size = self._pinned(blob), blob.size
+        for start in range(0, size, chunk_size):
+            yield self._download_range(pinned, start, min(size, start + chunk_size) - 1)
+
+    def download_blob_sliced(
+        self,
+        blob_name_or_blob: Union[str, storage.Blob],
+        destination: Optional[Union[bytearray, memoryview, str]] = None,
+        slices: int = 8,
+        max_slice_attempts: int = 3,
+    ) -> Union[bytearray, memoryview, mmap.mmap]:
+        """Downloads a blob as concurrent byte range slices.
+
+        Slices are written straight into `destination`, a preallocated
+        bytearray/memoryview or the path of a file which is memory mapped and
+        returned. A bytearray is allocated if no destination is given. Failed
+        slices are retried up to `max_slice_attempts` times and the CRC32C of
+        the assembled object is verified.
+        """
+        blob = self._reload_blob(blob_name_or_blob, "crc32c")
+        pinned, size = self._pinned(blob), blob.size
+        buffer: Union[bytearray, memoryview, mmap.mmap]
+        if destination is None:
+            buffer = bytearray(size)
+        elif isinstance(destination, str):
+            with open(destination, "w+b") as f:
+                f.truncate(size)
+                if not size:
+                    return memoryview(b"")
+                buffer = mmap.mmap(f.fileno(), size)
+        else:
+            buffer = destination
+        view = memoryview(buffer)
+        if len(view) < size:
+            raise ValueError(f"Destination holds less than {size} bytes")
+
+        def download_slice(start: int, end: int):
+            self._limit("download_range", end - start + 1)
+            pinned.download_to_file(
+                _SliceWriter(view[start : end + 1]),
+                start=start,
+                end=end,
+                checksum=None,
+                retry=self._retry_policy,
+            )
+
+        slice_size = max(1, -(-size // max(1, slices)))
+        pending = [
+            (start, min(size, start + slice_size) - 1)
+            for start in range(0, size, slice_size)
+        ]
+        with ThreadPoolExecutor(
+            max_workers=max(1, len(pending)), thread_name_prefix="gcs-slice"
+        ) as executor:
+            for _ in range(max_slice_attempts):
+                futures = {}
+                for start, end in pending:
+                    future = _submit(executor, download_slice, start, end)
+                    futures[future] = (start, end)
+                wait(futures)
+                failed = {f: r for f, r in futures.items() if f.exception()}
+                if not failed:
+                    break
+                pending = list(failed.values())
+                logger.debug(f"retrying {len(pending)} failed slices of {blob.name}")
+            else:
+                raise next(iter(failed)).exception()  # type: ignore
+
+        checksum = _crc32c(view[:size])
+        if blob.crc32c and checksum != blob.crc32c:
+            raise ValueError(
+                f"CRC32C mismatch for {blob.name}: {checksum} != {blob.crc32c}"
+            )
+        return buffer
+
     def upload_blob_from_memory(
         self, blob_name_or_blob: Union[str, storage.Blob], file_obj: io.BytesIO
     ):
-        if self._ratelimiter:
-            self._ratelimiter.limit()
-
         if isinstance(blob_name_or_blob, str):
             blob = self.bucket.blob(blob_name_or_blob)
             return self.upload_blob_from_memory(blob, file_obj)
 
+        self._limit("upload_blob_from_memory", file_obj.getbuffer().nbytes)
         file_obj.seek(0)
         blob_name_or_blob.upload_from_file(
             file_obj,
-            retry=ConditionalRetrier(
-                is_generation_specified, ["query_params"], **self._backoff_params
-            )
-            if self._backoff_params
-            else None,
+            retry=self._upload_retry_policy,
         )
 
-    @staticmethod
-    def filter_updated(
-        blobs: Iterator[storage.Blob], threshold: Union[str, datetime], cmp_op="gt"
+    def _conditional_retry_policy(
+        self, if_generation_match: Optional[int]
+    ) -> Optional[Callable]:
+        # the client library only evaluates its own conditional policies
+        if not self._upload_retry_policy:
+            return None
+        return self._upload_retry_policy.get_retry_policy_if_conditions_met(
+            query_params={"ifGenerationMatch": if_generation_match}
+        )
+
+    def upload_blob(
+        self,
+        blob_name_or_blob: Union[str, storage.Blob],
+        data: Union[bytes, bytearray, memoryview, str, os.PathLike],
+        content_type: Optional[str] = None,
+        if_generation_match: Optional[int] = None,
+        chunk_size: int = 8 * 1024 * 1024,
+        composite_threshold: Optional[int] = None,
+        max_workers: int = 8,
     ):
-        if isinstance(threshold, str):
-            return GCSHandler.filter_updated(
-                blobs, datetime.strptime(threshold, "%Y-%m-%dT%H:%M:%S.%f%z"), cmp_op
+        """Uploads a buffer or the file at a path without copying it.
+
+        Payloads larger than `chunk_size` are sent as a resumable upload which
+        continues from the last committed offset after a failure. With a
+        `composite_threshold`, larger payloads are instead uploaded as parallel
+        parts and composed. Retries are only enabled if `if_generation_match`
+        makes the final write idempotent.
+        """
+        assert chunk_size % _RESUMABLE_CHUNK_MULTIPLE == 0
+        blob = (
+            self.bucket.blob(blob_name_or_blob)
+            if isinstance(blob_name_or_blob, str)
+            else blob_name_or_blob
+        )
+        with _buffer_view(data) as view:
+            if composite_threshold is not None and len(view) > composite_threshold:
+                self._upload_composite(
+                    blob, view, content_type, if_generation_match, max_workers
+                )
+            elif len(view) > chunk_size:
+                self._upload_resumable(
+                    blob, view, content_type, if_generation_match, chunk_size
+                )
+            else:
+                self._limit("upload_blob", len(view))
+                blob.upload_from_file(
+                    _BufferReader(view),
+                    size=len(view),
+                    content_type=content_type,
+                    if_generation_match=if_generation_match,
+                    retry=self._conditional_retry_policy(if_generation_match),
+                )
+
+    def _upload_resumable(
+        self,
+        blob: storage.Blob,
+        view: memoryview,
+        content_type: Optional[str],
+        if_generation_match: Optional[int],
+        chunk_size: int,
+    ):
+        import requests
+        from google.api_core import exceptions as api_exceptions
+
+        size = len(view)
+        self._limit("upload_blob")
+        session_url = blob.create_resumable_upload_session(
+            content_type=content_type,
+            size=size,
+            if_generation_match=if_generation_match,
+            retry=self._conditional_retry_policy(if_generation_match),
+        )
+        # the session URL authorizes the upload, no credentials are needed
+        transport = requests.Session()
+        offset = 0
+        resync = False
+
+        def put(data: Any, content_range: str) -> requests.Response:
+            response = transport.put(
+                session_url, data=data, headers={"Content-Range": content_range}
+            )
+            if response.status_code not in (200, 201, 308):
+                raise api_exceptions.from_http_response(response)
+            return response
+
+        def upload_chunk() -> Optional[requests.Response]:
+            nonlocal offset, resync
+            if resync:
+                # the session knows how much of a failed chunk was persisted
+                response = put(None, f"bytes */{size}")
+                if response.status_code != 308:
+                    return response
+                offset = _committed_offset(response)
+            resync = True
+            end = min(size, offset + chunk_size)
+            response = put(
+                _BufferReader(view[offset:end]), f"bytes {offset}-{end - 1}/{size}"
             )
+            resync = False
+            if response.status_code != 308:
+                return response
+            offset = _committed_offset(response)
+            return None
 
-        def resolve_op(
-            lhs: storage.Blob, rhs: datetime = cast(datetime, threshold)
-        ) -> bool:
-            if hasattr(lhs, "updated"):
-                if not lhs.updated:
-                    return False
+        # chunks of one session are idempotent, so they are always retried
+        if self._retry_policy:
+            upload_chunk = self._retry_policy(upload_chunk)
+        try:
+            while True:
+                self._limit("upload_chunk", min(chunk_size, size - offset))
+                if upload_chunk() is not None:
+                    return
+        finally:
+            transport.close()
+
+    def _upload_composite(
+        self,
+        blob: storage.Blob,
+        view: memoryview,
+        content_type: Optional[str],
+        if_generation_match: Optional[int],
+        max_workers: int,
+    ):
+        size = len(view)
+        part_size = -(-size // _MAX_COMPOSE_COMPONENTS)
+        prefix = f"{blob.name}.parts-{uuid.uuid4().hex}/"
+        parts = [
+            (self.bucket.blob(f"{prefix}{i:02d}"), start, min(size, start + part_size))
+            for i, start in enumerate(range(0, size, part_size))
+        ]
+
+        def upload_part(part: storage.Blob, start: int, end: int):
+            self._limit("upload_part", end - start)
+            # ifGenerationMatch=0 only creates the part, so retries are safe
+            part.upload_from_file(
+                _BufferReader(view[start:end]),
+                size=end - start,
+                content_type=content_type,
+                if_generation_match=0,
+                retry=self._conditional_retry_policy(0),
+            )
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="gcs-part"
+            ) as executor:
+                futures = [_submit(executor, upload_part, *part) for part in parts]
+                for future in futures:
+                    future.result()
+            self._limit("compose")
+            blob.content_type = content_type
+            blob.compose(
+                [part for part, _, _ in parts],
+                if_generation_match=if_generation_match,
+                retry=self._conditional_retry_policy(if_generation_match),
+            )
+        finally:
+            self._limit("delete_parts")
+            self.bucket.delete_blobs(
+                [part for part, _, _ in parts], on_error=lambda part: None
+            )
+
+    def _run_many(
+        self,
+        fn: Callable,
+        jobs: Iterable[Tuple[Union[str, storage.Blob], ...]],
+        max_workers: int,
+    ) -> Iterator[BatchResult]:
+        # at most max_workers jobs are in flight, jobs are consumed lazily
+        with ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="gcs-batch"
+        ) as executor:
+            pending: Set[Future] = set()
+            names: Dict[Future, str] = {}
+            for job in jobs:
+                if len(pending) >= max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from (self._batch_result(names.pop(f), f) for f in done)
+                future = _submit(executor, fn, *job)
+                names[future] = _blob_name(job[0])
+                pending.add(future)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (self._batch_result(names.pop(f), f) for f in done)
+
+    @staticmethod
+    def _batch_result(name: str, future: Future) -> BatchResult:
+        error = future.exception()
+        if error:
+            logger.debug(f"batch operation on {name} failed: {error}")
+            return BatchResult(name, None, error)
+        return BatchResult(name, future.result(), None)
+
+    def download_many(
+        self,
+        blob_names_or_blobs: Iterable[Union[str, storage.Blob]],
+        max_workers: int = 8,
+    ) -> Iterator[BatchResult]:
+        """Downloads blobs concurrently into memory.
+
+        Results are yielded as downloads finish, a failed download is reported
+        by the error of its result instead of aborting the batch.
+        """
+        return self._run_many(
+            self.download_blob_into_memory,
+            ((blob,) for blob in blob_names_or_blobs),
+            max_workers,
+        )
+
+    def upload_many(
+        self,
+        uploads: Iterable[Tuple[Union[str, storage.Blob], io.BytesIO]],
+        max_workers: int = 8,
+    ) -> Iterator[BatchResult]:
+        """Uploads (blob, file_obj) pairs concurrently, see `download_many`."""
+        return self._run_many(self.upload_blob_from_memory, uploads, max_workers)
+
+    def _as_blob(self, blob_name_or_blob: Union[str, storage.Blob]) -> storage.Blob:
+        if isinstance(blob_name_or_blob, str):
+            return self.bucket.blob(blob_name_or_blob)
+        return blob_name_or_blob
+
+    def _run_batched(
+        self,
+        method: str,
+        operations: Iterable[_BatchOperation],
+        batch_size: int,
+    ) -> Iterator[Tuple[_BatchOperation, BatchResult]]:
+        assert 0 < batch_size <= _MAX_BATCH_SIZE, "GCS batches hold 1-100 requests"
+        operations = iter(operations)
+        while True:
+            group = list(islice(operations, batch_size))
+            if not group:
+                return
+            yield from self._run_batch(method, group)
+
+    def _run_batch(
+        self, method: str, operations: List[_BatchOperation]
+    ) -> List[Tuple[_BatchOperation, BatchResult]]:
+        from google.api_core import exceptions as api_exceptions
+
+        results: List[Tuple[_BatchOperation, BatchResult]] = []
+        failed: List[Tuple[_BatchOperation, Optional[Exception]]] = [
+            (operation, None) for operation in operations
+        ]
+
+        def send_batch():
+            nonlocal failed
+            self._limit(method)
+            batch_type, finishes_unraised = _batch_type()
+            batch = batch_type(self.client)
+            if self._api_endpoint:
+                batch.API_BASE_URL = self._api_endpoint
+            for operation, _ in failed:
+                batch.api_request(
+                    method=operation.method,
+                    path=operation.path,
+                    query_params=operation.query_params,
+                    data=operation.data,
+                )
+            if finishes_unraised:
+                responses = batch.finish(raise_exception=False)
             else:
-                return False
-            if cmp_op == "gt":
-                return lhs.updated > rhs
-            elif cmp_op == "ge":
-                return lhs.updated >= rhs
-            elif cmp_op == "lt":
-                return lhs.updated < rhs
-            elif cmp_op == "le":
-                return lhs.updated <= rhs
-            elif cmp_op == "eq":
-                return lhs.updated == rhs
+                responses = batch.finish()
+            retry = []
+            for (operation, _), response in zip(failed, responses):
+                if 200 <= response.status_code < 300:
+                    value = response.json() if response.content else None
+                    results.append(
+                        (operation, BatchResult(operation.name, value, None))
+                    )
+                    continue
+                error = api_exceptions.from_http_response(response)
+                if _should_retry(error):
+                    retry.append((operation, error))
+                else:
+                    results.append(
+                        (operation, BatchResult(operation.name, None, error))
+                    )
+            failed = retry
+            if failed:
+                # the retry policy resends the failed sub-requests only
+                logger.debug(f"{len(failed)} sub-requests of {method} failed")
+                raise failed[0][1]  # type: ignore
+
+        try:
+            if self._retry_policy:
+                self._retry_policy(send_batch)()
             else:
-                raise ValueError("Unknown comparison operator")
+                send_batch()
+        except Exception as err:
+            results.extend(
+                (operation, BatchResult(operation.name, None, error or err))
+                for operation, error in failed
+            )
+        return results
+
+    def delete_many(
+        self,
+        blob_names_or_blobs: Iterable[Union[str, storage.Blob]],
+        batch_size: int = _MAX_BATCH_SIZE,
+    ) -> Iterator[BatchResult]:
+        """Deletes blobs through batch requests of up to `batch_size` deletions.
+
+        Every batch is charged to the ratelimiter once. Sub-requests which fail
+        with a retryable error are resent by the retry policy, all others are
+        reported by the error of their result.
+        """
+
+        def operations() -> Iterator[_BatchOperation]:
+            for blob in map(self._as_blob, blob_names_or_blobs):
+                query_params = (
+                    {"generation": blob.generation} if blob.generation else {}
+                )
+                yield _BatchOperation(blob.name, "DELETE", blob.path, query_params)
 
-        return filter(resolve_op, blobs)
+        batched = self._run_batched("delete_many", operations(), batch_size)
+        return (result for _, result in batched)
+
+    def _transfer_operations(
+        self,
+        kind: str,
+        pairs: Iterable[Tuple[Union[str, storage.Blob], str]],
+        destination_bucket: Optional[str],
+    ) -> Iterator[_BatchOperation]:
+        bucket = (
+            self.client.bucket(destination_bucket)
+            if destination_bucket
+            else self.bucket
+        )
+        for source_name_or_blob, destination_name in pairs:
+            source = self._as_blob(source_name_or_blob)
+            destination = bucket.blob(destination_name)
+            yield _BatchOperation(
+                source.name,
+                "POST",
+                f"{source.path}/{kind}{destination.path}",
+                {"sourceGeneration": source.generation} if source.generation else {},
+                {},
+                (source, destination),
+            )
+
+    def copy_many(
+        self,
+        pairs: Iterable[Tuple[Union[str, storage.Blob], str]],
+        destination_bucket: Optional[str] = None,
+        batch_size: int = _MAX_BATCH_SIZE,
+    ) -> Iterator[BatchResult]:
+        """Copies (source, destination name) pairs, see `delete_many`.
+
+        The value of a result is the resource of the copy.
+        """
+        operations = self._transfer_operations("copyTo", pairs, destination_bucket)
+        batched = self._run_batched("copy_many", operations, batch_size)
+        return (result for _, result in batched)
+
+    def rewrite_many(
+        self,
+        pairs: Iterable[Tuple[Union[str, storage.Blob], str]],
+        destination_bucket: Optional[str] = None,
+        batch_size: int = _MAX_BATCH_SIZE,
+    ) -> Iterator[BatchResult]:
+        """Rewrites (source, destination name) pairs, see `delete_many`.
+
+        Rewrites which do not complete within their batch are continued one by
+        one with their rewrite token. The value of a result is the resource of
+        the rewritten object.
+        """
+        operations = self._transfer_operations("rewriteTo", pairs, destination_bucket)
+        for operation, result in self._run_batched(
+            "rewrite_many", operations, batch_size
+        ):
+            if result.error or result.value["done"]:
+                yield result._replace(value=result.value and result.value["resource"])
+                continue
+            source, destination = operation.target
+            token = result.value["rewriteToken"]
+            try:
+                while token:
+                    self._limit("rewrite_many")
+                    token, _, _ = destination.rewrite(
+                        source, token=token, retry=self._retry_policy
+                    )
+            except Exception as err:
+                yield BatchResult(result.name, None, err)
+                continue
+            yield BatchResult(result.name, destination._properties, None)
+
+    def patch_metadata_many(
+        self,
+        updates: Iterable[Tuple[Union[str, storage.Blob], Mapping[str, Optional[str]]]],
+        batch_size: int = _MAX_BATCH_SIZE,
+    ) -> Iterator[BatchResult]:
+        """Patches the custom metadata of (blob, metadata) pairs, see
+        `delete_many`.
+
+        Keys mapped to None are removed. The value of a result is the patched
+        resource.
+        """
+
+        def operations() -> Iterator[_BatchOperation]:
+            for blob_name_or_blob, metadata in updates:
+                blob = self._as_blob(blob_name_or_blob)
+                yield _BatchOperation(
+                    blob.name, "PATCH", blob.path, {}, {"metadata": metadata}
+                )
+
+        batched = self._run_batched("patch_metadata_many", operations(), batch_size)
+        return (result for _, result in batched)
+
+    def _list_index_entries(
+        self,
+        prefix: Optional[str],
+        start_offset: Optional[str],
+        match_glob: Optional[str],
+    ) -> List[IndexEntry]:
+        return [
+            _index_entry(blob)
+            for blob in self.list_blobs(
+                prefix,
+                start_offset=start_offset,
+                match_glob=match_glob,
+                fields=_INDEX_FIELDS,
+            )
+        ]
+
+    def sync_index(
+        self,
+        index: BucketIndex,
+        prefix: Optional[str] = None,
+        match_glob: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        incremental: bool = False,
+        max_workers: int = 8,
+    ) -> List[IndexChange]:
+        """Lists a prefix into `index` and returns the objects added, changed
+        or deleted since the last sync.
+
+        Listings only request the fields kept by the index. With a `delimiter`
+        the sub-prefixes below `prefix` are listed in parallel. An
+        `incremental` sync lists names from the watermark of the index on,
+        which suits append-only layouts such as date partitioned names but
+        cannot report deletions or changes below the watermark.
+        """
+        scope = index.scope(prefix, match_glob)
+        start_offset = index.watermark(scope) if incremental else None
+        entries: List[IndexEntry] = []
+        shards = [prefix]
+        if delimiter:
+            self._limit("list_blobs")
+            iterator = self.client.list_blobs(
+                self.bucket,
+                prefix=prefix,
+                delimiter=delimiter,
+                start_offset=start_offset,
+                fields=_INDEX_FIELDS,
+                retry=self._retry_policy,
+                **_glob_options(match_glob),
+            )
+            entries.extend(
+                _index_entry(blob) for blob in _glob_filter(iterator, match_glob)
+            )
+            shards = sorted(iterator.prefixes)
+        with ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="gcs-list"
+        ) as executor:
+            futures = [
+                _submit(
+                    executor,
+                    self._list_index_entries,
+                    shard,
+                    start_offset,
+                    match_glob,
+                )
+                for shard in shards
+            ]
+            for future in futures:
+                entries.extend(future.result())
+        return index.update(scope, entries, complete=not incremental)
+
+    @staticmethod
+    def filter_updated(
+        blobs: Iterator[storage.Blob], threshold: Union[str, datetime], cmp_op="gt"
+    ):
+        return filter(_updated_predicate(threshold, cmp_op), blobs)
@@ -0,0 +1,133 @@
+import sqlite3
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+
+class IndexEntry(NamedTuple):
+    name: str
+    generation: int
+    size: int
+    updated: Optional[str]
+
+
+class IndexChange(NamedTuple):
+    kind: str  # added, changed or deleted
+    name: str
+    generation: int
+    size: int
+    updated: Optional[str]
+
+
+class BucketIndex:
+    """Persistent manifest of the objects listed under a scope of a bucket.
+
+    A scope is a prefix and an optional glob, every scope keeps its own rows
+    so that deletions are only detected among objects a listing could have
+    returned. `update` diffs a listing against the stored rows inside sqlite
+    and records the greatest listed name as the watermark of the scope.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS objects (
+            scope TEXT NOT NULL,
+            name TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            updated TEXT,
+            PRIMARY KEY (scope, name)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS watermarks (
+            scope TEXT PRIMARY KEY,
+            name TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(self._schema)
+
+    def __enter__(self) -> "BucketIndex":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    @staticmethod
+    def scope(prefix: Optional[str] = None, match_glob: Optional[str] = None) -> str:
+        return f"{prefix or ''}\0{match_glob or ''}"
+
+    def watermark(self, scope: str) -> Optional[str]:
+        row = self._connection.execute(
+            "SELECT name FROM watermarks WHERE scope = ?", (scope,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def entries(self, scope: str) -> Iterator[IndexEntry]:
+        cursor = self._connection.execute(
+            "SELECT name, generation, size, updated FROM objects"
+            " WHERE scope = ? ORDER BY name",
+            (scope,),
+        )
+        return (IndexEntry(*row) for row in cursor)
+
+    def update(
+        self, scope: str, listed: Iterable[IndexEntry], complete: bool = True
+    ) -> List[IndexChange]:
+        """Stores a listing of a scope and returns how it differs.
+
+        Deleted objects are only reported for a `complete` listing, a listing
+        which started at the watermark can only add or change objects.
+        """
+        with self._connection:
+            cursor = self._connection.cursor()
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS listed ("
+                " name TEXT PRIMARY KEY, generation INTEGER, size INTEGER,"
+                " updated TEXT)"
+            )
+            cursor.execute("DELETE FROM listed")
+            cursor.executemany(
+                "INSERT OR REPLACE INTO listed VALUES (?, ?, ?, ?)", listed
+            )
+            changes = [
+                IndexChange(*row)
+                for row in cursor.execute(
+                    "SELECT CASE WHEN o.name IS NULL THEN 'added' ELSE 'changed'"
+                    " END, l.name, l.generation, l.size, l.updated FROM listed l"
+                    " LEFT JOIN objects o ON o.scope = ? AND o.name = l.name"
+                    " WHERE o.name IS NULL OR o.generation != l.generation",
+                    (scope,),
+                )
+            ]
+            if complete:
+                changes.extend(
+                    IndexChange("deleted", *row)
+                    for row in cursor.execute(
+                        "SELECT name, generation, size, updated FROM objects o"
+                        " WHERE scope = ? AND NOT EXISTS"
+                        " (SELECT 1 FROM listed l WHERE l.name = o.name)",
+                        (scope,),
+                    )
+                )
+                cursor.execute(
+                    "DELETE FROM objects WHERE scope = ? AND name NOT IN"
+                    " (SELECT name FROM listed)",
+                    (scope,),
+                )
+            cursor.execute(
+                "INSERT OR REPLACE INTO objects"
+                " SELECT ?, name, generation, size, updated FROM listed",
+                (scope,),
+            )
+            (last,) = cursor.execute("SELECT max(name) FROM listed").fetchone()
+            watermark = self.watermark(scope)
+            if last and (complete or not watermark or last > watermark):
+                cursor.execute(
+                    "INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (scope, last)
+                )
+            elif not last and complete:
+                cursor.execute("DELETE FROM watermarks WHERE scope = ?", (scope,))
+            cursor.execute("DELETE FROM listed")
+        return sorted(changes, key=lambda change: change.name)
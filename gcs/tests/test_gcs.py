@@ -1,11 +1,634 @@
-from gcs import __version__
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from gcs import __version__, AsyncGCSHandler, BlobCache, BucketIndex, GCSHandler
+from gcs.clients import ClientRegistry
+from google.auth.credentials import AnonymousCredentials  # type: ignore
+from google.cloud import storage  # type: ignore
+from retry import constant
+import base64
+import mmap
+import os
+import re
+import subprocess
+import sys
+import requests
+import io
+from datetime import datetime, timezone
+import tempfile
+import google_crc32c  # type: ignore
+import time
 import unittest
+from unittest import mock
+
+
+def _handler(**kwargs) -> GCSHandler:
+    return GCSHandler(
+        "project", "bucket", credentials=AnonymousCredentials(), **kwargs
+    )
 
 
 class GCSTests(unittest.TestCase):
     def test_version(self):
         self.assertEqual(__version__, "0.1.0")
 
+    def test_per_method_ratelimit_costs(self):
+        with _handler(
+            ratelimit_params={
+                "kind": "token_bucket",
+                "calls": 4,
+                "period": 60,
+                "per_method": True,
+                "costs": {"download_blob_into_memory": 4},
+            }
+        ) as handler:
+            handler._limit("download_blob_into_memory")
+            self.assertFalse(
+                handler._ratelimiter.try_acquire(
+                    "download_blob_into_memory", timeout=0
+                )
+            )
+            # cheap calls do not queue behind downloads
+            self.assertTrue(handler._ratelimiter.try_acquire("list_blobs", timeout=0))
+
+    def test_transfers_are_charged_by_size(self):
+        with _handler(
+            ratelimit_params={
+                "kind": "token_bucket",
+                "calls": 8,
+                "period": 60,
+                "bytes_per_token": 1024,
+            }
+        ) as handler:
+            handler._limit("download_range", 3 * 1024 + 1)
+            self.assertFalse(handler._ratelimiter.try_acquire(cost=5, timeout=0))
+            self.assertTrue(handler._ratelimiter.try_acquire(cost=4, timeout=0))
+
+    def test_list_blobs_accepts_the_locked_client(self):
+        with _handler() as handler:
+            # the listing is lazy, no request is sent
+            blobs = handler.list_blobs(prefix="a/")
+            self.assertEqual(blobs.extra_params["prefix"], "a/")
+
+    def test_circuit_breaker_is_shared_per_endpoint(self):
+        params = {**GCSHandler._default_backoff_params, "circuit_breaker": True}
+        first = _handler(backoff_params=params)
+        second = _handler(backoff_params=params)
+        other = _handler(backoff_params=params, api_endpoint="http://localhost:9023")
+        self.assertIs(first._circuit_breaker, second._circuit_breaker)
+        self.assertIsNot(first._circuit_breaker, other._circuit_breaker)
+
+    def test_hedged_download_is_charged_to_the_ratelimiter(self):
+        delays = iter([1.0, 0.0])
+        blobs = []
+
+        def download_to_file(blob, file_obj, retry=None):
+            blobs.append(blob)
+            time.sleep(next(delays))
+            file_obj.write(b"content")
+
+        with _handler(
+            ratelimit_params={"kind": "token_bucket", "calls": 10, "period": 60},
+            hedging_params={"download_blob_into_memory": {"delay": 0.05}},
+        ) as handler, mock.patch.object(
+            storage.Blob, "download_to_file", download_to_file
+        ):
+            blob = handler.bucket.blob("name")
+            self.assertEqual(
+                handler.download_blob_into_memory(blob).read(), b"content"
+            )
+            self.assertFalse(handler._ratelimiter.try_acquire(cost=9, timeout=0))
+            self.assertTrue(handler._ratelimiter.try_acquire(cost=8, timeout=0))
+        # the hedge does not share the blob of the caller
+        self.assertIs(blobs[0], blob)
+        self.assertIsNot(blobs[1], blob)
+        self.assertEqual(blobs[1].name, "name")
+
+    def test_hedged_download_is_charged_by_size(self):
+        delays = iter([1.0, 0.0])
+
+        def download_to_file(blob, file_obj, retry=None):
+            time.sleep(next(delays))
+            file_obj.write(b"content")
+
+        with _handler(
+            ratelimit_params={
+                "kind": "token_bucket",
+                "calls": 10,
+                "period": 60,
+                "bytes_per_token": 1024,
+            },
+            hedging_params={"download_blob_into_memory": {"delay": 0.05}},
+        ) as handler, mock.patch.object(
+            storage.Blob, "download_to_file", download_to_file
+        ):
+            blob = handler.bucket.blob("name")
+            blob._properties["size"] = "3072"
+            handler.download_blob_into_memory(blob)
+            # both attempts were charged three tokens
+            self.assertFalse(handler._ratelimiter.try_acquire(cost=5, timeout=0))
+            self.assertTrue(handler._ratelimiter.try_acquire(cost=4, timeout=0))
+
+    def test_hedge_is_skipped_without_permit(self):
+        calls = []
+
+        def download_to_file(blob, file_obj, retry=None):
+            calls.append(blob)
+            time.sleep(0.3)
+            file_obj.write(b"content")
+
+        with _handler(
+            ratelimit_params={"kind": "token_bucket", "calls": 1, "period": 60},
+            hedging_params={"download_blob_into_memory": {"delay": 0.05}},
+        ) as handler, mock.patch.object(
+            storage.Blob, "download_to_file", download_to_file
+        ):
+            self.assertEqual(
+                handler.download_blob_into_memory("name").read(), b"content"
+            )
+        self.assertEqual(len(calls), 1)
+
+    def test_download_many_reports_errors_per_blob(self):
+        with _handler() as handler, mock.patch.object(
+            handler, "download_blob_into_memory"
+        ) as download:
+            download.side_effect = lambda name: name.encode() if name != "b" else 1 / 0
+            results = {
+                result.name: result
+                for result in handler.download_many(["a", "b", "c"], max_workers=2)
+            }
+        self.assertEqual(results["a"].value, b"a")
+        self.assertIsInstance(results["b"].error, ZeroDivisionError)
+        self.assertEqual(results["c"].value, b"c")
+
+    def test_blob_stream_reads_ranges_within_buffer_size(self):
+        content = bytes(range(256)) * 4
+        requested = []
+
+        def download_as_bytes(blob, start, end, **kwargs):
+            requested.append((start, end))
+            return content[start : end + 1]
+
+        with _handler() as handler, mock.patch.object(
+            storage.Blob, "download_as_bytes", download_as_bytes
+        ):
+            blob = handler.bucket.blob("blob")
+            blob._properties.update(size=str(len(content)), generation="1")
+            stream = handler.open_blob_stream(blob, buffer_size=256)
+            self.assertEqual(stream.read(10), content[:10])
+            stream.seek(700)
+            self.assertEqual(stream.read(), content[700:])
+            self.assertEqual(
+                b"".join(handler.iter_blob_chunks(blob, chunk_size=300)), content
+            )
+        self.assertTrue(all(end - start < 300 for start, end in requested))
+
+    def test_blob_stream_reads_all_by_large_requests(self):
+        content = bytes(range(256)) * 4
+        requested = []
+
+        def download_as_bytes(blob, start, end, **kwargs):
+            requested.append((start, end))
+            return content[start : end + 1]
+
+        with _handler() as handler, mock.patch.object(
+            storage.Blob, "download_as_bytes", download_as_bytes
+        ):
+            blob = handler.bucket.blob("blob")
+            blob._properties.update(size=str(len(content)), generation="1")
+            self.assertEqual(
+                handler.open_blob_stream(blob, buffer_size=512).read(), content
+            )
+            self.assertEqual(
+                handler.open_blob_stream(blob, buffer_size=256).read(1000),
+                content[:1000],
+            )
+        # 8 KB reads of the default readall would take a request each
+        self.assertEqual(
+            requested,
+            [(0, 511), (512, 1023), (0, 255), (256, 511), (512, 767), (768, 1023)],
+        )
+
+    def test_sliced_download_retries_failed_slices_only(self):
+        content = bytes(range(256)) * 5
+        crc = google_crc32c.value(content).to_bytes(4, "big")
+        requested = []
+
+        def download_to_file(blob, file_obj, start, end, **kwargs):
+            requested.append(start)
+            if requested.count(start) == 1 and start == 320:
+                raise ConnectionError()
+            file_obj.write(content[start : end + 1])
+
+        with _handler() as handler, mock.patch.object(
+            storage.Blob, "download_to_file", download_to_file
+        ):
+            blob = handler.bucket.blob("blob")
+            blob._properties.update(
+                size=str(len(content)),
+                generation="1",
+                crc32c=base64.b64encode(crc).decode(),
+            )
+            self.assertEqual(handler.download_blob_sliced(blob, slices=4), content)
+            self.assertEqual(sorted(requested), [0, 320, 320, 640, 960])
+
+            blob._properties["crc32c"] = base64.b64encode(b"0000").decode()
+            with self.assertRaises(ValueError):
+                handler.download_blob_sliced(blob, slices=4)
+
+    def test_cached_download_is_keyed_by_generation(self):
+        generations = iter(["1", "1", "2"])
+
+        def reload(blob, **kwargs):
+            blob._properties.update(size="7", generation=next(generations))
+
+        def download_to_file(blob, file_obj, **kwargs):
+            file_obj.write(f"content{blob.generation}".encode()[:7])
+
+        with tempfile.TemporaryDirectory() as directory, _handler(
+            cache_params={"directory": directory, "max_bytes": 10}
+        ) as handler, mock.patch.object(
+            storage.Blob, "reload", reload
+        ), mock.patch.object(
+            storage.Blob, "download_to_file", autospec=True
+        ) as download:
+            download.side_effect = download_to_file
+            for _ in range(3):
+                handler.download_blob_into_memory("blob")
+            self.assertEqual(download.call_count, 2)
+            cache = handler.cache
+            self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 2, 1))
+            # the first generation was evicted to stay within max_bytes
+            self.assertIsNone(cache.get("bucket", "blob", "1"))
+            self.assertEqual(cache.get("bucket", "blob", "2"), b"content")
+
+    def test_cached_download_keeps_the_pinned_generation(self):
+        reloaded = []
+
+        def reload(blob, **kwargs):
+            reloaded.append(blob.generation)
+            blob._properties.update(size="8")
+
+        def download_to_file(blob, file_obj, **kwargs):
+            file_obj.write(f"content{blob.generation}".encode())
+
+        with tempfile.TemporaryDirectory() as directory, _handler(
+            cache_params={"directory": directory},
+            ratelimit_params={"kind": "token_bucket", "calls": 10, "period": 60},
+        ) as handler, mock.patch.object(
+            storage.Blob, "reload", reload
+        ), mock.patch.object(
+            storage.Blob, "download_to_file", download_to_file
+        ):
+            blob = handler.bucket.blob("blob", generation=1)
+            for _ in range(2):
+                self.assertEqual(
+                    handler.download_blob_into_memory(blob).read(), b"content1"
+                )
+            # one reload and one download were charged
+            self.assertFalse(handler._ratelimiter.try_acquire(cost=9, timeout=0))
+            self.assertTrue(handler._ratelimiter.try_acquire(cost=8, timeout=0))
+        self.assertEqual(reloaded, [1])
+
+    def test_blob_cache_scans_the_directory_once_full(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(
+            os, "scandir", wraps=os.scandir
+        ) as scandir:
+            cache = BlobCache(directory, max_bytes=20)
+            for name in "abcd":
+                cache.put("bucket", name, 1, b"12345")
+            self.assertEqual((scandir.call_count, cache.evictions), (1, 0))
+            cache.put("bucket", "e", 1, b"12345")
+            self.assertEqual((scandir.call_count, cache.evictions), (2, 1))
+
+    def test_sync_index_reports_changes_since_last_sync(self):
+        objects = {"a/1": "1", "a/2": "1", "b/1": "1", "top": "1"}
+        calls = []
+
+        class Listing(list):
+            prefixes = {"a/", "b/"}
+
+        def list_blobs(bucket, prefix=None, delimiter=None, **kwargs):
+            # the locked google-cloud-storage does not know match_glob
+            self.assertNotIn("match_glob", kwargs)
+            calls.append((prefix, delimiter, kwargs["start_offset"]))
+            blobs = []
+            for name, generation in sorted(objects.items()):
+                if name.startswith(prefix or "") and (
+                    not delimiter or "/" not in name
+                ):
+                    if name >= (kwargs["start_offset"] or ""):
+                        blob = bucket.blob(name)
+                        blob._properties.update(size="1", generation=generation)
+                        blobs.append(blob)
+            return Listing(blobs)
+
+        with _handler() as handler, BucketIndex() as index, mock.patch.object(
+            handler.client, "list_blobs", list_blobs
+        ):
+            changes = handler.sync_index(index, delimiter="/")
+            self.assertEqual([c.kind for c in changes], ["added"] * 4)
+            self.assertEqual({c[0] for c in calls}, {None, "a/", "b/"})
+
+            objects["a/2"] = "2"
+            del objects["b/1"]
+            objects["c"] = "1"
+            changes = handler.sync_index(index, delimiter="/")
+            self.assertEqual(
+                [(c.kind, c.name) for c in changes],
+                [("changed", "a/2"), ("deleted", "b/1"), ("added", "c")],
+            )
+            self.assertEqual(handler.sync_index(index, delimiter="/"), [])
+
+            objects["z"] = "1"
+            calls.clear()
+            changes = handler.sync_index(index, incremental=True)
+            self.assertEqual([(c.kind, c.name) for c in changes], [("added", "z")])
+            self.assertEqual(calls, [(None, None, "top")])
+
+            # the glob is applied to the listing instead
+            changes = handler.sync_index(index, match_glob="a/*", delimiter="/")
+            self.assertEqual([c.name for c in changes], ["a/1", "a/2"])
+            self.assertEqual(
+                [b.name for b in handler.list_blobs(match_glob="{c,z}")], ["c", "z"]
+            )
+
+    def test_filter_updated_resolves_operator_once(self):
+        threshold = "2024-01-01T00:00:00.000000+0000"
+        updated = datetime(2024, 2, 1, tzinfo=timezone.utc)
+        blobs = [mock.Mock(updated=None), mock.Mock(updated=updated)]
+        self.assertEqual(list(GCSHandler.filter_updated(blobs, threshold)), blobs[1:])
+        self.assertEqual(list(GCSHandler.filter_updated(blobs, threshold, "lt")), [])
+        with self.assertRaises(ValueError):
+            GCSHandler.filter_updated(blobs, threshold, "ne")
+
+    def test_batches_retry_failed_sub_requests_only(self):
+        statuses = {"a": [204], "b": [503, 204], "c": [404]}
+        batches = []
+
+        def make_request(method, url, data, headers, timeout):
+            names = re.findall(r"DELETE \S+/o/(\w+)\?", data)
+            batches.append(names)
+            parts = []
+            for i, name in enumerate(names):
+                status = statuses[name].pop(0)
+                body = "" if status < 300 else '{"error": {"message": "x"}}'
+                parts.append(
+                    f"--batch\nContent-Type: application/http\n"
+                    f"Content-ID: <response-{i}>\n\nHTTP/1.1 {status} X\n"
+                    f"Content-Type: application/json\n\n{body}\n"
+                )
+            response = requests.Response()
+            response.status_code = 200
+            response.headers["content-type"] = "multipart/mixed; boundary=batch"
+            response._content = ("".join(parts) + "--batch--\n").encode()
+            return response
+
+        params = {
+            **GCSHandler._default_backoff_params,
+            "wait_gen": constant,
+            "interval": 0,
+        }
+        with _handler(
+            backoff_params=params,
+            ratelimit_params={"kind": "token_bucket", "calls": 10, "period": 60},
+        ) as handler, mock.patch.object(
+            handler.client._base_connection, "_make_request", make_request
+        ):
+            results = {r.name: r for r in handler.delete_many("abc", batch_size=3)}
+            # one charge per batch request
+            self.assertTrue(handler._ratelimiter.try_acquire(cost=8, timeout=0))
+            self.assertFalse(handler._ratelimiter.try_acquire(cost=1, timeout=0))
+        self.assertEqual(batches, [["a", "b", "c"], ["b"]])
+        self.assertIsNone(results["a"].error)
+        self.assertIsNone(results["b"].error)
+        self.assertEqual(results["c"].error.code, 404)
+
+    def test_batches_are_sent_to_the_handler_endpoint(self):
+        urls = []
+
+        def make_request(method, url, data, headers, timeout):
+            urls.append(url)
+            response = requests.Response()
+            response.status_code = 200
+            response.headers["content-type"] = "multipart/mixed; boundary=batch"
+            response._content = (
+                "--batch\nContent-Type: application/http\n"
+                "Content-ID: <response-0>\n\nHTTP/1.1 204 X\n\n\n--batch--\n"
+            ).encode()
+            return response
+
+        with _handler(
+            api_endpoint="https://storage.example.com"
+        ) as handler, mock.patch.object(
+            handler.client._base_connection, "_make_request", make_request
+        ):
+            results = list(handler.delete_many("a"))
+        self.assertIsNone(results[0].error)
+        self.assertEqual(urls, ["https://storage.example.com/batch/storage/v1"])
+
+    def test_handlers_share_pooled_clients(self):
+        credentials = AnonymousCredentials()
+        first = GCSHandler(
+            "project", "bucket", credentials=credentials, shared_client=True
+        )
+        second = GCSHandler(
+            "project", "other", credentials=credentials, shared_client=True
+        )
+        own = GCSHandler("project", "bucket", credentials=credentials)
+        self.assertIs(first.client, second.client)
+        self.assertIsNot(first.client, own.client)
+        adapter = first.client._http.get_adapter("https://storage.googleapis.com")
+        self.assertEqual(adapter._pool_maxsize, 10)
+
+        auth_session = first.client._http._auth_request.session
+        auth_adapter = auth_session.get_adapter("https://oauth2.googleapis.com")
+
+        pid = os.fork()
+        if not pid:
+            # the child gets fresh connection pools, also to refresh tokens
+            child = first.client._http.get_adapter("https://storage.googleapis.com")
+            auth = auth_session.get_adapter("https://oauth2.googleapis.com")
+            os._exit(0 if child is not adapter and auth is not auth_adapter else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+    def test_client_registry_drops_least_recently_used_clients(self):
+        registry = ClientRegistry(
+            lambda *args: mock.Mock(), storage.Client.SCOPE, max_clients=2
+        )
+        credentials = [AnonymousCredentials() for _ in range(3)]
+        first, second = (registry.get_client("p", c) for c in credentials[:2])
+        self.assertIs(registry.get_client("p", credentials[0]), first)
+        registry.get_client("p", credentials[2])
+        self.assertIs(registry.get_client("p", credentials[0]), first)
+        self.assertIsNot(registry.get_client("p", credentials[1]), second)
+
+    def test_resumable_upload_continues_from_committed_offset(self):
+        chunk = 256 * 1024
+        content = memoryview(bytes(range(256)) * 2560)
+        ranges, received = [], bytearray()
+
+        def put(url, data, headers):
+            ranges.append(headers["Content-Range"])
+            if data is None:
+                return mock.Mock(status_code=308, headers={"Range": "bytes=0-299999"})
+            body = data.read()
+            if len(ranges) == 2:
+                received.extend(body[: 300000 - chunk])
+                raise ConnectionError()
+            received.extend(body)
+            done = len(received) == len(content)
+            return mock.Mock(
+                status_code=200 if done else 308,
+                headers={"Range": f"bytes=0-{len(received) - 1}"},
+            )
+
+        params = {
+            **GCSHandler._default_backoff_params,
+            "wait_gen": constant,
+            "interval": 0,
+        }
+        session = mock.Mock(put=put)
+        with _handler(backoff_params=params) as handler, mock.patch.object(
+            storage.Blob, "create_resumable_upload_session", return_value="url"
+        ), mock.patch.object(requests, "Session", return_value=session):
+            handler.upload_blob("blob", content, chunk_size=chunk)
+        session.close.assert_called_once_with()
+        self.assertEqual(received, content)
+        self.assertEqual(
+            ranges,
+            [
+                f"bytes 0-{chunk - 1}/655360",
+                f"bytes {chunk}-{2 * chunk - 1}/655360",
+                "bytes */655360",
+                f"bytes 300000-{300000 + chunk - 1}/655360",
+                f"bytes {300000 + chunk}-655359/655360",
+            ],
+        )
+
+    def test_path_upload_unmaps_the_file(self):
+        uploaded, mappings = [], []
+        mmap_class = mmap.mmap
+
+        def mapping(*args, **kwargs):
+            mappings.append(mmap_class(*args, **kwargs))
+            return mappings[-1]
+
+        def upload_from_file(blob, file_obj, size, **kwargs):
+            uploaded.append(file_obj.read(size))
+
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"content")
+            f.flush()
+            with _handler() as handler, mock.patch.object(
+                storage.Blob, "upload_from_file", upload_from_file
+            ), mock.patch.object(mmap, "mmap", mapping):
+                handler.upload_blob("blob", f.name)
+        self.assertEqual(uploaded, [b"content"])
+        self.assertTrue(mappings[0].closed)
+
+    def test_composite_upload_composes_parts(self):
+        content = bytes(range(256)) * 4
+        parts = {}
+
+        def upload_from_file(blob, file_obj, size, **kwargs):
+            self.assertEqual(kwargs["if_generation_match"], 0)
+            parts[blob.name] = file_obj.read(size)
+
+        with _handler() as handler, mock.patch.object(
+            storage.Blob, "upload_from_file", upload_from_file
+        ), mock.patch.object(storage.Blob, "compose") as compose, mock.patch.object(
+            storage.Bucket, "delete_blobs"
+        ) as delete_blobs:
+            handler.upload_blob("blob", content, composite_threshold=0)
+        sources = compose.call_args.args[0]
+        self.assertEqual(len(sources), 32)
+        self.assertEqual(b"".join(parts[source.name] for source in sources), content)
+        self.assertEqual(delete_blobs.call_args.args[0], sources)
+
+    def test_import_defers_client_libraries(self):
+        code = (
+            "import gcs, sys; gcs.GCSHandler.filter_updated; print(*sys.modules)"
+        )
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        )
+        # -X importtime lines end with the module name
+        timed = {
+            line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines()
+        }
+        loaded = set(result.stdout.split())
+        self.assertIn("gcs.gcs", timed)
+        for module in (
+            "google.cloud.storage",
+            "requests",
+            "backoff",
+            "aiohttp",
+            "asyncio",
+            "google_crc32c",
+        ):
+            self.assertNotIn(module, timed)
+            self.assertNotIn(module, loaded)
+
+
+class AsyncGCSTests(unittest.IsolatedAsyncioTestCase):
+    async def test_handler_against_emulator(self):
+        objects = {}
+        failures = iter([True, False])
+
+        async def list_objects(request):
+            names = sorted(objects)
+            start = int(request.query.get("pageToken", 0))
+            page = {"items": [{"name": n, "size": "1"} for n in names[start:][:2]]}
+            if start + 2 < len(names):
+                page["nextPageToken"] = str(start + 2)
+            return web.json_response(page)
+
+        async def get_object(request):
+            if next(failures):
+                return web.Response(status=503)
+            return web.Response(body=objects[request.match_info["name"]])
+
+        async def insert_object(request):
+            objects[request.query["name"]] = await request.read()
+            return web.json_response({"name": request.query["name"], "size": "1"})
+
+        app = web.Application()
+        app.router.add_get("/storage/v1/b/bucket/o", list_objects)
+        app.router.add_get("/storage/v1/b/bucket/o/{name}", get_object)
+        app.router.add_post("/upload/storage/v1/b/bucket/o", insert_object)
+        params = {
+            **AsyncGCSHandler._default_backoff_params,
+            "wait_gen": constant,
+            "interval": 0,
+        }
+        async with TestServer(app) as server, AsyncGCSHandler(
+            "project",
+            "bucket",
+            credentials=AnonymousCredentials(),
+            api_endpoint=str(server.make_url("")),
+            backoff_params=params,
+        ) as handler:
+            for name in "abc/":
+                await handler.upload_blob_from_memory(name, io.BytesIO(b"x"))
+            names = [blob.name async for blob in handler.list_blobs()]
+            self.assertEqual(names, ["/", "a", "b", "c"])
+            content = await handler.download_blob_into_memory("/")
+            self.assertEqual(content.read(), b"x")
+
+    async def test_handler_rejects_unsupported_ratelimiters(self):
+        with self.assertRaises(ValueError):
+            AsyncGCSHandler(
+                "project",
+                "bucket",
+                credentials=AnonymousCredentials(),
+                ratelimit_params={"kind": "sliding_window"},
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
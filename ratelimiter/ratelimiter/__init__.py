@@ -1,4 +1,20 @@
-from .ratelimit import RateLimiter
+from .ratelimit import (
+    RateLimiter,
+    TokenBucketRateLimiter,
+    AdaptiveRateLimiter,
+    AsyncRateLimiter,
+    SharedRateLimiter,
+    RateLimiterRegistry,
+    make_ratelimiter,
+)
 
-__version__ = "0.1.0"
-__all__ = ["RateLimiter"]
+__version__ = "0.2.0"
+__all__ = [
+    "RateLimiter",
+    "TokenBucketRateLimiter",
+    "AdaptiveRateLimiter",
+    "AsyncRateLimiter",
+    "SharedRateLimiter",
+    "RateLimiterRegistry",
+    "make_ratelimiter",
+]
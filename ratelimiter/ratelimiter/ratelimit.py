@@ -1,32 +1,42 @@
 from __future__ import annotations
+import mmap
+import os
+import struct
 import sys
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from math import floor
-from threading import RLock, Event, Thread, Condition
+from threading import Lock, RLock, Event, Thread, Condition
 import logging
 from traceback import print_exception
 from types import TracebackType
-from typing import Optional, Type, Union
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Type,
+    Union,
+)
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
 
-logger = logging.getLogger(__name__)
 
+logger = logging.getLogger(__name__)
 
-class RateLimiter:
-    def __init__(self, calls: int, period: Union[int, float]):
-        self._max_calls = max(1, min(sys.maxsize, floor(calls)))
-        self._period = period
-        self._num_calls = 0
-        self._lock = RLock()
-        self._ticker = Event()
-        self._resetter = Thread(target=self._reset)
-        self._resetter.start()
-        self._cv = Condition(lock=self._lock)
 
+class _BaseRateLimiter(ABC):
     def finalize(self):
-        self._ticker.set()
-        self._resetter.join()
+        pass
 
-    def __enter__(self) -> RateLimiter:
+    def __enter__(self):
         return self
 
     def __exit__(
@@ -42,6 +52,29 @@ class RateLimiter:
         print_exception(type, value, traceback)
         return False
 
+    @abstractmethod
+    def limit(self, cost: int = 1):
+        """Blocks until `cost` calls are permitted."""
+
+
+class RateLimiter(_BaseRateLimiter):
+    def __init__(self, calls: int, period: Union[int, float]):
+        self._max_calls = max(1, min(sys.maxsize, floor(calls)))
+        self._period = period
+        self._num_calls = 0
+        self._lock = RLock()
+        self._ticker = Event()
+        self._resetter = Thread(target=self._reset)
+        self._resetter.start()
+        self._cv = Condition(lock=self._lock)
+
+    def finalize(self):
+        self._ticker.set()
+        self._resetter.join()
+
+    def __enter__(self) -> RateLimiter:
+        return self
+
     def _reset(self):
         def do_reset():
             logger.debug("resetting number of calls")
@@ -55,11 +88,382 @@ class RateLimiter:
                 # n = max calls avoids thundering herd problem
                 self._cv.notify(n=self._max_calls)
 
-    def limit(self):
-        if self._num_calls == self._max_calls:
-            with self._cv:
-                self._cv.wait()
-        with self._lock:
+    def limit(self, cost: int = 1):
+        self.try_acquire(cost)
+
+    def try_acquire(self, cost: int = 1, timeout: Optional[float] = None) -> bool:
+        if cost > self._max_calls:
+            raise ValueError(f"cost {cost} exceeds max calls {self._max_calls}")
+        with self._cv:
+            if not self._cv.wait_for(
+                lambda: self._num_calls + cost <= self._max_calls, timeout
+            ):
+                return False
             logger.debug("increase call counter")
-            self._num_calls += 1
+            self._num_calls += cost
             logger.debug(f"num calls: {self._num_calls} max calls: {self._max_calls}")
+        return True
+
+
+class _TokenBucket:
+    """Token bucket which is refilled lazily from a monotonic clock.
+
+    Callers reserve tokens up front and may drive the bucket into debt, the
+    returned delay is the time until the reservation is covered. Since every
+    reservation is queued behind the previous ones, waiters are served in
+    FIFO order without any background thread.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._last = clock()
+        self._lock = Lock()
+
+    def _refill(self, now: float):
+        # the stored timestamp may stem from before a reboot in shared buckets
+        elapsed = max(0.0, now - self._last)
+        self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+        self._last = now
+
+    @contextmanager
+    def _synchronized(self) -> Iterator[None]:
+        with self._lock:
+            yield
+
+    def reserve(
+        self, cost: float = 1, max_wait: Optional[float] = None
+    ) -> Optional[float]:
+        """Reserves `cost` tokens and returns the delay until they are covered.
+
+        Returns None without reserving anything if the delay would exceed
+        `max_wait`.
+        """
+        with self._synchronized():
+            self._refill(self._clock())
+            delay = max(0.0, (cost - self._tokens) / self._rate)
+            if max_wait is not None and delay > max_wait:
+                return None
+            self._tokens -= cost
+            logger.debug(f"tokens left: {self._tokens} capacity: {self._capacity}")
+            return delay
+
+    def refund(self, cost: float = 1):
+        with self._synchronized():
+            self._refill(self._clock())
+            self._tokens = min(self._capacity, self._tokens + cost)
+
+    def set_rate(self, rate: float):
+        with self._synchronized():
+            self._refill(self._clock())
+            self._rate = rate
+
+    def close(self):
+        pass
+
+
+class _SharedTokenBucket(_TokenBucket):
+    """Token bucket whose state lives in a memory mapped file.
+
+    Every update is guarded by an exclusive `flock` on the file, so all
+    processes on one host mapping the same file draw from the same bucket.
+    `time.monotonic` is system wide on Linux which keeps refills consistent
+    across processes.
+    """
+
+    _layout = struct.Struct("dd")
+
+    def __init__(self, rate: float, capacity: float, path: str):
+        assert fcntl is not None, "Shared ratelimiting requires fcntl"
+        self._path = path
+        super().__init__(rate, capacity)
+        self._open()
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._lock = Lock()
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self._layout.size:
+                logger.debug(f"initializing shared bucket {self._path}")
+                os.ftruncate(self._fd, self._layout.size)
+                os.pwrite(self._fd, self._layout.pack(self._tokens, self._last), 0)
+            self._map = mmap.mmap(self._fd, self._layout.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _synchronized(self) -> Iterator[None]:
+        if self._pid != os.getpid():
+            # flock is bound to the open file description which is shared
+            # with the parent after a fork, hence the file is reopened
+            self._open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._tokens, self._last = self._layout.unpack_from(self._map)
+                yield
+                self._layout.pack_into(self._map, 0, self._tokens, self._last)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._map.close()
+            os.close(self._fd)
+
+
+class TokenBucketRateLimiter(_BaseRateLimiter):
+    """Thread-free rate limiter allowing `calls` per `period` on average.
+
+    Up to `burst` calls (defaults to `calls`) pass without waiting, after that
+    calls are spread evenly at a rate of `calls / period`.
+    """
+
+    def __init__(
+        self,
+        calls: int,
+        period: Union[int, float],
+        burst: Optional[int] = None,
+    ):
+        self._max_calls = max(1, min(sys.maxsize, floor(calls)))
+        self._period = period
+        self._burst = self._max_calls if burst is None else max(1, floor(burst))
+        self._bucket = _TokenBucket(self._max_calls / period, self._burst)
+
+    def __enter__(self) -> TokenBucketRateLimiter:
+        return self
+
+    def limit(self, cost: int = 1):
+        self.try_acquire(cost)
+
+    def try_acquire(self, cost: int = 1, timeout: Optional[float] = None) -> bool:
+        delay = self._bucket.reserve(cost, timeout)
+        if delay is None:
+            return False
+        if delay > 0:
+            logger.debug(f"waiting {delay:0.3f} seconds for {cost} tokens")
+            time.sleep(delay)
+        return True
+
+
+class AdaptiveRateLimiter(TokenBucketRateLimiter):
+    """Token bucket rate limiter adjusting its rate by AIMD feedback.
+
+    The rate starts at `calls / period`. Each `record_success` adds
+    `increase / calls` calls per period, i.e. `increase` per period's worth
+    of successes, and `record_throttle` multiplies it by `decrease`. The rate
+    is kept between `min_calls` and `max_calls` per period and is cut at most
+    once per `cooldown` seconds, so a burst of throttled calls counts once.
+    """
+
+    def __init__(
+        self,
+        calls: int,
+        period: Union[int, float],
+        burst: Optional[int] = None,
+        min_calls: Union[int, float] = 1,
+        max_calls: Optional[Union[int, float]] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        super().__init__(calls, period, burst)
+        assert 0 < decrease < 1, "decrease must be in (0, 1)"
+        self._calls = float(self._max_calls)
+        self._min_calls = min_calls
+        self._max_calls_limit = max_calls
+        self._increase = increase
+        self._decrease = decrease
+        self._cooldown = cooldown
+        self._last_decrease = -cooldown
+        self._feedback_lock = Lock()
+
+    def __enter__(self) -> AdaptiveRateLimiter:
+        return self
+
+    @property
+    def calls(self) -> float:
+        return self._calls
+
+    def _update(self, calls: float):
+        if self._max_calls_limit is not None:
+            calls = min(self._max_calls_limit, calls)
+        self._calls = max(self._min_calls, calls)
+        self._bucket.set_rate(self._calls / self._period)
+
+    def record_success(self):
+        with self._feedback_lock:
+            self._update(self._calls + self._increase / self._calls)
+
+    def record_throttle(self):
+        with self._feedback_lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self._cooldown:
+                return
+            self._last_decrease = now
+            self._update(self._calls * self._decrease)
+            logger.debug(f"throttled, reducing rate to {self._calls} calls")
+
+
+class AsyncRateLimiter(_BaseRateLimiter):
+    """Asyncio counterpart of `TokenBucketRateLimiter`.
+
+    Waiters are served in FIFO order and a waiter cancelled while sleeping
+    hands its reservation back to the bucket.
+    """
+
+    def __init__(
+        self,
+        calls: int,
+        period: Union[int, float],
+        burst: Optional[int] = None,
+    ):
+        self._max_calls = max(1, min(sys.maxsize, floor(calls)))
+        self._period = period
+        self._burst = self._max_calls if burst is None else max(1, floor(burst))
+        self._bucket = _TokenBucket(self._max_calls / period, self._burst)
+
+    def __enter__(self) -> AsyncRateLimiter:
+        return self
+
+    async def __aenter__(self) -> AsyncRateLimiter:
+        return self
+
+    async def __aexit__(
+        self,
+        type: Optional[Type[BaseException]],
+        value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> bool:
+        return self.__exit__(type, value, traceback)
+
+    async def limit(self, cost: int = 1):
+        await self.try_acquire(cost)
+
+    async def try_acquire(self, cost: int = 1, timeout: Optional[float] = None) -> bool:
+        delay = self._bucket.reserve(cost, timeout)
+        if delay is None:
+            return False
+        if delay <= 0:
+            return True
+        logger.debug(f"waiting {delay:0.3f} seconds for {cost} tokens")
+        # already loaded by the running loop, synchronous users never import it
+        import asyncio
+
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            logger.debug("returning tokens of cancelled waiter")
+            self._bucket.refund(cost)
+            raise
+        return True
+
+
+class SharedRateLimiter(TokenBucketRateLimiter):
+    """Token bucket rate limiter shared by all processes on one host.
+
+    Limiters constructed with the same `name` (and `directory`) share one
+    quota, the bucket is stored in `<directory>/ratelimiter-<name>.bucket`.
+    """
+
+    def __init__(
+        self,
+        calls: int,
+        period: Union[int, float],
+        name: str,
+        burst: Optional[int] = None,
+        directory: Optional[str] = None,
+    ):
+        super().__init__(calls, period, burst)
+        self._path = os.path.join(
+            directory or tempfile.gettempdir(), f"ratelimiter-{name}.bucket"
+        )
+        self._bucket = _SharedTokenBucket(
+            self._max_calls / period, self._burst, self._path
+        )
+
+    def __enter__(self) -> SharedRateLimiter:
+        return self
+
+    def finalize(self):
+        self._bucket.close()
+
+
+_RATELIMITER_KINDS: Mapping[str, Callable[..., Any]] = {
+    "fixed_window": RateLimiter,
+    "token_bucket": TokenBucketRateLimiter,
+    "shared": SharedRateLimiter,
+    "adaptive": AdaptiveRateLimiter,
+}
+
+
+def make_ratelimiter(*args, **kwargs):
+    kind = kwargs.pop("kind", "fixed_window")
+    factory = _RATELIMITER_KINDS.get(kind)
+    assert factory is not None, f"Unknown ratelimiter kind {kind}"
+    return factory(*args, **kwargs)
+
+
+class RateLimiterRegistry:
+    """Hands out one rate limiter per key, e.g. per bucket or per API method.
+
+    Limiters are built lazily by `make_ratelimiter` from `params`, merged with
+    `overrides[key]` if present. Shared limiters get the key appended to their
+    name so that each key keeps its own quota.
+    """
+
+    def __init__(self, overrides: Optional[Mapping[str, Mapping]] = None, **params):
+        self._params = params
+        self._overrides = overrides or {}
+        self._limiters: MutableMapping[str, Any] = {}
+        self._lock = Lock()
+
+    def __enter__(self) -> RateLimiterRegistry:
+        return self
+
+    def __exit__(
+        self,
+        type: Optional[Type[BaseException]],
+        value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> bool:
+        logger.debug("finalizing ratelimiters")
+        self.finalize()
+        if not type and not value and not traceback:
+            return True
+        print_exception(type, value, traceback)
+        return False
+
+    def get(self, key: str):
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                params = {**self._params, **self._overrides.get(key, {})}
+                if "name" in params:
+                    params["name"] = f"{params['name']}-{key}"
+                logger.debug(f"creating ratelimiter for {key}")
+                limiter = self._limiters[key] = make_ratelimiter(**params)
+            return limiter
+
+    def limit(self, key: str, cost: int = 1):
+        self.get(key).limit(cost)
+
+    def try_acquire(
+        self, key: str, cost: int = 1, timeout: Optional[float] = None
+    ) -> bool:
+        return self.get(key).try_acquire(cost, timeout)
+
+    def finalize(self):
+        with self._lock:
+            for limiter in self._limiters.values():
+                limiter.finalize()
+            self._limiters.clear()
@@ -1,5 +1,131 @@
-from ratelimiter import __version__
+import asyncio
+import threading
+import time
+
+from ratelimiter import (
+    __version__,
+    AdaptiveRateLimiter,
+    AsyncRateLimiter,
+    RateLimiter,
+    RateLimiterRegistry,
+    SharedRateLimiter,
+    TokenBucketRateLimiter,
+    make_ratelimiter,
+)
 
 
 def test_version():
-    assert __version__ == '0.1.0'
+    assert __version__ == '0.2.0'
+
+
+def test_token_bucket_spreads_calls_after_burst():
+    with TokenBucketRateLimiter(calls=10, period=0.5, burst=2) as limiter:
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.limit()
+        elapsed = time.monotonic() - start
+    # 2 calls pass immediately, the remaining 4 are spaced 50ms apart
+    assert 0.18 <= elapsed < 0.5
+
+
+def test_token_bucket_starts_no_thread():
+    before = threading.active_count()
+    limiter = make_ratelimiter(kind="token_bucket", calls=5, period=1)
+    limiter.limit()
+    assert threading.active_count() == before
+
+
+def test_async_matches_sync_scenario():
+    async def run():
+        async with AsyncRateLimiter(calls=10, period=0.5, burst=2) as limiter:
+            start = time.monotonic()
+            for _ in range(6):
+                await limiter.limit()
+            return time.monotonic() - start
+
+    assert 0.18 <= asyncio.run(run()) < 0.5
+
+
+def test_async_waiters_are_served_in_fifo_order():
+    async def run():
+        limiter = AsyncRateLimiter(calls=50, period=1, burst=1)
+        order = []
+
+        async def call(i):
+            await limiter.limit()
+            order.append(i)
+
+        await asyncio.gather(*(call(i) for i in range(8)))
+        return order
+
+    assert asyncio.run(run()) == list(range(8))
+
+
+def test_async_cancelled_waiter_returns_its_token():
+    async def run():
+        limiter = AsyncRateLimiter(calls=10, period=1, burst=1)
+        await limiter.limit()
+        waiter = asyncio.ensure_future(limiter.limit())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        start = time.monotonic()
+        await limiter.limit()
+        return time.monotonic() - start
+
+    # without the refund the second waiter would queue behind the cancelled one
+    assert asyncio.run(run()) < 0.15
+
+
+def test_shared_limiters_draw_from_one_quota(tmp_path):
+    params = {"calls": 10, "period": 0.5, "burst": 2, "directory": str(tmp_path)}
+    with SharedRateLimiter(name="quota", **params) as first, make_ratelimiter(
+        kind="shared", name="quota", **params
+    ) as second:
+        first.limit()
+        first.limit()
+        start = time.monotonic()
+        second.limit()
+        assert time.monotonic() - start >= 0.04
+
+
+def test_weighted_try_acquire_gives_up_after_timeout():
+    with TokenBucketRateLimiter(calls=10, period=1) as limiter:
+        limiter.limit(cost=8)
+        assert limiter.try_acquire(cost=2, timeout=0)
+        assert not limiter.try_acquire(cost=5, timeout=0.1)
+        assert limiter.try_acquire(cost=1, timeout=0.2)
+
+
+def test_fixed_window_try_acquire():
+    with RateLimiter(calls=3, period=60) as limiter:
+        limiter.limit(cost=2)
+        assert limiter.try_acquire()
+        assert not limiter.try_acquire(timeout=0.01)
+
+
+def test_registry_hands_out_one_limiter_per_key():
+    with RateLimiterRegistry(
+        kind="token_bucket",
+        calls=1,
+        period=60,
+        overrides={"cheap": {"calls": 100}},
+    ) as registry:
+        assert registry.get("a") is registry.get("a")
+        assert registry.try_acquire("a", timeout=0)
+        assert not registry.try_acquire("a", timeout=0)
+        assert registry.try_acquire("b", timeout=0)
+        for _ in range(100):
+            assert registry.try_acquire("cheap", timeout=0)
+
+
+def test_adaptive_limiter_increases_additively_and_decreases_multiplicatively():
+    limiter = AdaptiveRateLimiter(calls=10, period=1, min_calls=2, cooldown=60)
+    for _ in range(10):
+        limiter.record_success()
+    assert 10.9 < limiter.calls < 11
+    limiter.record_throttle()
+    assert 5.4 < limiter.calls < 5.5
+    # further throttles within the cooldown count once
+    limiter.record_throttle()
+    assert 5.4 < limiter.calls < 5.5
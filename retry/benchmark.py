@@ -0,0 +1,43 @@
+from timeit import timeit
+from retry import SimpleRetrier, RetryPolicy, expo, full_jitter, backoff_hdlr
+
+# mirrors the default backoff params of the gcs and bq handlers
+BACKOFF_PARAMS = {
+    "kind": "on_predicate",
+    "wait_gen": expo,
+    "predicate": lambda exc: False,
+    "on_backoff": backoff_hdlr,
+    "max_tries": 8,
+    "jitter": full_jitter,
+    "max_time": 600,
+}
+NUMBER = 20_000
+
+
+def api_request():
+    return None
+
+
+def per_call_retrier():
+    SimpleRetrier(**BACKOFF_PARAMS)(api_request)()
+
+
+POLICY = RetryPolicy(**BACKOFF_PARAMS)
+
+
+def shared_policy():
+    POLICY(api_request)()
+
+
+def bare_call():
+    api_request()
+
+
+if __name__ == "__main__":
+    baseline = timeit(bare_call, number=NUMBER)
+    for name, fn in [
+        ("per call SimpleRetrier", per_call_retrier),
+        ("shared RetryPolicy", shared_policy),
+    ]:
+        overhead = (timeit(fn, number=NUMBER) - baseline) / NUMBER
+        print(f"{name:<24} {overhead * 1e6:8.2f} us per call")
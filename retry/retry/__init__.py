@@ -1,11 +1,54 @@
-from .retry import SimpleRetrier, ConditionalRetrier, backoff_hdlr
-from backoff import full_jitter, random_jitter, expo, constant
+from .retry import (
+    SimpleRetrier,
+    ConditionalRetrier,
+    RetryPolicy,
+    ConditionalRetryPolicy,
+    RetryBudget,
+    CircuitBreaker,
+    CircuitOpenError,
+    get_circuit_breaker,
+    HedgingPolicy,
+    DeadlineExceeded,
+    deadline,
+    remaining_time,
+    backoff_hdlr,
+    default_backoff_params,
+    ClassDefault,
+    with_handlers,
+    feedback_handlers,
+)
 
-__version__ = "0.1.0"
+_BACKOFF_EXPORTS = frozenset(["full_jitter", "random_jitter", "expo", "constant"])
+
+
+def __getattr__(name: str):
+    # backoff is only imported once one of its helpers is used
+    if name in _BACKOFF_EXPORTS:
+        import backoff
+
+        return getattr(backoff, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__version__ = "0.2.0"
 __all__ = [
     "SimpleRetrier",
     "ConditionalRetrier",
+    "RetryPolicy",
+    "ConditionalRetryPolicy",
+    "RetryBudget",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "get_circuit_breaker",
+    "HedgingPolicy",
+    "DeadlineExceeded",
+    "deadline",
+    "remaining_time",
     "backoff_hdlr",
+    "default_backoff_params",
+    "ClassDefault",
+    "with_handlers",
+    "feedback_handlers",
     "full_jitter",
     "random_jitter",
     "expo",
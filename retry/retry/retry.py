@@ -1,10 +1,81 @@
 from __future__ import annotations
+import inspect
 import logging
-from typing import Callable, Optional, Sequence
-import backoff
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import partial
+from threading import BoundedSemaphore, Event, Lock
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Generator,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 logger = logging.getLogger(__name__)
 
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Bounds all retriers invoked within the context to `seconds` from now.
+
+    Deadlines nest, the earliest one wins. Retriers cut their backoff sleeps
+    to the time left and raise `DeadlineExceeded` instead of starting another
+    attempt once it has passed. Being a context variable, the deadline
+    follows asyncio tasks but not threads.
+    """
+    if seconds is None:
+        yield
+        return
+    current = _deadline.get()
+    expires = time.monotonic() + seconds
+    token = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def _check_deadline():
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded(f"deadline exceeded by {-remaining:0.3f} seconds")
+
+
+def _bounded(max_time: Any) -> Callable[[], Optional[float]]:
+    # backoff evaluates callable max_time once per retried call and never
+    # sleeps past it, which cuts the backoff to the enclosing deadline
+    def bounded_max_time() -> Optional[float]:
+        configured = max_time() if callable(max_time) else max_time
+        remaining = remaining_time()
+        if remaining is None:
+            return configured
+        remaining = max(0.0, remaining)
+        return remaining if configured is None else min(configured, remaining)
+
+    return bounded_max_time
+
 
 def backoff_hdlr(details):
     logger.debug(
@@ -14,6 +85,422 @@ def backoff_hdlr(details):
     )
 
 
+def default_backoff_params(predicate: Callable[[Any], bool]) -> Mapping:
+    """Returns the default backoff parameters of the handlers, retrying with
+    jittered exponential waits while `predicate` holds for the outcome."""
+    import backoff
+
+    return {
+        "kind": "on_predicate",
+        "wait_gen": backoff.expo,
+        "predicate": predicate,
+        "on_backoff": backoff_hdlr,
+        "max_tries": 8,
+        "jitter": backoff.full_jitter,
+        "max_time": 600,
+    }
+
+
+class ClassDefault:
+    """Class attribute built on first access, e.g. to defer imports."""
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._value = None
+
+    def __get__(self, instance: Any, owner: type) -> Any:
+        if self._value is None:
+            self._value = self._factory()
+        return self._value
+
+
+def with_handlers(params: Mapping, **handlers: Callable) -> dict:
+    """Returns a copy of `params` with event `handlers` appended.
+
+    Existing on_success/on_backoff/on_giveup handlers are kept, backoff
+    accepts an iterable of handlers for every event.
+    """
+    merged = dict(params)
+    for event, handler in handlers.items():
+        existing = merged.get(event)
+        if existing is None:
+            merged[event] = handler
+        elif callable(existing):
+            merged[event] = [existing, handler]
+        else:
+            merged[event] = [*existing, handler]
+    return merged
+
+
+def feedback_handlers(
+    on_success: Callable[[], Any],
+    on_throttle: Callable[[], Any],
+    is_throttled: Callable[[Any], bool],
+) -> Mapping[str, Callable]:
+    """Creates backoff event handlers reporting call outcomes, e.g. to an
+    adaptive rate limiter.
+
+    `on_throttle` is called whenever a failed attempt satisfies
+    `is_throttled` and `on_success` whenever a call returns without error.
+    """
+
+    def outcome(details) -> Any:
+        return details.get("exception", details.get("value"))
+
+    def success_hdlr(details):
+        if not isinstance(outcome(details), Exception):
+            on_success()
+
+    def failure_hdlr(details):
+        if is_throttled(outcome(details)):
+            on_throttle()
+
+    return {
+        "on_success": success_hdlr,
+        "on_backoff": failure_hdlr,
+        "on_giveup": failure_hdlr,
+    }
+
+
+class RetryBudget:
+    """Thread-safe token pool limiting retries across all retriers sharing it.
+
+    Within the last `ttl` seconds at most `ratio` retries per successful call
+    are allowed, plus `min_retries_per_second` so that retries are still
+    possible while traffic is low. Once the budget is spent retriers give up
+    immediately instead of adding load to a degraded backend.
+    """
+
+    def __init__(
+        self,
+        ratio: float = 0.1,
+        min_retries_per_second: float = 10,
+        ttl: float = 10.0,
+    ):
+        self._ratio = ratio
+        self._reserve = min_retries_per_second * ttl
+        self._ttl = ttl
+        self._deposits: Deque[float] = deque()
+        self._withdrawals: Deque[float] = deque()
+        self._lock = Lock()
+
+    def _expire(self, now: float):
+        for timestamps in (self._deposits, self._withdrawals):
+            while timestamps and now - timestamps[0] > self._ttl:
+                timestamps.popleft()
+
+    @property
+    def balance(self) -> float:
+        with self._lock:
+            self._expire(time.monotonic())
+            return (
+                self._reserve
+                + self._ratio * len(self._deposits)
+                - len(self._withdrawals)
+            )
+
+    def deposit(self):
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            self._deposits.append(now)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            balance = (
+                self._reserve
+                + self._ratio * len(self._deposits)
+                - len(self._withdrawals)
+            )
+            if balance < 1:
+                logger.debug("retry budget exhausted, giving up")
+                return False
+            self._withdrawals.append(now)
+            return True
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Circuit breaker tracking the failure rate of calls to one endpoint.
+
+    While closed, calls pass and their outcomes are recorded over the last
+    `window` seconds. Once at least `minimum_calls` were recorded and the
+    share of failures reaches `failure_rate_threshold`, the circuit opens and
+    calls fail immediately with `CircuitOpenError`. After `cooldown` seconds
+    it is half-open and lets `half_open_calls` trial calls through, closing
+    again if they succeed and reopening on the first failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate_threshold: float = 0.5,
+        window: float = 60.0,
+        minimum_calls: int = 10,
+        cooldown: float = 30.0,
+        half_open_calls: int = 1,
+    ):
+        self._threshold = failure_rate_threshold
+        self._window = window
+        self._minimum_calls = minimum_calls
+        self._cooldown = cooldown
+        self._half_open_calls = half_open_calls
+        self._state = self.CLOSED
+        self._outcomes: Deque[tuple] = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._lock = Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._cooled_down(time.monotonic()):
+                return self.HALF_OPEN
+            return self._state
+
+    def _cooled_down(self, now: float) -> bool:
+        return now - self._opened_at >= self._cooldown
+
+    def _open(self, now: float):
+        logger.debug("opening circuit")
+        self._state = self.OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self._failures = 0
+
+    def check(self):
+        """Raises `CircuitOpenError` while the circuit is open."""
+        if self._state == self.OPEN and not self._cooled_down(time.monotonic()):
+            raise CircuitOpenError("circuit is open")
+
+    def before_call(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN:
+                if not self._cooled_down(now):
+                    raise CircuitOpenError("circuit is open")
+                logger.debug("circuit is half-open")
+                self._state = self.HALF_OPEN
+                self._trials = 0
+            if self._state == self.HALF_OPEN:
+                if self._trials >= self._half_open_calls:
+                    raise CircuitOpenError("circuit is half-open")
+                self._trials += 1
+
+    def release_trial(self):
+        """Hands back a half-open trial whose call ended without an outcome,
+        e.g. because it was cancelled."""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def _record(self, now: float, failed: bool):
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        while self._outcomes and now - self._outcomes[0][0] > self._window:
+            self._failures -= self._outcomes.popleft()[1]
+
+    def record_success(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                logger.debug("closing circuit")
+                self._state = self.CLOSED
+            elif self._state == self.CLOSED:
+                self._record(time.monotonic(), False)
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.HALF_OPEN:
+                self._open(now)
+            elif self._state == self.CLOSED:
+                self._record(now, True)
+                calls = len(self._outcomes)
+                if (
+                    calls >= self._minimum_calls
+                    and self._failures / calls >= self._threshold
+                ):
+                    self._open(now)
+
+
+_circuit_breakers: MutableMapping[str, CircuitBreaker] = {}
+_circuit_breakers_lock = Lock()
+
+
+def get_circuit_breaker(key: str, **kwargs) -> CircuitBreaker:
+    """Returns the process-wide circuit breaker of `key`, e.g. an endpoint.
+
+    `kwargs` are only used when the breaker is created by this call.
+    """
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(key)
+        if breaker is None:
+            breaker = _circuit_breakers[key] = CircuitBreaker(**kwargs)
+        return breaker
+
+
+class HedgingPolicy:
+    """Starts backup attempts of slow idempotent calls and keeps the first
+    result.
+
+    If an attempt has not finished after `delay` seconds, another one is
+    started, up to `max_hedges` in addition to the first. Without a fixed
+    `delay` it is the `percentile` of the latencies of the last `window`
+    calls, or `initial_delay` until `min_samples` latencies were observed.
+    `on_hedge` is called with the args and kwargs of the call before every
+    backup attempt, e.g. to take a rate limiter permit without waiting, and
+    returning False skips the backup attempt until the next `delay` passed. `hedge_args` maps the args and
+    kwargs of a call to those of its backup attempts, e.g. to copy mutable
+    arguments. First attempts run in a pool of `max_workers` threads, and
+    delays and latencies are timed from the start of an attempt, not from
+    its submission. At most `max_concurrent_hedges` backup attempts run at a
+    time in a pool of their own, further ones are skipped until one
+    finished. Losing attempts which already started cannot be interrupted
+    and their results are discarded.
+    """
+
+    def __init__(
+        self,
+        delay: Optional[float] = None,
+        percentile: float = 95,
+        initial_delay: float = 1.0,
+        min_delay: float = 0.01,
+        window: int = 100,
+        min_samples: int = 10,
+        max_hedges: int = 1,
+        on_hedge: Optional[Callable[[], Any]] = None,
+        hedge_args: Optional[Callable[[tuple, dict], Tuple[tuple, dict]]] = None,
+        max_workers: int = 32,
+        max_concurrent_hedges: int = 8,
+    ):
+        assert 0 < percentile <= 100, "percentile must be in (0, 100]"
+        assert max_concurrent_hedges > 0
+        self._delay = delay
+        self._percentile = percentile
+        self._initial_delay = initial_delay
+        self._min_delay = min_delay
+        self._min_samples = min_samples
+        self._max_hedges = max_hedges
+        self._on_hedge = on_hedge
+        self._hedge_args = hedge_args
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedging"
+        )
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_hedges, thread_name_prefix="hedging-backup"
+        )
+        self._hedge_slots = BoundedSemaphore(max_concurrent_hedges)
+
+    @property
+    def delay(self) -> float:
+        if self._delay is not None:
+            return self._delay
+        with self._lock:
+            if len(self._latencies) < self._min_samples:
+                return self._initial_delay
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self._percentile / 100))
+        return max(self._min_delay, latencies[index])
+
+    def _record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _submit(
+        self, executor: ThreadPoolExecutor, fn: Callable, args: tuple, kwargs: dict
+    ) -> Tuple[Future, Event]:
+        started = Event()
+
+        def attempt():
+            started.set()
+            start = time.monotonic()
+            result = fn(*args, **kwargs)
+            self._record(time.monotonic() - start)
+            return result
+
+        # attempts inherit the deadline of the caller
+        return executor.submit(partial(copy_context().run, attempt)), started
+
+    def _hedge(self, fn: Callable, args: tuple, kwargs: dict) -> Optional[Future]:
+        if not self._hedge_slots.acquire(blocking=False):
+            logger.debug("skipping hedge, too many hedges running")
+            return None
+        if self._on_hedge and self._on_hedge(*args, **kwargs) is False:
+            logger.debug("skipping hedge")
+            self._hedge_slots.release()
+            return None
+        logger.debug(f"hedging call after {self.delay:0.3f} seconds")
+        if self._hedge_args:
+            args, kwargs = self._hedge_args(args, kwargs)
+        hedge, started = self._submit(self._hedge_executor, fn, args, kwargs)
+        hedge.add_done_callback(lambda _: self._hedge_slots.release())
+        started.wait()
+        return hedge
+
+    def __call__(self, fn: Callable) -> Callable:
+        def hedged_fn(*args, **kwargs):
+            first, started = self._submit(self._executor, fn, args, kwargs)
+            # the first delay runs from the start of the first attempt
+            started.wait()
+            attempts: List[Future] = [first]
+            pending = set(attempts)
+            error: Optional[BaseException] = None
+            while pending:
+                can_hedge = len(attempts) <= self._max_hedges
+                done, pending = wait(
+                    pending,
+                    timeout=self.delay if can_hedge else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                for attempt in done:
+                    if attempt.exception() is None:
+                        for loser in pending:
+                            loser.cancel()
+                        return attempt.result()
+                    error = attempt.exception()
+                if not done and can_hedge:
+                    hedge = self._hedge(fn, args, kwargs)
+                    if hedge:
+                        attempts.append(hedge)
+                        pending.add(hedge)
+            raise error  # type: ignore
+
+        return hedged_fn
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        self._hedge_executor.shutdown(wait=False)
+
+
+_FINAL_ERRORS = (DeadlineExceeded, CircuitOpenError)
+
+
+def _budgeted(wait_gen: Callable, budget: RetryBudget) -> Callable:
+    # backoff asks the wait generator for the next delay right before it
+    # sleeps, a generator which stops makes backoff give up
+    def budgeted_wait_gen(*args, **kwargs) -> Generator[Any, Any, None]:
+        wait = wait_gen(*args, **kwargs)
+        value = wait.send(None)
+        while True:
+            sent = yield value
+            if not budget.try_withdraw():
+                return
+            value = wait.send(sent)
+
+    return budgeted_wait_gen
+
+
 class SimpleRetrier:
     def __init__(self, *args, **kwargs):
         self._maximum = kwargs.get("max_value")
@@ -21,23 +508,136 @@ class SimpleRetrier:
         self._initial = kwargs.pop("initial", 0)
         self._multiplier = kwargs.get("factor", 1)
         self._kind = kwargs.pop("kind", "on_exception")
+        self._budget = budget = kwargs.pop("budget", None)
+        if budget:
+            args, kwargs = self._with_budget(budget, args, kwargs)
+        self._circuit_breaker = breaker = kwargs.pop("circuit_breaker", None)
+        kwargs["max_time"] = _bounded(self._deadline)
+        raise_errors = self._kind == "on_exception"
+        if raise_errors:
+            giveup = kwargs.get("giveup")
+            kwargs["giveup"] = lambda e: isinstance(e, _FINAL_ERRORS) or bool(
+                giveup and giveup(e)
+            )
+        is_failure = self._failure_predicate(self._kind, args, kwargs)
+        # backoff imports asyncio, hence it is loaded by the first retrier
+        import backoff
+
         fn = getattr(backoff, self._kind)
         assert callable(fn), "Unknown retry method"
-        self._impl = fn(*args, **kwargs)
-        assert callable(self._impl), f"Failed to generate backoff.{self._kind}"
+        decorator = fn(*args, **kwargs)
+        assert callable(decorator), f"Failed to generate backoff.{self._kind}"
 
-    def __call__(self, fn: Callable) -> Callable:
-        fn.__name__ = "retriable_api_request"
+        def before_attempt():
+            _check_deadline()
+            if breaker:
+                breaker.before_call()
 
-        def fn_wrapper(*args, **kwargs):
+        def after_attempt(err: Optional[Exception]):
+            if err is None:
+                if budget:
+                    budget.deposit()
+                if breaker:
+                    breaker.record_success()
+            elif breaker:
+                if is_failure(err):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+        def release_attempt():
+            if breaker:
+                breaker.release_trial()
+
+        def retriable_api_request(fn: Callable, args: tuple, kwargs: dict):
+            before_attempt()
             try:
-                return fn(*args, **kwargs)
+                result = fn(*args, **kwargs)
+            except _FINAL_ERRORS:
+                release_attempt()
+                raise
             except Exception as err:
-                if self._kind == "on_exception":
+                after_attempt(err)
+                if raise_errors:
                     raise err
                 return err
+            except BaseException:
+                # cancellation says nothing about the health of the endpoint
+                release_attempt()
+                raise
+            after_attempt(None)
+            return result
 
-        return self._impl(fn_wrapper)
+        async def async_retriable_api_request(fn: Callable, args: tuple, kwargs: dict):
+            before_attempt()
+            try:
+                result = await fn(*args, **kwargs)
+            except _FINAL_ERRORS:
+                release_attempt()
+                raise
+            except Exception as err:
+                after_attempt(err)
+                if raise_errors:
+                    raise err
+                return err
+            except BaseException:
+                # cancellation says nothing about the health of the endpoint
+                release_attempt()
+                raise
+            after_attempt(None)
+            return result
+
+        # backoff rebinds its handler lists whenever a decorator is applied,
+        # hence each retry loop is generated exactly once per retrier
+        self._impl = decorator(retriable_api_request)
+        self._async_impl = fn(*args, **kwargs)(async_retriable_api_request)
+
+    @staticmethod
+    def _failure_predicate(
+        kind: str, args: tuple, kwargs: dict
+    ) -> Callable[[Exception], bool]:
+        # failures are the errors the retrier would retry on
+        if kind == "on_exception":
+            exception = args[1] if len(args) > 1 else kwargs.get("exception")
+            return lambda err: isinstance(err, exception)  # type: ignore
+        predicate = args[1] if len(args) > 1 else kwargs.get("predicate")
+        return lambda err: bool(predicate(err)) if predicate else True
+
+    @staticmethod
+    def _with_budget(budget: RetryBudget, args: tuple, kwargs: dict):
+        if args:
+            args = (_budgeted(args[0], budget), *args[1:])
+        else:
+            kwargs["wait_gen"] = _budgeted(kwargs["wait_gen"], budget)
+        return args, kwargs
+
+    def __call__(self, fn: Callable) -> Callable:
+        max_time = None if callable(self._deadline) else self._deadline
+        if inspect.iscoroutinefunction(fn):
+            async_impl = self._async_impl
+
+            async def async_fn_wrapper(*args, **kwargs):
+                with deadline(max_time):
+                    result = await async_impl(fn, args, kwargs)
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+            return async_fn_wrapper
+
+        impl = self._impl
+
+        def fn_wrapper(*args, **kwargs):
+            # nested retriers are bound by the max_time of this one
+            with deadline(max_time):
+                result = impl(fn, args, kwargs)
+            # errors which are not retried (anymore) are returned by
+            # on_predicate retry loops and must reach the caller as such
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        return fn_wrapper
 
 
 class ConditionalRetrier(SimpleRetrier):
@@ -56,3 +656,42 @@ class ConditionalRetrier(SimpleRetrier):
         if self._conditional_predicate(*[kwargs[key] for key in self._required_kwargs]):
             return self
         return None
+
+
+class _Immutable:
+    _frozen = False
+
+    def _freeze(self):
+        object.__setattr__(self, "_frozen", True)
+
+    def __setattr__(self, name: str, value: Any):
+        if self._frozen:
+            raise AttributeError(f"{type(self).__name__} is immutable")
+        super().__setattr__(name, value)
+
+
+class RetryPolicy(_Immutable, SimpleRetrier):
+    """Immutable `SimpleRetrier` which is built once and reused across calls.
+
+    The retry loop is generated from the params on construction only, so
+    long-lived owners such as handlers should keep one policy instead of
+    creating a retrier per request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._freeze()
+
+
+class ConditionalRetryPolicy(_Immutable, ConditionalRetrier):
+    """Immutable counterpart of `ConditionalRetrier`, see `RetryPolicy`."""
+
+    def __init__(
+        self,
+        conditional_predicate: Callable,
+        required_kwargs: Sequence,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(conditional_predicate, required_kwargs, *args, **kwargs)
+        self._freeze()
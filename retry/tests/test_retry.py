@@ -1,5 +1,281 @@
-from retry import __version__
+import asyncio
+import time
+
+import pytest  # type: ignore
+
+from retry import (
+    __version__,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    HedgingPolicy,
+    RetryBudget,
+    RetryPolicy,
+    SimpleRetrier,
+    constant,
+    deadline,
+    feedback_handlers,
+    with_handlers,
+)
 
 
 def test_version():
-    assert __version__ == '0.1.0'
+    assert __version__ == '0.2.0'
+
+
+def test_feedback_handlers_report_throttles_and_successes():
+    events = []
+    params = with_handlers(
+        {
+            "kind": "on_predicate",
+            "wait_gen": constant,
+            "interval": 0,
+            "predicate": lambda exc: isinstance(exc, ValueError),
+            "max_tries": 3,
+        },
+        **feedback_handlers(
+            lambda: events.append("success"),
+            lambda: events.append("throttle"),
+            lambda exc: isinstance(exc, ValueError),
+        ),
+    )
+    outcomes = iter([ValueError("429"), ValueError("429"), "ok"])
+
+    def call():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert SimpleRetrier(**params)(call)() == "ok"
+    assert events == ["throttle", "throttle", "success"]
+
+
+def test_retry_policy_is_reusable_and_immutable():
+    backoffs = []
+    policy = RetryPolicy(
+        kind="on_exception",
+        wait_gen=constant,
+        interval=0,
+        exception=ValueError,
+        max_tries=2,
+        on_backoff=backoffs.append,
+    )
+
+    def flaky(attempts=[]):
+        attempts.append(None)
+        if len(attempts) % 2:
+            raise ValueError()
+        return len(attempts)
+
+    for _ in range(100):
+        policy(flaky)()
+    # handlers are configured once, not once per wrapped call
+    assert len(backoffs) == 100
+    with pytest.raises(AttributeError):
+        policy._kind = "on_predicate"
+
+
+def test_retry_budget_fails_fast_once_spent():
+    budget = RetryBudget(ratio=0.5, min_retries_per_second=0.1, ttl=10)
+    policy = RetryPolicy(
+        kind="on_predicate",
+        wait_gen=constant,
+        interval=0,
+        predicate=lambda exc: isinstance(exc, ValueError),
+        max_tries=10,
+        budget=budget,
+    )
+    calls = []
+
+    def failing():
+        calls.append(None)
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        policy(failing)()
+    # the reserve of one retry is spent, the next call is not retried at all
+    assert len(calls) == 2
+    with pytest.raises(ValueError):
+        policy(failing)()
+    assert len(calls) == 3
+    # two successful calls earn one more retry
+    policy(lambda: None)()
+    policy(lambda: None)()
+    assert budget.balance == pytest.approx(1)
+
+
+def test_coroutines_are_retried():
+    policy = RetryPolicy(
+        kind="on_exception",
+        wait_gen=constant,
+        interval=0,
+        exception=ValueError,
+        max_tries=3,
+    )
+    attempts = []
+
+    async def flaky():
+        attempts.append(None)
+        if len(attempts) < 3:
+            raise ValueError()
+        return "ok"
+
+    assert asyncio.run(policy(flaky)()) == "ok"
+    assert len(attempts) == 3
+
+
+def test_backoff_is_cut_to_the_enclosing_deadline():
+    policy = RetryPolicy(
+        kind="on_predicate",
+        wait_gen=constant,
+        interval=10,
+        jitter=None,
+        predicate=lambda exc: isinstance(exc, ValueError),
+        max_time=600,
+    )
+    attempts = []
+
+    def failing():
+        attempts.append(None)
+        raise ValueError()
+
+    start = time.monotonic()
+    with deadline(0.2), pytest.raises(DeadlineExceeded):
+        policy(failing)()
+    assert time.monotonic() - start < 1
+    assert len(attempts) == 1
+
+
+def test_nested_work_is_abandoned_after_the_deadline():
+    inner = RetryPolicy(kind="on_exception", wait_gen=constant, exception=Exception)
+    calls = []
+    with deadline(0.05), pytest.raises(DeadlineExceeded):
+        time.sleep(0.1)
+        inner(lambda: calls.append(None))()
+    assert calls == []
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(
+        failure_rate_threshold=0.5, minimum_calls=2, cooldown=0.05
+    )
+    policy = RetryPolicy(
+        kind="on_predicate",
+        wait_gen=constant,
+        interval=0,
+        predicate=lambda exc: isinstance(exc, ConnectionError),
+        max_tries=2,
+        circuit_breaker=breaker,
+    )
+    calls = []
+
+    def down():
+        calls.append(None)
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        policy(down)()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        policy(down)()
+    assert len(calls) == 2
+
+    time.sleep(0.05)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert policy(lambda: "up")() == "up"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_is_released_without_outcome():
+    breaker = CircuitBreaker(minimum_calls=1, cooldown=0)
+    breaker.record_failure()
+    policy = RetryPolicy(
+        kind="on_exception",
+        wait_gen=constant,
+        interval=0,
+        exception=ConnectionError,
+        max_tries=1,
+        circuit_breaker=breaker,
+    )
+
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    def timed_out():
+        raise DeadlineExceeded()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(policy(cancelled)())
+    with pytest.raises(DeadlineExceeded):
+        policy(timed_out)()
+    # neither call used up the single trial call of the half-open circuit
+    assert policy(lambda: "up")() == "up"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_hedging_takes_the_first_finished_attempt():
+    hedges = []
+    policy = HedgingPolicy(delay=0.05, on_hedge=lambda: hedges.append(None))
+    delays = iter([1.0, 0.0])
+
+    def call():
+        time.sleep(next(delays))
+        return "done"
+
+    start = time.monotonic()
+    assert policy(call)() == "done"
+    assert time.monotonic() - start < 0.5
+    assert len(hedges) == 1
+    policy.shutdown()
+
+
+def test_hedging_skips_hedges_without_permit_and_copies_args():
+    permits = iter([False, True])
+    policy = HedgingPolicy(
+        delay=0.05,
+        on_hedge=lambda items: next(permits),
+        hedge_args=lambda args, kwargs: (([*args[0]],), kwargs),
+        max_workers=2,
+    )
+    delays = iter([0.3, 0.0])
+    target: list = []
+
+    def call(items):
+        time.sleep(next(delays))
+        items.append(None)
+        return items
+
+    result = policy(call)(target)
+    # the hedge started after the second delay only, on a copy of the list
+    assert result is not target and result == [None]
+    policy.shutdown()
+
+
+def test_hedging_times_attempts_from_their_start_and_bounds_hedges():
+    hedges = []
+    policy = HedgingPolicy(
+        delay=0.1,
+        max_workers=1,
+        max_concurrent_hedges=1,
+        on_hedge=lambda: hedges.append(None),
+    )
+    # the first attempt waits for the only worker longer than the delay
+    policy._executor.submit(time.sleep, 0.3)
+    assert policy(lambda: "done")() == "done"
+    assert hedges == [] and max(policy._latencies) < 0.1
+
+    # no backup attempt is started while the hedges running use up the pool
+    policy._hedge_slots.acquire()
+    assert policy(lambda: time.sleep(0.3) or "done")() == "done"
+    assert hedges == []
+    policy.shutdown()
+
+
+def test_hedging_delay_follows_observed_latencies():
+    policy = HedgingPolicy(percentile=50, min_samples=3, initial_delay=5)
+    assert policy.delay == 5
+    for latency in (0.1, 0.2, 0.3):
+        policy._record(latency)
+    assert policy.delay == pytest.approx(0.2)
+    policy.shutdown()